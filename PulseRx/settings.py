@@ -14,6 +14,7 @@ from pathlib import Path
 import os
 from dotenv import load_dotenv
 import dj_database_url
+from celery.schedules import crontab
 
 # Load environment variables from .env file
 load_dotenv()
@@ -59,6 +60,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -98,6 +100,26 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Threads running WebSocket consumer database work (each holds one DB connection)
+WEBSOCKET_DB_WORKERS = int(os.environ.get('WEBSOCKET_DB_WORKERS', '8'))
+
+# Shared cache for the drug catalog, search index versions and dashboard counters.
+# Redis when REDIS_URL is configured so every web process sees the same version
+# tokens, per-process memory otherwise (request profiles are then not kept in the session)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 
 # Database
@@ -192,4 +214,12 @@ LOGIN_URL = '/accounts/login'
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_TIMEZONE = 'America/New_York'
-CELERY_ENABLE_UTC = True
\ No newline at end of file
+CELERY_ENABLE_UTC = True
+
+# Reminders are driven from the database: one tick at the start of every minute fires every due ReminderTime
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-due-reminders': {
+        'task': 'accounts.tasks.dispatch_due_reminders',
+        'schedule': crontab(),
+    },
+}
@@ -1,8 +1,21 @@
 from django.contrib import admin
-from .models import CustomAccount, Message, Notifications, Thread
+from .models import CustomAccount, Message, Notifications, Thread, UnreadCounter
+
+
+class UnreadCounterAdmin(admin.ModelAdmin):
+    """Keeps UnreadCounter in step with unread rows that admin deletes cascade to"""
+
+    def delete_model(self, request, obj):
+        UnreadCounter.uncount_cascade(obj)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        UnreadCounter.uncount_cascade(queryset)
+        super().delete_queryset(request, queryset)
+
 
 # Register your models here.
-admin.site.register(CustomAccount)
-admin.site.register(Message)
-admin.site.register(Thread)
-admin.site.register(Notifications)
\ No newline at end of file
+admin.site.register(CustomAccount, UnreadCounterAdmin)
+admin.site.register(Message, UnreadCounterAdmin)
+admin.site.register(Thread, UnreadCounterAdmin)
+admin.site.register(Notifications, UnreadCounterAdmin)
@@ -1,21 +1,25 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.utils import timezone
 from channels.layers import get_channel_layer
 from django.contrib.auth import get_user_model
-from .models import Message, Thread, Notifications, ReadStatus
-from .utils import send_notification_with_counts
-from asgiref.sync import sync_to_async
+from django.db import transaction
+from .models import Message, Thread, Notifications, ReadStatus, UnreadCounter
+from .presence import HEARTBEAT_INTERVAL, join_thread, leave_thread, thread_viewers
+from .protocol import COMPACT_SUBPROTOCOL, FRAME_BATCH_WINDOW, compact_event, dumps, epoch, legacy_notification
+from .utils import COUNT_PUSH_WINDOW, database_task, group_send_many, send_notification_with_counts, serialize_message, thread_history
 
 User = get_user_model()
 
-active_notification_users = {}
-active_message_users = {}
-
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
         self.current_thread = None
+        self.heartbeat = None
+        self.count_flush = None
+        self.frame_flush = None
+        self.outbox = []
 
         if self.user.is_anonymous:
             await self.close()
@@ -28,19 +32,40 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        active_notification_users[self.user.id] = self
-        await self.accept()
+        # Clients opt into the compact protocol by offering its subprotocol
+        self.compact = COMPACT_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        await self.accept(COMPACT_SUBPROTOCOL if self.compact else None)
     
     async def receive(self, text_data):
         data = json.loads(text_data)
 
         if data.get('type') == 'set_current_thread':
-            self.current_thread = str(data['thread_id'])
-
+            thread_id = str(data['thread_id'])
+            if self.current_thread and self.current_thread != thread_id:
+                await leave_thread(self.current_thread, self.user.id, self.channel_name)
+            self.current_thread = thread_id
+            await join_thread(thread_id, self.user.id, self.channel_name)
+            if self.heartbeat is None:
+                self.heartbeat = asyncio.create_task(self.keep_present())
+
+    async def keep_present(self):
+        # Refresh this connection's presence until it disconnects
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            await join_thread(self.current_thread, self.user.id, self.channel_name)
     
     async def disconnect(self, close_code):
-        if self.user.id in active_notification_users:
-            del active_notification_users[self.user.id]
+        if self.user.is_anonymous:
+            return
+
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+        if self.count_flush is not None:
+            self.count_flush.cancel()
+        if self.frame_flush is not None:
+            self.frame_flush.cancel()
+        if self.current_thread:
+            await leave_thread(self.current_thread, self.user.id, self.channel_name)
             
         await self.channel_layer.group_discard(
             self.group_name,
@@ -51,26 +76,58 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     async def send_notification(self, event):
         notification = event['notification']
 
-        if notification.get("id") == 0:
-            await self.send(text_data=json.dumps({
-                "notification": {
-                    "unread_count": notification["unread_count"],
-                    "unread_messages": notification["unread_messages"],
-                }
-            }))
+        if not notification.get("id"):
+            # Count-only payload: merged into the next coalesced push
+            self.mark_counts_dirty()
             return
         
-        await self.send(text_data=json.dumps({
-            "notification": notification
-        }))
+        await self.push(notification)
+
+    async def push(self, notification):
+        if not self.compact:
+            await self.send(text_data=dumps({
+                "notification": legacy_notification(notification)
+            }))
+            return
+
+        # Compact sockets get every event queued within one window in a single array frame
+        self.outbox.append(compact_event(notification))
+        if self.frame_flush is None:
+            self.frame_flush = asyncio.create_task(self.flush_frame())
+
+    async def flush_frame(self):
+        await asyncio.sleep(FRAME_BATCH_WINDOW)
+        events, self.outbox = self.outbox, []
+        self.frame_flush = None
+        await self.send(text_data=dumps(events))
+
+    async def unread_counts_changed(self, event):
+        self.mark_counts_dirty()
+
+    def mark_counts_dirty(self):
+        # Every change within one window shares a single counter read and frame
+        if self.count_flush is None:
+            self.count_flush = asyncio.create_task(self.flush_counts())
+
+    async def flush_counts(self):
+        await asyncio.sleep(COUNT_PUSH_WINDOW)
+        # Changes arriving while the counters are read schedule the next flush
+        self.count_flush = None
+        unread_count, unread_messages = await self.get_counts()
+        await self.push({
+            "unread_count": unread_count,
+            "unread_messages": unread_messages,
+        })
+
+    @database_task
+    def get_counts(self):
+        return UnreadCounter.get_counts(self.user)
 
 
 class MessageConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"] 
 
-        active_message_users[self.user.id] = self
-
         self.current_thread = None
         self.thread_id = self.scope['url_route']['kwargs']['thread_id']
         self.room_group_name = f'thread_{self.thread_id}'
@@ -83,9 +140,6 @@ class MessageConsumer(AsyncWebsocketConsumer):
         await self.accept()
     
     async def disconnect(self, close_code):
-        if self.user.id in active_message_users:
-            del active_message_users[self.user.id]
-
         await self.channel_layer.group_discard(
             self.room_group_name, 
             self.channel_name
@@ -99,6 +153,10 @@ class MessageConsumer(AsyncWebsocketConsumer):
                 self.current_thread = str(data["thread_id"])
                 return
 
+            if data.get("type") == "history":
+                await self.send(text_data=json.dumps(await self.get_history(data.get("cursor"))))
+                return
+
             content = data.get('content')
             if not content:
                 print("ERROR: No content in message")
@@ -108,59 +166,48 @@ class MessageConsumer(AsyncWebsocketConsumer):
 
             thread = await self.get_thread(self.thread_id)
 
-            message, notifications = await self.create_message(thread, user, content)
+            # Presence comes from Redis, so look it up while the message row is written
+            message, viewing = await asyncio.gather(
+                self.create_message(thread, user, content),
+                thread_viewers(thread.id),
+            )
+            sender_name = f"{user.first_name} {user.last_name}"
+            timestamp = timezone.localtime(message.timestamp).strftime("%b %d, %I:%M %p")
 
+            # Echo to the thread first so chat latency does not depend on the participant count
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
                     'type': 'chat_message',
                     'id': message.id,
                     'message': content,
-                    'sender': f"{user.first_name} {user.last_name}",
-                    'timestamp': timezone.localtime(message.timestamp).strftime("%b %d, %I:%M %p"),
+                    'sender': sender_name,
+                    'timestamp': timestamp,
                 }
             )
 
-            other_participants = await self.get_other_participants(thread, user)
-            channel_layer = get_channel_layer()
-
-            # Process notifications for each participant
-            for participant in other_participants:
-                try:
-                    notification_obj = next((n for n in notifications if n.user == participant), None)
-
-                    # Get unread counts for this participant
-                    unread_count = await self.get_unread_count(participant)
-                    unread_messages = await self.get_unread_messages(participant)
-
-                    notification_data = {
-                        "id": notification_obj.id if notification_obj else 0,
-                        "unread_count": unread_count,
-                        "unread_messages": unread_messages,
+            payloads = await self.record_delivery(thread, message, user, viewing)
+
+            for participant_id, notification_data in payloads:
+                notification_data.update({
+                    "thread_id": thread.id,
+                    "message_id": message.id,
+                    "sender": sender_name,
+                    "content": message.content,
+                    "time": epoch(message.timestamp),
+                    "is_read": False,
+                })
+
+            await group_send_many(self.channel_layer, [
+                (
+                    f"user_{participant_id}",
+                    {
+                        "type": "send_notification",
+                        "notification": notification_data
                     }
-
-                    if notification_obj:
-                        notification_data.update({
-                            "thread_id": thread.id,
-                            "message_id": message.id,
-                            "sender": f"{user.first_name} {user.last_name}",
-                            "content": message.content,
-                            "timestamp": timezone.localtime(message.timestamp).strftime("%b %d, %I:%M %p"),
-                            "is_read": False,
-                        })
-
-                    await channel_layer.group_send(
-                        f"user_{participant.id}",
-                        {
-                            "type": "send_notification",
-                            "notification": notification_data
-                        }
-                    )
-
-                except Exception as participant_error:
-                    print(f"ERROR processing participant {participant.id}: {participant_error}")
-                    import traceback
-                    traceback.print_exc()
+                )
+                for participant_id, notification_data in payloads
+            ])
         except Exception as e:
             print(f"ERROR in MessageConsumer.receive: {e}")
             import traceback
@@ -179,9 +226,10 @@ class MessageConsumer(AsyncWebsocketConsumer):
             import traceback
             traceback.print_exc()
         
-    async def get_thread(self, thread_id):
+    @database_task
+    def get_thread(self, thread_id):
         try:
-            return await Thread.objects.aget(id=thread_id)
+            return Thread.objects.get(id=thread_id)
         except Thread.DoesNotExist:
             print(f"ERROR: Thread {thread_id} does not exist")
             raise
@@ -189,40 +237,67 @@ class MessageConsumer(AsyncWebsocketConsumer):
             print(f"ERROR in get_thread: {e}")
             raise
     
-    @sync_to_async
-    def get_other_participants(self, thread, user):
-        return list(thread.participant.exclude(id=user.id))
-
-    @sync_to_async
+    @database_task
+    def get_history(self, cursor):
+        """One page of older messages for this socket, in the shape of the thread_messages view"""
+        user = self.scope["user"]
+        if not Thread.objects.filter(id=self.thread_id, participant=user).exists():
+            return {"type": "history", "error": "Thread not found"}
+        try:
+            messages, next_cursor = thread_history(user, self.thread_id, cursor or None)
+        except ValueError:
+            return {"type": "history", "error": "Invalid cursor"}
+        return {
+            "type": "history",
+            "messages": [serialize_message(message, user) for message in messages],
+            "next_cursor": next_cursor,
+        }
+
+    @database_task
     def create_message(self, thread, sender, content):
-        message = Message.objects.create(
+        return Message.objects.create(
             thread=thread,
             sender=sender,
             content=content,
             timestamp=timezone.now(),
         )
 
-        notifications = []
-        participants = thread.participant.exclude(id=sender.id)
-
-        for participant in participants:
-            notif_ws = active_notification_users.get(participant.id)
-            is_viewing_thread = notif_ws and getattr(notif_ws, "current_thread", None) == str(thread.id)
-            if is_viewing_thread:
-                ReadStatus.objects.create(message=message, user=participant, read=True)
-            else:
-                ReadStatus.objects.create(message=message, user=participant, read=False)
-                noti = Notifications.objects.create(user=participant, message=message,is_read=False)
-                notifications.append(noti)
-
-        return message, notifications
-
-    @sync_to_async
-    def get_unread_count(self, user):
-        return Notifications.objects.filter(user=user, is_read=False).count()
-
-    @sync_to_async
-    def get_unread_messages(self, user):
-        return ReadStatus.objects.filter(user=user, read=False).count()
-    
-
+    @database_task
+    def record_delivery(self, thread, message, sender, viewing):
+        """
+        Create every participant's ReadStatus and Notifications row for a new message.
+
+        Both sets are written with one bulk_create each inside a single transaction,
+        and the unread counters are shifted in one UPDATE since bulk_create skips
+        the post_save receivers.
+
+        Args:
+            viewing: set of user ids with a connection viewing the thread, from thread_viewers
+
+        Returns:
+            list of (participant id, notification payload) tuples for the participants
+            not viewing the thread; viewers' counts are unchanged so they get no push
+        """
+        participant_ids = list(thread.participant.exclude(id=sender.id).values_list('id', flat=True))
+        unread = [participant_id for participant_id in participant_ids if participant_id not in viewing]
+
+        with transaction.atomic():
+            ReadStatus.objects.bulk_create([
+                ReadStatus(message=message, user_id=participant_id, read=participant_id in viewing)
+                for participant_id in participant_ids
+            ])
+            notifications = Notifications.objects.bulk_create([
+                Notifications(user_id=participant_id, message=message, is_read=False)
+                for participant_id in unread
+            ])
+            UnreadCounter.adjust_many(unread, notifications=1, messages=1)
+            counts = UnreadCounter.get_counts_many(unread)
+
+        return [
+            (notification.user_id, {
+                "id": notification.id,
+                "unread_count": counts[notification.user_id][0],
+                "unread_messages": counts[notification.user_id][1],
+            })
+            for notification in notifications
+        ]
@@ -1,20 +1,18 @@
-from .models import Notifications, ReadStatus
+from .models import UnreadCounter
+from .utils import notification_page
 
 def notification_display(request):
     if request.user.is_authenticated:
-        notifications = Notifications.objects.filter(user=request.user).order_by('-time')
-        unread_count = notifications.filter(is_read=False).count()
+        # Only the newest page is rendered; older ones are fetched on scroll
+        notifications, notifications_cursor = notification_page(request.user)
 
-     
-        unread_messages = ReadStatus.objects.filter(
-            user=request.user,
-            read=False
-        ).exclude(
-            message__sender__role='system'
-        ).count()
+        # System messages never get ReadStatus rows, so the counter matches
+        # the old "exclude system sender" count
+        unread_count, unread_messages = UnreadCounter.get_counts(request.user)
 
         return {
             'notifications': notifications,
+            'notifications_cursor': notifications_cursor,
             'unread_count': unread_count,
             'unread_messages': unread_messages
         }
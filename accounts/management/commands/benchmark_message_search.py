@@ -0,0 +1,149 @@
+"""
+Management command that loads a large synthetic message history and reports
+message search latency percentiles for Message.objects.search.
+
+Usage:
+    python manage.py benchmark_message_search [--messages 1000000] [--threads 500] [--queries 200] [--baseline] [--keep]
+"""
+import random
+import statistics
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from accounts.models import Message, Thread
+from pharmacy.seeding import delete_seeded, seed_pharmacy
+
+VOCABULARY = [
+    'refill', 'prescription', 'pickup', 'ready', 'dosage', 'amoxicillin', 'ibuprofen', 'lisinopril',
+    'metformin', 'atorvastatin', 'insurance', 'copay', 'pharmacy', 'question', 'side', 'effects',
+    'morning', 'evening', 'tablet', 'capsule', 'allergy', 'reminder', 'appointment', 'doctor',
+    'delivery', 'stock', 'generic', 'brand', 'thanks', 'please', 'tomorrow', 'today', 'weekend',
+    'headache', 'nausea', 'dizziness', 'blood', 'pressure', 'sugar', 'cholesterol', 'antibiotic',
+    'inhaler', 'cream', 'drops', 'syrup', 'injection', 'vaccine', 'flu', 'covid', 'schedule',
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Latency benchmark for full-text message search over a large message history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1_000_000, help='Number of synthetic messages to load')
+        parser.add_argument('--threads', type=int, default=500, help='Number of threads the messages are spread over')
+        parser.add_argument('--queries', type=int, default=200, help='Number of timed searches')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+        parser.add_argument('--baseline', action='store_true', help='Also time the previous content__icontains scan')
+        parser.add_argument('--keep', action='store_true', help='Leave the synthetic data in place afterwards')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for content and queries')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = f'bench_search_{uuid.uuid4().hex[:8]}'
+
+        try:
+            # One patient and the pharmacy admin; the message history is loaded below
+            seeded = seed_pharmacy(0, prefix, {
+                'pharmacists': 0, 'patients': 1, 'drugs': 1, 'prescriptions': 0, 'messages': 0, 'notifications': 0,
+            }, seed=options['seed'], password='!')
+            staff = seeded['pharmacy'].user
+            patient = seeded['pharmacy'].patients.get().user
+
+            threads = self.load(rng, patient, staff, options)
+            queries = self.build_queries(rng, options['queries'])
+
+            self.stdout.write(f'Backend: {connection.vendor}')
+            self.report('search', self.time_queries(
+                queries, lambda q: list(Message.objects.filter(thread__participant=patient).search(q))
+            ))
+            if options['baseline']:
+                self.report('icontains (baseline)', self.time_queries(
+                    queries, lambda q: list(Message.objects.filter(
+                        thread__in=Thread.objects.filter(participant=patient), content__icontains=q
+                    ))
+                ))
+        finally:
+            if options['keep']:
+                self.stdout.write(self.style.WARNING(f'Kept synthetic data for users prefixed {prefix}_'))
+            else:
+                self.cleanup(prefix)
+
+    def load(self, rng, patient, staff, options):
+        total = options['messages']
+        batch_size = options['batch_size']
+
+        threads = Thread.objects.bulk_create([Thread() for _ in range(options['threads'])])
+        through = Thread.participant.through
+        through.objects.bulk_create(
+            [through(thread_id=t.id, customaccount_id=user.id) for t in threads for user in (patient, staff)]
+        )
+
+        started = time.perf_counter()
+        created = 0
+        while created < total:
+            size = min(batch_size, total - created)
+            with transaction.atomic():
+                Message.objects.bulk_create([
+                    Message(
+                        sender=rng.choice((patient, staff)),
+                        thread=rng.choice(threads),
+                        content=' '.join(rng.choices(VOCABULARY, k=rng.randint(4, 16))),
+                    )
+                    for _ in range(size)
+                ])
+            created += size
+            if created % (batch_size * 20) == 0 or created == total:
+                self.stdout.write(f'Loaded {created:,} / {total:,} messages')
+
+        self.stdout.write(f'Load time: {time.perf_counter() - started:.1f}s')
+        return threads
+
+    def build_queries(self, rng, count):
+        queries = []
+        for i in range(count):
+            kind = i % 3
+            if kind == 0:
+                queries.append(rng.choice(VOCABULARY))
+            elif kind == 1:
+                queries.append(' '.join(rng.sample(VOCABULARY, 2)))
+            else:
+                # Partially typed word, as sent by the search-as-you-type box
+                queries.append(rng.choice(VOCABULARY)[:4])
+        return queries
+
+    def time_queries(self, queries, run):
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            run(query)
+            samples.append((time.perf_counter() - started) * 1000)
+        return samples
+
+    def report(self, label, samples):
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: {len(samples)} queries, '
+            f'p50 {percentile(samples, 50):.1f}ms, '
+            f'p95 {percentile(samples, 95):.1f}ms, '
+            f'p99 {percentile(samples, 99):.1f}ms, '
+            f'max {max(samples):.1f}ms, '
+            f'mean {statistics.mean(samples):.1f}ms'
+        ))
+
+    def cleanup(self, prefix):
+        thread_ids = list(
+            Thread.objects.filter(participant__username__startswith=f'{prefix}_').distinct().values_list('id', flat=True)
+        )
+        # Synthetic messages have no read statuses or notifications, so delete them in SQL
+        # instead of loading a million rows into the deletion collector
+        with connection.cursor() as cursor:
+            for start in range(0, len(thread_ids), 100):
+                batch = thread_ids[start:start + 100]
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f'DELETE FROM {Message._meta.db_table} WHERE thread_id IN ({placeholders})', batch)
+        delete_seeded(prefix)
+        self.stdout.write('Removed synthetic benchmark data')
@@ -0,0 +1,127 @@
+"""
+Management command that seeds a large synthetic dataset, runs EXPLAIN on the
+queries behind the hot views and fails unless each one is answered from the
+index added for it. A table with fewer than SMALL_TABLE rows may be scanned
+instead: on so few rows, or when the seeded pharmacy holds every row of it,
+the planner rightly prefers a scan.
+
+Usage:
+    python manage.py explain_hot_queries [--pharmacies 20] [--patients 50] [--per-patient 20] [--keep] [--verbose]
+"""
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from accounts.models import Message, Notifications, ReadStatus, Thread
+from patients.models import MedicationReminder, PatientProfile
+from pharmacy.models import Drug, PharmacistProfile, Prescription
+from pharmacy.seeding import delete_seeded, seed_pharmacy
+
+# Below this many rows a scan is an acceptable plan
+SMALL_TABLE = 1000
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot view queries on a seeded dataset and check they use their indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pharmacies', type=int, default=20, help='Number of synthetic pharmacies')
+        parser.add_argument('--patients', type=int, default=50, help='Patients per pharmacy')
+        parser.add_argument('--per-patient', type=int, default=20,
+                            help='Messages, notifications and prescriptions per patient')
+        parser.add_argument('--keep', action='store_true', help='Leave the synthetic data in place afterwards')
+        parser.add_argument('--verbose', action='store_true', help='Print every query plan')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the dataset')
+
+    def handle(self, *args, **options):
+        prefix = f'explain_{uuid.uuid4().hex[:8]}'
+
+        try:
+            target = self.seed(prefix, options)
+            self.analyze()
+            failures = []
+            self.stdout.write(f'Backend: {connection.vendor}')
+            for label, queryset, indexes in self.hot_queries(target):
+                plan = queryset.explain()
+                used = [name for name in indexes if name in plan]
+                rows = queryset.model.objects.count()
+                if used:
+                    self.stdout.write(self.style.SUCCESS(f'{label}: {used[0]}'))
+                elif rows < SMALL_TABLE:
+                    self.stdout.write(self.style.WARNING(
+                        f'{label}: not using {" or ".join(indexes)}, accepted with only {rows:,} rows'
+                    ))
+                else:
+                    failures.append(label)
+                    self.stdout.write(self.style.ERROR(f'{label}: expected {" or ".join(indexes)}'))
+                if options['verbose'] or not used:
+                    self.stdout.write(plan)
+        finally:
+            if options['keep']:
+                self.stdout.write(self.style.WARNING(f'Kept synthetic data for users prefixed {prefix}_'))
+            else:
+                delete_seeded(prefix)
+                self.stdout.write('Removed synthetic data')
+
+        if failures:
+            raise CommandError(f'{len(failures)} hot queries do not use their index: {", ".join(failures)}')
+
+    def hot_queries(self, target):
+        """(label, queryset, acceptable index names) mirroring the queries of the hot views"""
+        today = timezone.now().date()
+        user, patient, pharmacy, thread = target['user'], target['patient'], target['pharmacy'], target['thread']
+        return [
+            ('notification dropdown', Notifications.objects.for_dropdown(user)[:21],
+             ['notification_user_time_idx']),
+            ('unread notification count', Notifications.objects.filter(user_id__in=[user.id], is_read=False)
+             .values('user').annotate(total=Count('id')), ['notification_user_unread_idx']),
+            ('unread message count', ReadStatus.objects.filter(user_id__in=[user.id], read=False)
+             .values('user').annotate(total=Count('id')), ['readstatus_user_unread_idx']),
+            ('thread history', Message.objects.filter(thread=thread).order_by('-timestamp', '-id')[:51],
+             ['message_thread_history_idx']),
+            ('stock alerts', Drug.objects.filter(pharmacy=pharmacy, status__in=['out_of_stock', 'low_stock']),
+             ['drug_pharmacy_status_idx']),
+            ('recent prescriptions', Prescription.objects.filter(
+                prescribed_by__pharmacy=pharmacy, expiration_date__gt=today
+            ).order_by('-prescribed_on')[:20], ['rx_prescriber_recent_idx', 'rx_refill_pending_idx']),
+            ('refill requests', Prescription.objects.filter(
+                prescribed_by__pharmacy=pharmacy, refill_pending=True, expiration_date__gt=today
+            ).order_by('-prescribed_on')[:20], ['rx_refill_pending_idx']),
+            ('active reminders', MedicationReminder.objects.filter(user=patient, is_archived=False, is_active=True),
+             ['reminder_user_state_idx']),
+        ]
+
+    def seed(self, prefix, options):
+        per_patient = options['per_patient']
+        sizes = {
+            'pharmacists': 5, 'drugs': 100, 'patients': options['patients'],
+            'prescriptions': per_patient, 'messages': per_patient, 'notifications': per_patient,
+        }
+        totals = {}
+        for index in range(options['pharmacies']):
+            counts = seed_pharmacy(index, prefix, sizes, seed=options['seed'], password='!')
+            if index == 0:
+                pharmacy = counts['pharmacy']
+            for name, count in counts.items():
+                if name != 'pharmacy':
+                    totals[name] = totals.get(name, 0) + count
+
+        self.stdout.write(f'Seeded {totals["users"]:,} users, {totals["prescriptions"]:,} prescriptions, '
+                          f'{totals["messages"]:,} messages and {totals["notifications"]:,} notifications')
+        patient = PatientProfile.objects.filter(pharmacy=pharmacy).select_related('user').order_by('id').first()
+        return {
+            'user': patient.user,
+            'patient': patient,
+            'pharmacy': pharmacy,
+            'thread': Thread.objects.filter(participant=patient.user).order_by('id').first(),
+        }
+
+    def analyze(self):
+        # Planner statistics for the freshly loaded rows
+        tables = [model._meta.db_table for model in (
+            Notifications, ReadStatus, Message, Drug, Prescription, MedicationReminder, PharmacistProfile,
+        )]
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(table)}')
@@ -0,0 +1,109 @@
+"""
+Management command that drives MessageConsumer through in-process WebSocket
+connections and reports message throughput as the number of concurrent
+sockets grows.
+
+Every concurrency level is one seeded pharmacy: each socket is a patient in
+its own thread with the pharmacy admin and --participants pharmacists, and it
+sends --messages messages, waiting for each chat echo before sending the next.
+
+Usage:
+    python manage.py loadtest_websockets [--sockets 1 4 16 32] [--messages 20] [--participants 5] [--workers 8] [--redis]
+"""
+import asyncio
+import time
+import uuid
+from channels.layers import channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from accounts.models import Thread
+from accounts.routing import websocket_urlpatterns
+from accounts.utils import configure_database_executor
+from pharmacy.seeding import delete_seeded, seed_pharmacy
+
+
+class Command(BaseCommand):
+    help = 'WebSocket chat throughput at increasing numbers of concurrent sockets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, nargs='+', default=[1, 4, 16, 32], help='Concurrency levels to run')
+        parser.add_argument('--messages', type=int, default=20, help='Messages sent per socket')
+        parser.add_argument('--participants', type=int, default=5, help='Pharmacists in every thread besides the admin')
+        parser.add_argument('--workers', type=int, default=settings.WEBSOCKET_DB_WORKERS,
+                            help='Consumer database pool size (1 reproduces the old single-thread path)')
+        parser.add_argument('--redis', action='store_true', help='Use the configured channel layer instead of an in-memory one')
+
+    def handle(self, *args, **options):
+        if not options['redis']:
+            settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            channel_layers.backends.clear()
+
+        configure_database_executor(options['workers'])
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite serializes writers, so throughput will not scale with --workers; '
+                'run against PostgreSQL to measure the pool'
+            ))
+        prefix = f'loadtest_{uuid.uuid4().hex[:8]}'
+
+        try:
+            self.stdout.write(f"Pool workers: {options['workers']}, "
+                              f"{options['messages']} messages per socket, {options['participants'] + 1} staff per thread")
+
+            baseline = None
+            for index, sockets in enumerate(options['sockets']):
+                senders, threads = self.seed(prefix, index, sockets, options['participants'])
+                elapsed, latencies = asyncio.run(self.run_level(senders, threads, options['messages']))
+                total = sockets * options['messages']
+                throughput = total / elapsed
+                baseline = baseline or throughput
+                latencies.sort()
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                self.stdout.write(self.style.SUCCESS(
+                    f'{sockets:>4} sockets: {total:>6} messages in {elapsed:6.2f}s, '
+                    f'{throughput:8.1f} msg/s ({throughput / baseline:4.1f}x), echo p95 {p95:.1f}ms'
+                ))
+        finally:
+            delete_seeded(prefix)
+            self.stdout.write('Removed load test data')
+
+    def seed(self, prefix, index, sockets, participants):
+        """One pharmacy with a patient per socket and empty threads; returns (senders, threads)"""
+        pharmacy = seed_pharmacy(index, prefix, {
+            'pharmacists': participants, 'patients': sockets, 'drugs': 1,
+            'prescriptions': 0, 'messages': 0, 'notifications': 0,
+        }, password='!')['pharmacy']
+        senders = [patient.user for patient in pharmacy.patients.select_related('user').order_by('id')]
+        threads = [Thread.objects.filter(participant=sender).get() for sender in senders]
+        return senders, threads
+
+    async def run_level(self, senders, threads, messages):
+        application = URLRouter(websocket_urlpatterns)
+        communicators = []
+        for sender, thread in zip(senders, threads):
+            communicator = WebsocketCommunicator(application, f'/ws/messages/{thread.id}/')
+            communicator.scope['user'] = sender
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError(f'Socket for thread {thread.id} was rejected')
+            communicators.append(communicator)
+
+        latencies = []
+
+        async def chat(communicator, index):
+            for n in range(messages):
+                started = time.perf_counter()
+                await communicator.send_json_to({'content': f'load test message {index}-{n}'})
+                await communicator.receive_json_from(timeout=30)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(chat(communicator, i) for i, communicator in enumerate(communicators)))
+        elapsed = time.perf_counter() - started
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        return elapsed, latencies
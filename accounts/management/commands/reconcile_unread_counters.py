@@ -0,0 +1,87 @@
+"""
+Management command to repair drift in the denormalized unread counters.
+
+Usage:
+    python manage.py reconcile_unread_counters [--user ID] [--dry-run]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.models import CustomAccount, UnreadCounter
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Recompute UnreadCounter rows from Notifications and ReadStatus and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='Only reconcile the counters of this user ID'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drift without writing any changes'
+        )
+
+    def handle(self, *args, **options):
+        users = CustomAccount.objects.order_by('id')
+        if options['user']:
+            users = users.filter(id=options['user'])
+        user_ids = list(users.values_list('id', flat=True))
+
+        created = repaired = 0
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            batch_created, batch_repaired = self.reconcile_batch(
+                user_ids[start:start + BATCH_SIZE], options['dry_run']
+            )
+            created += batch_created
+            repaired += batch_repaired
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f'Dry run: {created} missing and {repaired} drifted counters found'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Created {created} and repaired {repaired} unread counters'
+            ))
+
+    def reconcile_batch(self, user_ids, dry_run):
+        """Reconcile one batch of users, returning (created, repaired)"""
+        with transaction.atomic():
+            # Locking the rows holds back F() adjustments until the fix is written,
+            # so no increment can land between reading a counter and correcting it
+            existing = {
+                counter.user_id: counter
+                for counter in UnreadCounter.objects.select_for_update().filter(user_id__in=user_ids)
+            }
+            # One grouped query per source table instead of a COUNT(*) per user
+            actual = UnreadCounter.count_unread(user_ids)
+
+            to_create = []
+            # (notification delta, message delta) -> user ids, so equal fixes share one UPDATE
+            deltas = {}
+            for user_id in user_ids:
+                notifications, messages = actual[user_id]
+                counter = existing.get(user_id)
+
+                if counter is None:
+                    to_create.append(UnreadCounter(user_id=user_id, notifications=notifications, messages=messages))
+                elif counter.notifications != notifications or counter.messages != messages:
+                    self.stdout.write(
+                        f'User {user_id}: notifications {counter.notifications} -> {notifications}, '
+                        f'messages {counter.messages} -> {messages}'
+                    )
+                    delta = (notifications - counter.notifications, messages - counter.messages)
+                    deltas.setdefault(delta, []).append(user_id)
+
+            if not dry_run:
+                UnreadCounter.objects.bulk_create(to_create, ignore_conflicts=True)
+                # Relative updates, so nothing written since the rows were read is overwritten
+                for (notifications, messages), delta_user_ids in deltas.items():
+                    UnreadCounter.adjust_many(delta_user_ids, notifications=notifications, messages=messages)
+
+        return len(to_create), sum(len(ids) for ids in deltas.values())
@@ -0,0 +1,18 @@
+from .profiles import resolve_profiles
+
+
+class ProfileMiddleware:
+    """
+    Attach the signed-in user's profiles to the request.
+
+    request.pharmacist - PharmacistProfile of pharmacists and pharmacy admins
+    request.pharmacy - PharmacyProfile the user works for (None for patients)
+    request.patient_profile - PatientProfile of patients, with .pharmacy loaded
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.pharmacist, request.pharmacy, request.patient_profile = resolve_profiles(request)
+        return self.get_response(request)
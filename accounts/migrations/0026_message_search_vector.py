@@ -0,0 +1,85 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:10
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRES_FORWARDS = [
+    """
+    CREATE OR REPLACE FUNCTION pharmacy_message_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := to_tsvector('english', coalesce(NEW.content, ''));
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER pharmacy_message_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON pharmacy_message
+    FOR EACH ROW EXECUTE FUNCTION pharmacy_message_search_vector_update()
+    """,
+    "UPDATE pharmacy_message SET search_vector = to_tsvector('english', coalesce(content, ''))",
+    "CREATE INDEX pharmacy_message_search_vector_gin ON pharmacy_message USING gin (search_vector)",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS pharmacy_message_search_vector_gin",
+    "DROP TRIGGER IF EXISTS pharmacy_message_search_vector_trigger ON pharmacy_message",
+    "DROP FUNCTION IF EXISTS pharmacy_message_search_vector_update()",
+]
+
+# External-content FTS5 table kept in sync with pharmacy_message by triggers
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE pharmacy_message_fts USING fts5(content, content='pharmacy_message', content_rowid='id')",
+    """
+    CREATE TRIGGER pharmacy_message_fts_insert AFTER INSERT ON pharmacy_message BEGIN
+        INSERT INTO pharmacy_message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER pharmacy_message_fts_delete AFTER DELETE ON pharmacy_message BEGIN
+        INSERT INTO pharmacy_message_fts(pharmacy_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER pharmacy_message_fts_update AFTER UPDATE OF content ON pharmacy_message BEGIN
+        INSERT INTO pharmacy_message_fts(pharmacy_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO pharmacy_message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO pharmacy_message_fts(pharmacy_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS pharmacy_message_fts_insert",
+    "DROP TRIGGER IF EXISTS pharmacy_message_fts_delete",
+    "DROP TRIGGER IF EXISTS pharmacy_message_fts_update",
+    "DROP TABLE IF EXISTS pharmacy_message_fts",
+]
+
+
+def run_vendor_sql(postgres, sqlite):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        statements = postgres if vendor == 'postgresql' else sqlite if vendor == 'sqlite' else []
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0025_notificationevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            run_vendor_sql(POSTGRES_FORWARDS, SQLITE_FORWARDS),
+            run_vendor_sql(POSTGRES_BACKWARDS, SQLITE_BACKWARDS),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0026_message_search_vector'),
+        ('pharmacy', '0017_drug_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['thread', 'timestamp', 'id'], name='message_thread_history_idx'),
+        ),
+    ]
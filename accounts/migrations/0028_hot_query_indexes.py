@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0027_message_thread_history_index'),
+        ('patients', '0022_patientprofile_name_trigram_indexes'),
+        ('pharmacy', '0017_drug_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notifications',
+            index=models.Index(fields=['user', '-time', '-id'], name='notification_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notifications',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user'], name='notification_user_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='readstatus',
+            index=models.Index(condition=models.Q(('read', False)), fields=['user', 'message'], name='readstatus_user_unread_idx'),
+        ),
+        migrations.AlterField(
+            model_name='notifications',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
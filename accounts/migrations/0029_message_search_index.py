@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-18 16:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0028_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchIndex',
+            fields=[
+                ('message', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='accounts.message')),
+                ('content', models.TextField()),
+            ],
+            options={
+                'db_table': 'pharmacy_message_fts',
+                'managed': False,
+            },
+        ),
+    ]
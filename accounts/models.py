@@ -1,5 +1,14 @@
+import operator
+import re
+from functools import reduce
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db import connection, models, router
+from django.db.models import Count, F, Q
+from django.db.models.deletion import Collector
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 
 class CustomAccount(AbstractUser):
     ROLE_CHOICES = (
@@ -26,6 +35,45 @@ class Thread(models.Model):
         """Get all participants in the thread except the current user"""
         return self.participant.exclude(id=current_user.id)
 
+# Maximum number of hits returned by a message search
+MESSAGE_SEARCH_LIMIT = 20
+
+# SQLite FTS5 table mirroring pharmacy_message.content (see migration 0026)
+MESSAGE_FTS_TABLE = 'pharmacy_message_fts'
+
+
+class MessageQuerySet(models.QuerySet):
+    def search(self, query, limit=MESSAGE_SEARCH_LIMIT):
+        """
+        Ranked full-text search over message content, best match first.
+
+        Every word in the query must match, as a prefix, so results keep
+        narrowing while the user types. PostgreSQL uses the GIN-indexed
+        search_vector column and SQLite uses the FTS5 shadow table.
+        """
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return self.none()
+
+        if connection.vendor == 'postgresql':
+            search_query = SearchQuery(' & '.join(f"{term}:*" for term in terms), config='english', search_type='raw')
+            return self.filter(search_vector=search_query).annotate(
+                rank=SearchRank(F('search_vector'), search_query)
+            ).order_by('-rank', '-timestamp')[:limit]
+
+        if connection.vendor == 'sqlite':
+            match = ' '.join(f'"{term}"*' for term in terms)
+            # Joining the FTS table lets MATCH drive the lookup; bm25() is lower for better matches
+            return self.filter(search_index__content__match=match).annotate(
+                rank=RawSQL(f"bm25({MESSAGE_FTS_TABLE})", [], output_field=models.FloatField())
+            ).order_by('rank', '-timestamp')[:limit]
+
+        # Other backends have no full-text index, fall back to a bounded scan
+        messages = self
+        for term in terms:
+            messages = messages.filter(content__icontains=term)
+        return messages.order_by('-timestamp')[:limit]
+
 class Message(models.Model):
 
      
@@ -45,9 +93,39 @@ class Message(models.Model):
     refill_fulfilled = models.BooleanField(null=True, blank=True, default=None)
     drug = models.ForeignKey('pharmacy.Drug', null=True, blank=True, on_delete=models.CASCADE)
     resupply_fulfilled = models.BooleanField(null=True, blank=True, default=None)
+    # Maintained by a database trigger on PostgreSQL, unused elsewhere
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = MessageQuerySet.as_manager()
     
     class Meta:
         db_table = 'pharmacy_message' 
+        indexes = [
+            # Keyset pagination of a thread's history (see accounts.utils.thread_history)
+            models.Index(fields=['thread', 'timestamp', 'id'], name='message_thread_history_idx'),
+        ]
+
+class FullTextMatch(models.Lookup):
+    """SQLite FTS5 `column MATCH query`"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", [*lhs_params, *rhs_params]
+
+class MessageSearchIndex(models.Model):
+    """The SQLite FTS5 table over Message.content, created and kept in sync by migration 0026"""
+    message = models.OneToOneField(
+        Message, primary_key=True, db_column='rowid', related_name='search_index', on_delete=models.DO_NOTHING
+    )
+    content = models.TextField()
+
+    class Meta:
+        managed = False
+        db_table = MESSAGE_FTS_TABLE
+
+MessageSearchIndex._meta.get_field('content').register_lookup(FullTextMatch)
 
 class ReadStatus(models.Model):
     message = models.ForeignKey('Message', on_delete=models.CASCADE, related_name='read_statuses')
@@ -56,6 +134,10 @@ class ReadStatus(models.Model):
 
     class Meta:
         unique_together = ('message', 'user')
+        indexes = [
+            # UnreadCounter.count_unread and thread_view only look at unread rows
+            models.Index(fields=['user', 'message'], condition=models.Q(read=False), name='readstatus_user_unread_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name} - {self.message.id} - {'Read' if self.read else 'Unread'}"
@@ -63,8 +145,17 @@ class ReadStatus(models.Model):
 
 
 
+class NotificationQuerySet(models.QuerySet):
+    def for_dropdown(self, user):
+        """Newest-first notifications with every FK the dropdown renders loaded in one pass"""
+        return self.filter(user=user).select_related(
+            'message__sender',
+            'reminder__prescription__medicine',
+        ).order_by('-time', '-id')
+
 class Notifications(models.Model):
-    user = models.ForeignKey(CustomAccount, on_delete=models.CASCADE, related_name='notifications')
+    # Indexed as the prefix of notification_user_time_idx
+    user = models.ForeignKey(CustomAccount, on_delete=models.CASCADE, related_name='notifications', db_index=False)
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='messages', blank=True, null=True)
     reminder = models.ForeignKey('patients.MedicationReminder', on_delete=models.CASCADE, related_name='reminders', blank=True, null=True)
     content = models.TextField(blank=True, null=True)
@@ -72,4 +163,170 @@ class Notifications(models.Model):
     prescription = models.ForeignKey('pharmacy.Prescription', on_delete=models.CASCADE, blank=True, null=True)
     drug = models.ForeignKey('pharmacy.Drug', on_delete=models.CASCADE, blank=True, null=True)
     time = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
\ No newline at end of file
+    is_read = models.BooleanField(default=False)
+
+    objects = NotificationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Dropdown and notification feed pages (for_dropdown ordering)
+            models.Index(fields=['user', '-time', '-id'], name='notification_user_time_idx'),
+            # Unread counts only look at unread rows
+            models.Index(fields=['user'], condition=models.Q(is_read=False), name='notification_user_unread_idx'),
+        ]
+
+
+class UnreadCounter(models.Model):
+    """Denormalized per-user unread totals so pushes don't COUNT(*) the full history"""
+    user = models.OneToOneField(CustomAccount, on_delete=models.CASCADE, related_name='unread_counter')
+    notifications = models.IntegerField(default=0)
+    messages = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} - {self.notifications} notifications, {self.messages} messages"
+
+    @staticmethod
+    def count_unread(user_ids):
+        """
+        Compute the real unread totals for several users from the source tables,
+        with one grouped aggregation per table.
+
+        Returns:
+            dict - user id -> (unread notifications, unread messages)
+        """
+        notifications = dict(
+            Notifications.objects.filter(user_id__in=user_ids, is_read=False)
+            .values('user').annotate(total=Count('id')).values_list('user', 'total')
+        )
+        messages = dict(
+            ReadStatus.objects.filter(user_id__in=user_ids, read=False)
+            .values('user').annotate(total=Count('id')).values_list('user', 'total')
+        )
+        return {
+            user_id: (notifications.get(user_id, 0), messages.get(user_id, 0))
+            for user_id in user_ids
+        }
+
+    @classmethod
+    def get_counts_many(cls, user_ids):
+        """
+        Return {user id: (unread_count, unread_messages)} for several users,
+        seeding missing rows from the source tables in bulk.
+        """
+        user_ids = list(user_ids)
+        counts = {
+            user_id: (notifications, messages)
+            for user_id, notifications, messages in cls.objects.filter(user_id__in=user_ids)
+            .values_list('user_id', 'notifications', 'messages')
+        }
+
+        missing = [user_id for user_id in user_ids if user_id not in counts]
+        if missing:
+            seeded = cls.count_unread(missing)
+            cls.objects.bulk_create(
+                [cls(user_id=user_id, notifications=n, messages=m) for user_id, (n, m) in seeded.items()],
+                ignore_conflicts=True
+            )
+            counts.update(seeded)
+
+        return counts
+
+    @classmethod
+    def get_counts(cls, user):
+        """Return (unread_count, unread_messages), seeding the row on first access"""
+        user_id = getattr(user, 'id', user)
+        return cls.get_counts_many([user_id])[user_id]
+
+    @classmethod
+    def adjust(cls, user_id, notifications=0, messages=0):
+        """
+        Atomically shift a user's counters with F() expressions.
+
+        Users without a row yet are skipped: their row is seeded from the real
+        counts on the next get_counts(), which already reflects this change.
+        """
+        cls.adjust_many([user_id], notifications=notifications, messages=messages)
+
+    @classmethod
+    def adjust_many(cls, user_ids, notifications=0, messages=0):
+        """Apply the same counter shift to several users in one UPDATE"""
+        if not notifications and not messages:
+            return
+        cls.objects.filter(user_id__in=user_ids).update(
+            notifications=F('notifications') + notifications,
+            messages=F('messages') + messages,
+        )
+
+    @classmethod
+    def uncount(cls, notifications=None, read_statuses=None):
+        """
+        Take the unread rows of querysets about to be bulk-deleted off their users' counters.
+
+        Deletes have no signal receivers, so querysets keep Django's fast delete;
+        call this right before .delete(). Deletes of other models that cascade
+        to these rows go through uncount_cascade().
+
+        Args:
+            notifications: Notifications queryset being deleted
+            read_statuses: ReadStatus queryset being deleted
+        """
+        for queryset, unread, counter in (
+            (notifications, Q(is_read=False), 'notifications'),
+            (read_statuses, Q(read=False), 'messages'),
+        ):
+            if queryset is None:
+                continue
+            # Users losing the same number of rows share one UPDATE
+            users_by_total = {}
+            for user_id, total in (
+                queryset.filter(unread).order_by().values('user').annotate(total=Count('id'))
+                .values_list('user', 'total')
+            ):
+                users_by_total.setdefault(total, []).append(user_id)
+            for total, user_ids in users_by_total.items():
+                cls.adjust_many(user_ids, **{counter: -total})
+
+
+    @classmethod
+    def uncount_cascade(cls, objs):
+        """
+        Take the unread rows that deleting `objs` cascades to off their users' counters.
+
+        Runs the same collection as .delete() to find every Notifications and
+        ReadStatus row the delete reaches, however indirectly; call it right
+        before deleting an instance, a list of instances or a queryset.
+        """
+        collector = Collector(using=router.db_for_write(Notifications))
+        collector.collect(objs if isinstance(objs, (list, models.QuerySet)) else [objs])
+        for model, counter in ((Notifications, 'notifications'), (ReadStatus, 'read_statuses')):
+            # A row reached along several paths (a reminder notification of a deleted
+            # prescription) must only be taken off once, so all paths go in one query
+            reached = [Q(pk__in=queryset.values('pk')) for queryset in collector.fast_deletes if queryset.model is model]
+            if collector.data.get(model):
+                reached.append(Q(pk__in=[obj.pk for obj in collector.data[model]]))
+            if reached:
+                cls.uncount(**{counter: model.objects.filter(reduce(operator.or_, reached))})
+
+
+class NotificationEvent(models.Model):
+    """Idempotency key for a notification fan-out task that has already run"""
+    key = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.key
+
+
+@receiver(post_save, sender=Notifications)
+def count_new_notification(sender, instance, created, **kwargs):
+    """Increment the unread notification counter for new unread notifications"""
+    if created and not instance.is_read:
+        UnreadCounter.adjust(instance.user_id, notifications=1)
+
+
+@receiver(post_save, sender=ReadStatus)
+def count_new_read_status(sender, instance, created, **kwargs):
+    """Increment the unread message counter for new unread read statuses"""
+    if created and not instance.read:
+        UnreadCounter.adjust(instance.user_id, messages=1)
+
@@ -0,0 +1,155 @@
+"""
+Registry of which thread each open notification socket is viewing.
+
+Every connection is stored under its own member, `<user id>:<channel name>`,
+so a second tab neither overwrites nor removes the first. Members carry an
+expiry timestamp that the owning consumer refreshes every HEARTBEAT_INTERVAL
+seconds, so a Daphne process that dies without running disconnect() stops
+counting as present after PRESENCE_TTL seconds.
+
+The registry lives in Redis next to the channel layer, so every process sees
+the viewers held by the others. With the in-memory channel layer (a single
+process by definition) it falls back to a dict in this process.
+"""
+import asyncio
+import time
+import weakref
+import redis
+import redis.asyncio
+from django.conf import settings
+
+# Seconds a connection stays present without a heartbeat
+PRESENCE_TTL = 60
+
+# Seconds between heartbeats of a connection viewing a thread
+HEARTBEAT_INTERVAL = 20
+
+
+def _thread_key(thread_id):
+    return f"presence:thread:{thread_id}"
+
+
+def _member(user_id, connection_id):
+    return f"{user_id}:{connection_id}"
+
+
+def _user_id(member):
+    if isinstance(member, bytes):
+        member = member.decode()
+    return int(member.split(':', 1)[0])
+
+
+class RedisPresence:
+    """
+    One sorted set per thread, scored by each member's expiry time.
+
+    Expired members are trimmed on every lookup, and the key itself expires
+    once the last heartbeat on the thread is older than PRESENCE_TTL.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        # redis.asyncio connections belong to the event loop that opened them
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = redis.asyncio.from_url(self.url)
+        return client
+
+    async def join(self, thread_id, user_id, connection_id):
+        key = _thread_key(thread_id)
+        async with self._client().pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {_member(user_id, connection_id): time.time() + PRESENCE_TTL})
+            pipe.expire(key, PRESENCE_TTL)
+            await pipe.execute()
+
+    async def leave(self, thread_id, user_id, connection_id):
+        await self._client().zrem(_thread_key(thread_id), _member(user_id, connection_id))
+
+    async def viewers(self, thread_id):
+        key = _thread_key(thread_id)
+        now = time.time()
+        async with self._client().pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(key, '-inf', now)
+            pipe.zrangebyscore(key, now, '+inf')
+            _, members = await pipe.execute()
+        return {_user_id(member) for member in members}
+
+
+class LocalPresence:
+    """Same interface as RedisPresence, held in this process"""
+
+    def __init__(self):
+        self._threads = {}
+
+    async def join(self, thread_id, user_id, connection_id):
+        members = self._threads.setdefault(str(thread_id), {})
+        members[_member(user_id, connection_id)] = time.time() + PRESENCE_TTL
+
+    async def leave(self, thread_id, user_id, connection_id):
+        members = self._threads.get(str(thread_id), {})
+        members.pop(_member(user_id, connection_id), None)
+        if not members:
+            self._threads.pop(str(thread_id), None)
+
+    async def viewers(self, thread_id):
+        now = time.time()
+        members = self._threads.get(str(thread_id), {})
+        for member in [member for member, expires in members.items() if expires <= now]:
+            del members[member]
+        return {_user_id(member) for member in members}
+
+
+# Backend path or Redis URL -> registry, so tests that swap CHANNEL_LAYERS get a matching one
+_registries = {}
+
+
+def get_presence():
+    """Presence registry shared with the default channel layer"""
+    layer = settings.CHANNEL_LAYERS['default']
+    if layer['BACKEND'] == 'channels.layers.InMemoryChannelLayer':
+        key = layer['BACKEND']
+        if key not in _registries:
+            _registries[key] = LocalPresence()
+    else:
+        key = settings.REDIS_URL
+        if key not in _registries:
+            _registries[key] = RedisPresence(key)
+    return _registries[key]
+
+
+async def join_thread(thread_id, user_id, connection_id):
+    """Mark one connection of a user as viewing a thread, or refresh its heartbeat"""
+    try:
+        await get_presence().join(thread_id, user_id, connection_id)
+    except redis.RedisError as e:
+        print(f"ERROR in presence join_thread: {e}")
+
+
+async def leave_thread(thread_id, user_id, connection_id):
+    """Remove one connection of a user from a thread's viewers"""
+    try:
+        await get_presence().leave(thread_id, user_id, connection_id)
+    except redis.RedisError as e:
+        print(f"ERROR in presence leave_thread: {e}")
+
+
+async def thread_viewers(thread_id):
+    """
+    Ids of every user with at least one live connection viewing a thread.
+
+    Args:
+        thread_id: int or str - id of the Thread
+
+    Returns:
+        set of user ids, fetched in a single round trip. Empty if Redis is
+        unreachable, so messages are then delivered as unread rather than lost.
+    """
+    try:
+        return await get_presence().viewers(thread_id)
+    except redis.RedisError as e:
+        print(f"ERROR in presence thread_viewers: {e}")
+        return set()
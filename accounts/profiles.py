@@ -0,0 +1,129 @@
+"""
+Per-request resolution of the signed-in user's role profile.
+
+ProfileMiddleware sets request.pharmacist, request.pharmacy and
+request.patient_profile. The resolved rows are kept in the session, which is
+loaded on every authenticated request anyway. They are only re-read from the
+database after a profile write replaces the user's or the pharmacy's version
+token in the shared cache. Without a shared cache a write in one process
+cannot reach the sessions served by the others, so profiles are then read from
+the database on every request.
+"""
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from patients.models import PatientProfile
+from pharmacy.models import PharmacistProfile, PharmacyProfile
+from .utils import bump_cache_version, cache_is_shared, cache_version
+
+SESSION_KEY = '_profiles'
+
+
+def _user_version_key(user_id):
+    return f"profile_version_user_{user_id}"
+
+
+def _pharmacy_version_key(pharmacy_id):
+    return f"profile_version_pharmacy_{pharmacy_id}"
+
+
+def _dump(instance):
+    """JSON-safe snapshot of a model row"""
+    if instance is None:
+        return None
+    return {
+        field.attname: None if field.value_from_object(instance) is None else field.value_to_string(instance)
+        for field in instance._meta.concrete_fields
+    }
+
+
+def _load(model, data):
+    """Rebuild a model instance from _dump() output as if it was just fetched"""
+    if data is None:
+        return None
+    fields = model._meta.concrete_fields
+    values = [None if data[f.attname] is None else f.to_python(data[f.attname]) for f in fields]
+    return model.from_db(DEFAULT_DB_ALIAS, [f.attname for f in fields], values)
+
+
+def _fetch(user):
+    """Load the user's profiles from the database, one query per profile the role has"""
+    pharmacist = pharmacy = patient_profile = None
+
+    if user.role == 'pharmacy admin':
+        pharmacy = PharmacyProfile.objects.filter(user=user).first()
+        # Admins also prescribe through their own PharmacistProfile
+        pharmacist = PharmacistProfile.objects.filter(user=user).first()
+    elif user.role == 'pharmacist':
+        pharmacist = PharmacistProfile.objects.select_related('pharmacy').filter(user=user).first()
+        pharmacy = pharmacist.pharmacy if pharmacist else None
+    elif user.role == 'patient':
+        patient_profile = PatientProfile.objects.select_related('pharmacy').filter(user=user).first()
+
+    return pharmacist, pharmacy, patient_profile
+
+
+def resolve_profiles(request):
+    """
+    Profiles of request.user as a (pharmacist, pharmacy, patient_profile) tuple.
+
+    pharmacy is the pharmacy the user works for, so it stays None for patients;
+    their pharmacy is patient_profile.pharmacy.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None, None, None
+    if not cache_is_shared():
+        return _fetch(user)
+
+    cached = request.session.get(SESSION_KEY)
+    if cached and cached['user_id'] == user.id:
+        versions = [cache_version(_user_version_key(user.id))]
+        if cached['pharmacy_id']:
+            versions.append(cache_version(_pharmacy_version_key(cached['pharmacy_id'])))
+        if versions == cached['versions']:
+            pharmacist = _load(PharmacistProfile, cached['pharmacist'])
+            pharmacy = _load(PharmacyProfile, cached['pharmacy'])
+            patient_profile = _load(PatientProfile, cached['patient_profile'])
+            if pharmacist and pharmacy and pharmacist.pharmacy_id == pharmacy.id:
+                pharmacist.pharmacy = pharmacy
+            if patient_profile:
+                patient_profile.pharmacy = _load(PharmacyProfile, cached['patient_pharmacy'])
+            return pharmacist, pharmacy, patient_profile
+
+    pharmacist, pharmacy, patient_profile = _fetch(user)
+    patient_pharmacy = patient_profile.pharmacy if patient_profile else None
+    # The pharmacy whose edits must invalidate this entry
+    pharmacy_id = pharmacy.id if pharmacy else patient_pharmacy.id if patient_pharmacy else None
+
+    versions = [cache_version(_user_version_key(user.id))]
+    if pharmacy_id:
+        versions.append(cache_version(_pharmacy_version_key(pharmacy_id)))
+
+    request.session[SESSION_KEY] = {
+        'user_id': user.id,
+        'pharmacy_id': pharmacy_id,
+        'versions': versions,
+        'pharmacist': _dump(pharmacist),
+        'pharmacy': _dump(pharmacy),
+        'patient_profile': _dump(patient_profile),
+        'patient_pharmacy': _dump(patient_pharmacy),
+    }
+    return pharmacist, pharmacy, patient_profile
+
+
+def invalidate_user_profiles(user_id):
+    bump_cache_version(_user_version_key(user_id))
+
+
+@receiver([post_save, post_delete], sender=PharmacyProfile)
+def invalidate_pharmacy_profiles(sender, instance, **kwargs):
+    # Pharmacists and patients of this pharmacy carry a copy of it
+    bump_cache_version(_pharmacy_version_key(instance.id))
+    invalidate_user_profiles(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=PharmacistProfile)
+@receiver([post_save, post_delete], sender=PatientProfile)
+def invalidate_member_profiles(sender, instance, **kwargs):
+    invalidate_user_profiles(instance.user_id)
@@ -0,0 +1,76 @@
+"""
+Wire formats of the notification WebSocket.
+
+Producers build one payload shape with an epoch `time` (seconds). A socket
+opened with the COMPACT_SUBPROTOCOL receives JSON arrays of events using the
+short keys in COMPACT_KEYS, several events per frame, and formats times in the
+browser. Any other socket keeps the original protocol: one
+{"notification": {...}} frame per event with server-formatted time strings.
+"""
+import json
+from datetime import datetime, timezone as dt_timezone
+from django.utils import timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPACT_SUBPROTOCOL = 'pulserx.compact.v1'
+
+# Seconds a compact socket collects events before sending them as one frame
+FRAME_BATCH_WINDOW = 0.05
+
+# Payload key -> compact key; base.html holds the inverse map
+COMPACT_KEYS = {
+    'id': 'i',
+    'type': 'y',
+    'unread_count': 'u',
+    'unread_messages': 'm',
+    'time': 't',
+    'thread_id': 'th',
+    'message_id': 'mi',
+    'sender': 's',
+    'content': 'c',
+    'link': 'l',
+    'is_read': 'r',
+    'reminder_id': 'ri',
+    'reminder': 'rn',
+}
+
+
+def epoch(value):
+    """Whole seconds since the epoch for an aware datetime"""
+    return int(value.timestamp())
+
+
+def dumps(data):
+    """JSON text for a frame, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(',', ':'))
+
+
+def compact_event(notification):
+    """Short-key copy of a notification payload for the compact protocol"""
+    return {COMPACT_KEYS.get(key, key): value for key, value in notification.items()}
+
+
+def legacy_notification(notification):
+    """
+    Original-protocol copy of a notification payload.
+
+    Replaces the epoch `time` with the strings base.html renders directly:
+    `created_time` for reminders and `timestamp` for everything else.
+    """
+    notification = dict(notification)
+    seconds = notification.pop('time', None)
+    if seconds is None:
+        return notification
+
+    local = timezone.localtime(datetime.fromtimestamp(seconds, dt_timezone.utc))
+    if notification.get('type') == 'reminder':
+        notification['created_time'] = local.strftime("%b. %-d, %Y, %-I:%M %p").replace("AM", "a.m.").replace("PM", "p.m.")
+    else:
+        notification['timestamp'] = local.strftime("%b %d, %I:%M %p")
+    return notification
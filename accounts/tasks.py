@@ -1,37 +1,374 @@
+from collections import Counter
 from celery import shared_task
-from accounts.models import Notifications
-from accounts.utils import send_notification_with_counts
-from patients.models import MedicationReminder, ReminderTime
+from accounts.models import CustomAccount, Message, Notifications, NotificationEvent, Thread, UnreadCounter
+from accounts.utils import send_notification_with_counts, send_bulk_notifications, push_notifications
+from accounts.protocol import epoch
+from patients.models import ReminderTime
+from pharmacy.models import Drug, PharmacyProfile, Prescription
+from django.db import transaction, OperationalError
+from django.urls import reverse
 from django.utils import timezone
+from datetime import timedelta
 
 @shared_task
 def send_reminder(time_id):
-    try:
-        reminder_time = ReminderTime.objects.get(id=time_id)
-        reminder = reminder_time.reminder
-    except MedicationReminder.DoesNotExist:
+    return send_reminders([time_id])
+
+
+@shared_task
+def send_reminders(time_ids):
+    """
+    Send every reminder in time_ids as one batch.
+
+    Loads all ReminderTime rows with their reminder, patient user and medicine
+    in one query, bulk-creates the Notifications, reads unread counts for all
+    recipients at once and pushes the WebSocket messages in one batch.
+    """
+    reminder_times = ReminderTime.objects.filter(id__in=time_ids, is_active=True).select_related(
+        'reminder__user__user',
+        'reminder__prescription__medicine',
+    )
+
+    reminders = [
+        reminder_time.reminder for reminder_time in reminder_times
+        if reminder_time.reminder.is_active and reminder_time.reminder.days_left() > 0
+    ]
+    if not reminders:
+        return 0
+
+    # Create notifications
+    notifications = Notifications.objects.bulk_create([
+        Notifications(user=reminder.user.user, reminder=reminder)
+        for reminder in reminders
+    ])
+
+    # bulk_create skips post_save: bump each recipient by the number of reminders they got
+    per_user = Counter(notification.user_id for notification in notifications)
+    for increment in set(per_user.values()):
+        UnreadCounter.adjust_many(
+            [user_id for user_id, count in per_user.items() if count == increment],
+            notifications=increment
+        )
+    counts = UnreadCounter.get_counts_many(per_user)
+
+    payloads = []
+    for notif, reminder in zip(notifications, reminders):
+        unread_count, unread_messages = counts[notif.user_id]
+
+        payloads.append((notif.user_id, {
+            "id": notif.id,
+            "type": "reminder",
+            "reminder_id": reminder.id,
+            "reminder": reminder.prescription.medicine.name,
+            "is_read": notif.is_read,
+            "time": epoch(notif.time),
+            "unread_count": unread_count,
+            "unread_messages": unread_messages,
+        }))
+
+    push_notifications(payloads)
+    return len(notifications)
+
+
+# Due reminder times are claimed and advanced in batches of this size
+REMINDER_BATCH_SIZE = 500
+
+# Reminders missed by more than this (e.g. the worker was down) are skipped, not sent late
+REMINDER_GRACE = timedelta(minutes=15)
+
+
+@shared_task
+def dispatch_due_reminders():
+    """
+    Scheduler tick, run every minute by Celery beat.
+
+    Selects due ReminderTime rows through the next_fire_at index, sends them
+    and advances each to its next daily occurrence. Nothing is queued per
+    reminder, so worker memory stays flat regardless of reminder count.
+    """
+    now = timezone.now()
+    sent = 0
+
+    while True:
+        with transaction.atomic():
+            # skip_locked lets overlapping ticks split the work instead of double-sending
+            due = list(
+                ReminderTime.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(
+                    next_fire_at__lte=now,
+                    is_active=True,
+                    reminder__is_active=True,
+                    reminder__is_archived=False,
+                )
+                .order_by('next_fire_at')[:REMINDER_BATCH_SIZE]
+            )
+            if not due:
+                break
+
+            on_time = [
+                reminder_time.id for reminder_time in due
+                if reminder_time.next_fire_at >= now - REMINDER_GRACE
+            ]
+            sent += send_reminders(on_time)
+
+            for reminder_time in due:
+                reminder_time.schedule(now)
+            ReminderTime.objects.bulk_update(due, ['next_fire_at'])
+
+        if len(due) < REMINDER_BATCH_SIZE:
+            break
+
+    return sent
+
+
+# ---------------------------------------------------------------------------
+# Notification fan-out for pharmacy events.
+#
+# Views dispatch these with transaction.on_commit once the stock/prescription
+# writes are committed. Each task claims its event key inside the same
+# transaction as its writes, so a retry after a failure re-runs cleanly and a
+# retry after success is a no-op.
+# ---------------------------------------------------------------------------
+
+def event_key(kind, object_id, *change):
+    """
+    Key of one fan-out event, derived from the object and the change that triggered it.
+
+    Retries, re-dispatches and double-submitted forms for the same change build
+    the same key, so only the first of them notifies anyone.
+
+    Args:
+        kind: str - event type, e.g. 'prescription_refilled'
+        object_id: int - prescription or drug id
+        change: values identifying the triggering change, e.g. refilled_on
+
+    Returns:
+        str - e.g. 'prescription_refilled:12:2026-01-03T11:43:14+00:00'
+    """
+    parts = [kind, object_id, *(value.isoformat() if hasattr(value, 'isoformat') else value for value in change)]
+    return ":".join(str(part) for part in parts)
+
+
+def _claim_event(key):
+    """Record an event key, returning False if it was already processed"""
+    _, created = NotificationEvent.objects.get_or_create(key=key)
+    return created
+
+
+def _pharmacy_staff(pharmacy):
+    """The pharmacy admin followed by every pharmacist of the pharmacy"""
+    return [pharmacy.user] + list(CustomAccount.objects.filter(pharmacistprofile__pharmacy=pharmacy))
+
+
+def _send_stock_alert(medicine, new_stock, thread, system_user, pharmacy, actor_id):
+    """Post the low/out-of-stock system message and notify the pharmacy staff"""
+    if 1 <= new_stock <= 30:
+        alert_type = "low_stock"
+        content = f"{medicine.name} ({medicine.brand}) is running low."
+    elif new_stock == 0:
+        alert_type = "out_of_stock"
+        content = f"{medicine.name} ({medicine.brand}) is out of stock."
+    else:
         return
 
-    if reminder.is_active and reminder.days_left() > 0 and reminder_time.is_active:
-        # Create notification
-        notif = Notifications.objects.create(
-            user=reminder.user.user,
-            reminder=reminder
+    msg = Message.objects.create(
+        sender=system_user,
+        thread=thread,
+        content=content,
+        link=reverse('drug_detail', args=[medicine.id])
+    )
+
+    send_bulk_notifications(
+        _pharmacy_staff(pharmacy),
+        notification_data={
+            "type": alert_type,
+            "sender": system_user.first_name,
+            "thread_id": thread.id,
+            "message_id": msg.id,
+            "content": msg.content,
+            "time": epoch(msg.timestamp),
+            "link": msg.link
+        },
+        skip_push=[actor_id],
+        message=msg
+    )
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def notify_prescription_created(event_key, prescription_id, pharmacy_id, new_stock, actor_id):
+    with transaction.atomic():
+        if not _claim_event(event_key):
+            return
+
+        prescription = Prescription.objects.select_related('medicine', 'patient__user').get(id=prescription_id)
+        pharmacy = PharmacyProfile.objects.select_related('user').get(id=pharmacy_id)
+        medicine = prescription.medicine
+        patient_user = prescription.patient.user
+        system_user = CustomAccount.objects.get(role='system')
+
+        thread = Thread.objects.create()
+        thread.participant.add(system_user, *_pharmacy_staff(pharmacy))
+
+        _send_stock_alert(medicine, new_stock, thread, system_user, pharmacy, actor_id)
+
+        msg = Message.objects.create(
+            sender=system_user,
+            thread=thread,
+            content=f"You have a new prescription.",
+            link=f"{reverse('patient_profile', args=[prescription.patient.id])}#prescription-{prescription.id}"
         )
 
-        created_time_local = timezone.localtime(notif.time)
-        formatted_time = created_time_local.strftime("%b. %-d, %Y, %-I:%M %p").replace("AM", "a.m.").replace("PM", "p.m.")
+        notification_obj = Notifications.objects.create(user=patient_user, message=msg)
 
         # Send notification with automatic unread counts
         send_notification_with_counts(
-            user=reminder.user.user,
+            user=patient_user,
             notification_data={
-                "id": notif.id,
-                "type": "reminder",
-                "reminder_id": reminder.id,
-                "reminder": reminder.prescription.medicine.name,
-                "is_read": notif.is_read,
-                "created_time": formatted_time
+                "id": notification_obj.id,
+                "type": "create_prescription",
+                "sender": system_user.first_name,
+                "thread_id": thread.id,
+                "message_id": msg.id,
+                "content": msg.content,
+                "time": epoch(msg.timestamp),
+                "link": msg.link
             }
         )
 
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def notify_prescription_refilled(event_key, prescription_id, pharmacy_id, new_stock, actor_id):
+    with transaction.atomic():
+        if not _claim_event(event_key):
+            return
+
+        prescription = Prescription.objects.select_related('medicine', 'patient__user').get(id=prescription_id)
+        pharmacy = PharmacyProfile.objects.select_related('user').get(id=pharmacy_id)
+        patient = prescription.patient
+        system_user = CustomAccount.objects.get(role='system')
+
+        thread = Thread.objects.create()
+        thread.participant.add(system_user, patient.user)
+
+        _send_stock_alert(prescription.medicine, new_stock, thread, system_user, pharmacy, actor_id)
+
+        # Delete old refill request notifications for this prescription
+        stale = Notifications.objects.filter(
+            prescription=prescription,
+            content__icontains="refill request"
+        )
+        UnreadCounter.uncount(notifications=stale)
+        stale.delete()
+
+        content = f"A refill request has been fulfilled and is ready for pick up."
+        link = f"{reverse('patient_profile', args=[patient.id])}#prescription-{prescription.id}"
+
+        notification_obj = Notifications.objects.create(
+            user=patient.user,
+            content=content,
+            link=link,
+            prescription=prescription
+        )
+
+        # Send notification with automatic unread counts
+        send_notification_with_counts(
+            user=patient.user,
+            notification_data={
+                "id": notification_obj.id,
+                "type": "refill",
+                "content": content,
+                "time": epoch(notification_obj.time),
+                "link": link
+            }
+        )
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def notify_refill_requested(event_key, prescription_id):
+    with transaction.atomic():
+        if not _claim_event(event_key):
+            return
+
+        prescription = Prescription.objects.select_related('patient').get(id=prescription_id)
+        patient = prescription.patient
+
+        content = f"A refill request from {patient.first_name} {patient.last_name} has been sent."
+        link = reverse('refill_form', args=[prescription.id])
+
+        send_bulk_notifications(
+            CustomAccount.objects.filter(pharmacistprofile__pharmacy_id=patient.pharmacy_id),
+            notification_data={
+                "type": "refill_request",
+                "content": content,
+                "time": epoch(timezone.now()),
+                "link": link
+            },
+            content=content,
+            link=link,
+            prescription=prescription
+        )
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def notify_resupply_requested(event_key, drug_id, pharmacy_id):
+    with transaction.atomic():
+        if not _claim_event(event_key):
+            return
+
+        medicine = Drug.objects.get(id=drug_id)
+        pharmacy = PharmacyProfile.objects.select_related('user').get(id=pharmacy_id)
+
+        content = f"A resupply of {medicine.name} ({medicine.brand}) has been requested due to low inventory."
+        link = reverse('drug_detail', args=[drug_id])
+
+        notification_obj = Notifications.objects.create(
+            user=pharmacy.user,
+            content=content,
+            link=link,
+            drug=medicine
+        )
+
+        # Send notification with automatic unread counts
+        send_notification_with_counts(
+            user=pharmacy.user,
+            notification_data={
+                "id": notification_obj.id,
+                "type": "resupply_request",
+                "content": content,
+                "time": epoch(notification_obj.time),
+                "link": link
+            }
+        )
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def notify_drug_resupplied(event_key, drug_id, pharmacy_id):
+    with transaction.atomic():
+        if not _claim_event(event_key):
+            return
+
+        medicine = Drug.objects.get(id=drug_id)
+
+        content = f"{medicine.name} ({medicine.brand}) has been resupplied."
+        link = reverse('drug_detail', args=[drug_id])
+
+        # Delete old resupply request notifications
+        stale = Notifications.objects.filter(
+            drug=medicine,
+            content__icontains="resupply request"
+        )
+        UnreadCounter.uncount(notifications=stale)
+        stale.delete()
+
+        send_bulk_notifications(
+            CustomAccount.objects.filter(pharmacistprofile__pharmacy_id=pharmacy_id),
+            notification_data={
+                "type": "resupply",
+                "content": content,
+                "time": epoch(timezone.now()),
+                "link": link
+            },
+            content=content,
+            link=link,
+            drug=medicine
+        )
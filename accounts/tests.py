@@ -1,3 +1,369 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+from django.contrib.admin.sites import site
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from accounts.consumers import MessageConsumer
+from accounts.models import CustomAccount, Message, Notifications, ReadStatus, Thread, UnreadCounter
+from accounts.profiles import SESSION_KEY, resolve_profiles
+from accounts.utils import inbox_page, notification_page, thread_history
+from patients.models import MedicationReminder, PatientProfile
+from pharmacy.models import Drug, PharmacistProfile, PharmacyProfile, Prescription
 
-# Create your tests here.
+
+def make_user(username, role):
+    return CustomAccount.objects.create(
+        username=username, email=f'{username}@example.com', role=role, first_name=username.title(), last_name='Test'
+    )
+
+
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', 'pharmacy admin')
+        self.pharmacy = PharmacyProfile.objects.create(
+            user=self.admin, pharmacy_name='Main Pharmacy', street_address='1 Main St',
+            city='Newark', state='NJ', zip_code='07102',
+        )
+        self.pharmacist = PharmacistProfile.objects.create(
+            user=make_user('pharmacist', 'pharmacist'), pharmacy=self.pharmacy, first_name='Pat', last_name='Test',
+        )
+        self.patient_user = make_user('patient', 'patient')
+        self.patient = PatientProfile.objects.create(
+            user=self.patient_user, first_name='Pa', last_name='Tient', dob=date(1980, 1, 1),
+            gender='F', phone_number='555-0100', pharmacy=self.pharmacy,
+        )
+        self.thread = Thread.objects.create()
+        self.thread.participant.add(self.admin, self.patient_user, self.pharmacist.user)
+        self.users = [self.admin.id, self.pharmacist.user_id, self.patient_user.id]
+        # Seed every counter row so the F() adjustments have something to move
+        UnreadCounter.get_counts_many(self.users)
+
+    def send(self, sender, content='Hello', viewing=()):
+        """Deliver a message the way MessageConsumer does"""
+        message = Message.objects.create(thread=self.thread, sender=sender, content=content)
+        MessageConsumer.record_delivery.__wrapped__(None, self.thread, message, sender, set(viewing))
+        return message
+
+    def assertCounts(self, user, notifications, messages):
+        self.assertEqual(UnreadCounter.get_counts(user), (notifications, messages))
+        # The denormalized row must agree with the source tables
+        self.assertEqual(UnreadCounter.count_unread([user.id])[user.id], (notifications, messages))
+
+    def test_seeds_missing_rows_from_source_tables(self):
+        UnreadCounter.objects.all().delete()
+        # bulk_create skips the post_save receivers, so only seeding can count these
+        Notifications.objects.bulk_create([Notifications(user=self.patient_user) for _ in range(3)])
+
+        self.assertEqual(UnreadCounter.get_counts_many(self.users)[self.patient_user.id], (3, 0))
+        self.assertEqual(UnreadCounter.objects.get(user=self.patient_user).notifications, 3)
+
+    def test_new_unread_rows_increment(self):
+        Notifications.objects.create(user=self.patient_user)
+        Notifications.objects.create(user=self.patient_user, is_read=True)
+
+        self.assertCounts(self.patient_user, 1, 0)
+
+    def test_send_counts_every_participant_not_viewing(self):
+        self.send(self.patient_user, viewing=[self.admin.id])
+
+        self.assertCounts(self.patient_user, 0, 0)
+        self.assertCounts(self.admin, 0, 0)
+        self.assertCounts(self.pharmacist.user, 1, 1)
+
+    # The manifest only exists after collectstatic
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_thread_view_reads_messages_and_notifications(self):
+        self.send(self.admin)
+        self.send(self.pharmacist.user)
+        self.assertCounts(self.patient_user, 2, 2)
+
+        self.client.force_login(self.patient_user)
+        self.client.get(reverse('threads', args=[self.thread.id]))
+
+        self.assertCounts(self.patient_user, 0, 0)
+        self.assertCounts(self.admin, 1, 1)
+
+    def test_read_notification_only_counts_once(self):
+        notification = Notifications.objects.create(user=self.patient_user)
+        self.client.force_login(self.patient_user)
+
+        for _ in range(2):
+            self.client.post(reverse('read_notification'), json.dumps({'notification_id': notification.id}),
+                             content_type='application/json')
+
+        self.assertCounts(self.patient_user, 0, 0)
+
+    def test_delete_notification(self):
+        unread = Notifications.objects.create(user=self.patient_user)
+        read = Notifications.objects.create(user=self.patient_user, is_read=True)
+        Notifications.objects.create(user=self.patient_user)
+        self.client.force_login(self.patient_user)
+
+        for notification in (unread, read):
+            self.client.post(reverse('delete_notification'), json.dumps({'notification_id': notification.id}),
+                             content_type='application/json')
+
+        self.assertCounts(self.patient_user, 1, 0)
+
+    def prescription(self):
+        drug = Drug.objects.create(pharmacy=self.pharmacy, name='Ibuprofen', brand='Advil',
+                                   description='Pain reliever', dosage='200mg')
+        return Prescription.objects.create(patient=self.patient, medicine=drug, prescribed_by=self.pharmacist,
+                                           quantity=30, expiration_date=date.today() + timedelta(days=90))
+
+    def test_delete_reminder_uncounts_its_notifications(self):
+        reminder = MedicationReminder.objects.create(user=self.patient, prescription=self.prescription(),
+                                                     frequency=1, day_amount=30)
+        Notifications.objects.create(user=self.patient_user, reminder=reminder)
+        self.client.force_login(self.patient_user)
+
+        self.client.post(reverse('delete_reminder'), json.dumps({'reminder_id': reminder.id}),
+                         content_type='application/json')
+
+        self.assertFalse(MedicationReminder.objects.exists())
+        self.assertCounts(self.patient_user, 0, 0)
+
+    def test_uncount_cascade_thread(self):
+        self.send(self.admin)
+        self.send(self.patient_user)
+
+        UnreadCounter.uncount_cascade(self.thread)
+        self.thread.delete()
+
+        for user in (self.admin, self.pharmacist.user, self.patient_user):
+            self.assertCounts(user, 0, 0)
+
+    def test_uncount_cascade_counts_rows_reached_twice_once(self):
+        prescription = self.prescription()
+        reminder = MedicationReminder.objects.create(user=self.patient, prescription=prescription,
+                                                     frequency=1, day_amount=30)
+        # Reached through both the prescription and its reminder
+        Notifications.objects.create(user=self.patient_user, reminder=reminder, prescription=prescription)
+        Notifications.objects.create(user=self.admin, prescription=prescription)
+
+        queryset = Prescription.objects.filter(id=prescription.id)
+        UnreadCounter.uncount_cascade(queryset)
+        queryset.delete()
+
+        self.assertCounts(self.patient_user, 0, 0)
+        self.assertCounts(self.admin, 0, 0)
+
+    def test_admin_account_delete_uncounts_received_messages(self):
+        # Message.recipient cascades, taking the other participants' read statuses along
+        visitor = make_user('visitor', 'patient')
+        UnreadCounter.get_counts(visitor)
+        message = Message.objects.create(thread=self.thread, sender=self.admin, recipient=visitor, content='Hi')
+        ReadStatus.objects.create(message=message, user=self.pharmacist.user)
+        self.assertCounts(self.pharmacist.user, 0, 1)
+
+        request = RequestFactory().post('/')
+        site._registry[CustomAccount].delete_model(request, visitor)
+
+        self.assertCounts(self.pharmacist.user, 0, 0)
+
+    def test_reconcile_repairs_drift(self):
+        self.send(self.admin)
+        UnreadCounter.objects.filter(user=self.patient_user).update(notifications=7, messages=0)
+        UnreadCounter.objects.filter(user=self.admin).delete()
+
+        call_command('reconcile_unread_counters', stdout=StringIO())
+
+        self.assertCounts(self.patient_user, 1, 1)
+        self.assertEqual(UnreadCounter.objects.get(user=self.admin).notifications, 0)
+
+    def test_reconcile_dry_run_writes_nothing(self):
+        UnreadCounter.objects.filter(user=self.patient_user).update(notifications=7)
+
+        call_command('reconcile_unread_counters', '--dry-run', stdout=StringIO())
+
+        self.assertEqual(UnreadCounter.objects.get(user=self.patient_user).notifications, 7)
+
+
+class InboxPageTests(TestCase):
+    def setUp(self):
+        self.patient = make_user('patient', 'patient')
+        self.admins = [make_user(f'admin{n}', 'pharmacy admin') for n in range(5)]
+        self.threads = []
+        for admin in self.admins:
+            thread = Thread.objects.create()
+            thread.participant.add(self.patient, admin)
+            self.threads.append(thread)
+        # Two threads share a last_updated so the id tie-breaker is exercised
+        moment = timezone.now()
+        for thread, minutes in zip(self.threads, [0, 2, 2, 5, 7]):
+            Thread.objects.filter(id=thread.id).update(last_updated=moment - timedelta(minutes=minutes))
+
+    def test_pages_cover_every_thread_once_newest_first(self):
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = inbox_page(self.patient, cursor, page_size=2)
+            seen.extend(page)
+            if cursor is None:
+                break
+
+        expected = list(Thread.objects.filter(participant=self.patient).order_by('-last_updated', '-id'))
+        self.assertEqual([thread.id for thread in seen], [thread.id for thread in expected])
+
+    def test_counterparty_latest_message_and_unread_count(self):
+        thread = self.threads[0]
+        Message.objects.create(thread=thread, sender=self.admins[0], content='First')
+        latest = Message.objects.create(thread=thread, sender=self.admins[0], content='Second')
+        for message in thread.messages.all():
+            ReadStatus.objects.create(message=message, user=self.patient, read=message == latest)
+
+        threads = {thread.id: thread for thread in inbox_page(self.patient, page_size=10)[0]}
+
+        self.assertEqual(threads[thread.id].other_participants, [self.admins[0]])
+        self.assertEqual(threads[thread.id].latest_msg_id, latest.id)
+        self.assertEqual(threads[thread.id].unread_count, 1)
+        self.assertEqual(threads[self.threads[1].id].unread_count, 0)
+
+    def test_malformed_cursor_raises_value_error(self):
+        for cursor in ('garbage', '12_x', '1_2_3'):
+            with self.assertRaises(ValueError):
+                inbox_page(self.patient, cursor)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_view_falls_back_to_first_page_on_bad_cursor(self):
+        self.client.force_login(self.patient)
+
+        response = self.client.get(reverse('messages'), {'cursor': 'garbage'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['threads']), len(self.threads))
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.patient = make_user('patient', 'patient')
+        self.admin = make_user('admin', 'pharmacy admin')
+        self.thread = Thread.objects.create()
+        self.thread.participant.add(self.patient, self.admin)
+
+        moment = timezone.now()
+        self.messages = []
+        for n in range(7):
+            message = Message.objects.create(thread=self.thread, sender=self.admin, content=f'Message {n}')
+            ReadStatus.objects.create(message=message, user=self.patient, read=n < 3)
+            self.messages.append(message)
+        self.notifications = [Notifications.objects.create(user=self.patient, content=f'Note {n}') for n in range(7)]
+        # Pairs of rows share a timestamp so the id tie-breaker is exercised
+        for n, (message, notification) in enumerate(zip(self.messages, self.notifications)):
+            moment_n = moment - timedelta(minutes=6 - n // 2)
+            Message.objects.filter(id=message.id).update(timestamp=moment_n)
+            Notifications.objects.filter(id=notification.id).update(time=moment_n)
+
+    def walk(self, fetch):
+        pages = []
+        cursor = None
+        while True:
+            page, cursor = fetch(cursor)
+            pages.append(page)
+            if cursor is None:
+                return pages
+
+    def test_thread_history_walks_back_oldest_first_within_pages(self):
+        pages = self.walk(lambda cursor: thread_history(self.patient, self.thread, cursor, page_size=3))
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        # Each page is oldest first; together they go newest page first
+        walked = [message.id for page in reversed(pages) for message in page]
+        self.assertEqual(walked, [message.id for message in self.messages])
+        self.assertEqual([message.user_read for message in pages[-1] + pages[-2]], [True, True, True, False])
+
+    def test_notification_page_walks_newest_first(self):
+        pages = self.walk(lambda cursor: notification_page(self.patient, cursor, page_size=3))
+
+        walked = [notification.id for page in pages for notification in page]
+        self.assertEqual(walked, [notification.id for notification in reversed(self.notifications)])
+
+    def test_thread_messages_endpoint(self):
+        self.client.force_login(self.patient)
+        url = reverse('thread_messages', args=[self.thread.id])
+
+        _, cursor = thread_history(self.patient, self.thread, page_size=3)
+        older = self.client.get(url, {'cursor': cursor}).json()
+
+        self.assertEqual([message['id'] for message in older['messages']], [message.id for message in self.messages[:4]])
+        self.assertEqual([message['read'] for message in older['messages']], [True, True, True, False])
+        self.assertIsNone(older['next_cursor'])
+
+    def test_bad_cursors_are_rejected_with_400(self):
+        self.client.force_login(self.patient)
+
+        for url in (reverse('thread_messages', args=[self.thread.id]), reverse('notification_feed')):
+            response = self.client.get(url, {'cursor': 'not-a-cursor'})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+    def test_thread_messages_only_serves_participants(self):
+        self.client.force_login(make_user('outsider', 'patient'))
+
+        response = self.client.get(reverse('thread_messages', args=[self.thread.id]))
+
+        self.assertEqual(response.status_code, 404)
+
+
+class ExplainHotQueriesTests(TestCase):
+    def explain(self, *args):
+        out = StringIO()
+        call_command('explain_hot_queries', '--patients', '10', '--per-patient', '5', *args, stdout=out)
+        return out.getvalue()
+
+    def test_hot_queries_use_their_indexes(self):
+        output = self.explain('--pharmacies', '3')
+
+        self.assertIn('notification dropdown: notification_user_time_idx', output)
+        self.assertNotIn('expected', output)
+        self.assertFalse(CustomAccount.objects.filter(username__startswith='explain_').exists())
+
+    def test_single_pharmacy_may_scan_its_small_tables(self):
+        # Every drug belongs to the one pharmacy, so the planner scans pharmacy_drug
+        output = self.explain('--pharmacies', '1')
+
+        self.assertNotIn('expected', output)
+
+
+class ProfileSessionCacheTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', 'pharmacy admin')
+        self.pharmacy = PharmacyProfile.objects.create(
+            user=self.admin, pharmacy_name='Main Pharmacy', street_address='1 Main St',
+            city='Newark', state='NJ', zip_code='07102',
+        )
+        self.user = make_user('pharmacist', 'pharmacist')
+        PharmacistProfile.objects.create(user=self.user, pharmacy=self.pharmacy, first_name='Pat', last_name='Test')
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+        self.request.session = SessionStore()
+
+    def pharmacy_name(self):
+        return resolve_profiles(self.request)[1].pharmacy_name
+
+    def test_process_local_cache_reads_profiles_every_request(self):
+        self.assertEqual(self.pharmacy_name(), 'Main Pharmacy')
+        PharmacyProfile.objects.filter(pk=self.pharmacy.pk).update(pharmacy_name='Renamed')
+
+        self.assertEqual(self.pharmacy_name(), 'Renamed')
+        self.assertNotIn(SESSION_KEY, self.request.session)
+
+    def test_shared_cache_keeps_profiles_in_session_until_a_write(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                              'LOCATION': directory.name}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(self.pharmacy_name(), 'Main Pharmacy')
+            # No signal, so the session copy is still current as far as the version tokens know
+            PharmacyProfile.objects.filter(pk=self.pharmacy.pk).update(pharmacy_name='Renamed')
+            self.assertEqual(self.pharmacy_name(), 'Main Pharmacy')
+
+            self.pharmacy.pharmacy_name = 'Renamed again'
+            self.pharmacy.save()
+            self.assertEqual(self.pharmacy_name(), 'Renamed again')
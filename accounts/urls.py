@@ -11,8 +11,10 @@ urlpatterns = [
     path('account_settings', views.account_settings, name='account_settings'),
     path('messages', views.account_messages, name='messages'),
     path('thread/<int:thread_id>', views.thread_view, name='threads'),
+    path('thread/<int:thread_id>/messages', views.thread_messages, name='thread_messages'),
     path('message_search', views.message_search, name='message_search'),
     path('patient_thread', views.patient_thread, name='patient_thread'),
+    path('notifications', views.notification_feed, name='notification_feed'),
     path('delete_notification', views.delete_notification, name='delete_notification'),
     path('read_notification', views.read_notification, name='read_notification')
 ]
\ No newline at end of file
@@ -1,6 +1,65 @@
+import asyncio
+import functools
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from accounts.models import Notifications, ReadStatus
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Exists, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.formats import date_format
+from accounts.models import CustomAccount, Message, Notifications, ReadStatus, Thread, UnreadCounter
+
+# Number of notifications rendered in the dropdown / returned per feed page
+NOTIFICATION_PAGE_SIZE = 20
+
+# Number of threads rendered per page of the messages inbox
+INBOX_PAGE_SIZE = 25
+
+# Number of messages rendered on the thread page / returned per history page
+THREAD_PAGE_SIZE = 50
+
+# Seconds a notification socket collects count-only updates before pushing one frame
+COUNT_PUSH_WINDOW = 0.25
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def cache_version(key):
+    """
+    Current version token stored under `key` in the shared cache, creating one if missing.
+
+    Tokens are random rather than incrementing so an evicted version can never
+    come back as a value an old cache entry was built against.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key):
+    """Replace the version token under `key`, invalidating everything built against the old one"""
+    cache.set(key, uuid.uuid4().hex, None)
+
+
+def cache_is_shared():
+    """
+    Whether the default cache is one store for every process.
+
+    Per-process caches (the LocMem fallback when REDIS_URL is unset) only see
+    the version bumps of the process that made them, so data kept outside the
+    cache must not rely on their tokens.
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
 
 
 def send_notification_with_counts(user, notification_data):
@@ -20,20 +79,355 @@ def send_notification_with_counts(user, notification_data):
     Returns:
         None - sends notification via WebSocket channel layer
     """
-    # Calculate current unread counts for this user
-    unread_count = Notifications.objects.filter(user=user, is_read=False).count()
-    unread_messages = ReadStatus.objects.filter(user=user, read=False).count()
+    # Read the maintained unread counters for this user
+    unread_count, unread_messages = UnreadCounter.get_counts(user)
 
     # Add counts to notification payload
     notification_data['unread_count'] = unread_count
     notification_data['unread_messages'] = unread_messages
 
-    # Send via WebSocket
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"user_{user.id}",
-        {
-            "type": "send_notification",
-            "notification": notification_data
-        }
+    # Send via WebSocket once the surrounding transaction (if any) commits
+    push_notifications([(user.id, notification_data)])
+
+
+# Pool running WebSocket consumer database work, see database_task
+_database_executor = None
+
+
+def configure_database_executor(max_workers):
+    """Replace the consumer database pool with one of `max_workers` threads"""
+    global _database_executor
+    previous = _database_executor
+    _database_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ws-db')
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+def _run_database_task(func, args, kwargs):
+    # Each pool thread keeps its own connection; honour CONN_MAX_AGE and health checks
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def database_task(func):
+    """
+    Turn a sync ORM function into a coroutine that runs on the consumer database pool.
+
+    sync_to_async and the async ORM both hop into one thread-sensitive executor,
+    so every socket on a Daphne process would queue behind a single thread. This
+    pool has WEBSOCKET_DB_WORKERS threads, which bounds the connections it opens.
+    Decorated functions must not depend on thread-local state such as an open
+    transaction in the caller.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if _database_executor is None:
+            configure_database_executor(settings.WEBSOCKET_DB_WORKERS)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_database_executor, _run_database_task, func, args, kwargs)
+    return wrapper
+
+
+async def group_send_many(channel_layer, events):
+    """Send every (group, event) pair concurrently on one event loop"""
+    await asyncio.gather(*(
+        channel_layer.group_send(group, event) for group, event in events
+    ))
+
+
+def push_notifications(payloads):
+    """
+    Push several already-built notification payloads in one channel layer batch.
+
+    Args:
+        payloads: list of (user_id, notification_data) tuples
+
+    Returns:
+        None - all group_sends share a single async_to_sync hop instead of one each.
+        Inside a transaction the send is deferred until commit, so a rolled back
+        (and retried) fan-out never pushes twice.
+    """
+    if not payloads:
+        return
+
+    events = [
+        (
+            f"user_{user_id}",
+            {
+                "type": "send_notification",
+                "notification": notification_data
+            }
+        )
+        for user_id, notification_data in payloads
+    ]
+    transaction.on_commit(lambda: async_to_sync(group_send_many)(get_channel_layer(), events))
+
+
+def push_unread_counts(user_ids):
+    """
+    Tell users' notification sockets that their unread counts changed.
+
+    Args:
+        user_ids: iterable of user ids whose counters moved
+
+    Returns:
+        None - sends a count-free `unread_counts_changed` event per user. Each
+        NotificationConsumer merges these and reads the counters once per
+        COUNT_PUSH_WINDOW, so bulk actions cost one frame instead of one per
+        change. Deferred until commit like push_notifications.
+    """
+    events = [
+        (f"user_{user_id}", {"type": "unread_counts_changed"})
+        for user_id in dict.fromkeys(user_ids)
+    ]
+    if events:
+        transaction.on_commit(lambda: async_to_sync(group_send_many)(get_channel_layer(), events))
+
+
+def send_bulk_notifications(users, notification_data, skip_push=(), **notification_fields):
+    """
+    Create the same notification for many users and push it with unread counts.
+
+    Replaces a per-recipient Notifications.objects.create + send_notification_with_counts
+    loop with one bulk_create, one counter update, one counter read and one
+    batched channel layer send.
+
+    Args:
+        users: iterable of CustomAccount objects - the recipients
+        notification_data: dict - shared WebSocket payload; each recipient's copy
+            gets its own notification "id" and unread counts
+        skip_push: iterable of user ids that get the notification row but no push
+            (e.g. the user who triggered the event)
+        **notification_fields: Notifications fields shared by every row
+            (message, content, link, prescription, drug, ...)
+
+    Returns:
+        list of created Notifications
+    """
+    users = list({user.id: user for user in users}.values())
+    if not users:
+        return []
+
+    notifications = Notifications.objects.bulk_create([
+        Notifications(user=user, **notification_fields) for user in users
+    ])
+
+    # bulk_create skips post_save, so move the counters here in one UPDATE
+    user_ids = [user.id for user in users]
+    UnreadCounter.adjust_many(user_ids, notifications=1)
+
+    skip_push = set(skip_push)
+    push_ids = [user_id for user_id in user_ids if user_id not in skip_push]
+    counts = UnreadCounter.get_counts_many(push_ids)
+
+    push_notifications([
+        (
+            notification.user_id,
+            {
+                **notification_data,
+                "id": notification.id,
+                "unread_count": counts[notification.user_id][0],
+                "unread_messages": counts[notification.user_id][1],
+            }
+        )
+        for notification in notifications
+        if notification.user_id in counts
+    ])
+
+    return notifications
+
+
+def _encode_cursor(moment, pk):
+    """Opaque keyset cursor (microsecond timestamp + id)"""
+    micros = (moment - _EPOCH) // timedelta(microseconds=1)
+    return f"{micros}_{pk}"
+
+
+def _decode_cursor(cursor):
+    """Inverse of _encode_cursor. Raises ValueError on malformed input."""
+    micros, pk = cursor.split('_')
+    return _EPOCH + timedelta(microseconds=int(micros)), int(pk)
+
+
+def encode_notification_cursor(notification):
+    """Opaque keyset cursor pointing at a notification"""
+    return _encode_cursor(notification.time, notification.id)
+
+
+def decode_notification_cursor(cursor):
+    """Inverse of encode_notification_cursor. Raises ValueError on malformed input."""
+    return _decode_cursor(cursor)
+
+
+def notification_page(user, cursor=None, page_size=NOTIFICATION_PAGE_SIZE):
+    """
+    Return one newest-first page of a user's notifications.
+
+    Args:
+        user: CustomAccount object - owner of the notifications
+        cursor: str - cursor returned by the previous page, or None for the newest page
+        page_size: int - maximum number of notifications to return
+
+    Returns:
+        (list of Notifications, next cursor or None when there are no older rows)
+    """
+    notifications = Notifications.objects.for_dropdown(user)
+
+    if cursor:
+        time, noti_id = decode_notification_cursor(cursor)
+        notifications = notifications.filter(Q(time__lt=time) | Q(time=time, id__lt=noti_id))
+
+    # Fetch one extra row to know whether another page exists
+    page = list(notifications[:page_size + 1])
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_notification_cursor(page[-1])
+    return page, None
+
+
+def serialize_notification(notification):
+    """Flatten a dropdown notification into the fields base.html renders"""
+    if notification.reminder_id:
+        href = f"{reverse('reminders')}#reminder_{notification.reminder_id}"
+        text = f"Time to take your {notification.reminder.medicine_name}"
+    elif notification.content:
+        href = notification.link
+        text = notification.content
+    elif notification.message.sender.role != 'system':
+        message = notification.message
+        href = f"{reverse('threads', args=[message.thread_id])}#message_{message.id}"
+        text = f"{message.sender.first_name} {message.sender.last_name} has sent you a new message."
+    else:
+        href = notification.message.link
+        text = notification.message.content
+
+    return {
+        'id': notification.id,
+        'is_read': notification.is_read,
+        'href': href or '#',
+        'text': text,
+        'time': date_format(timezone.localtime(notification.time), 'DATETIME_FORMAT'),
+    }
+
+
+def inbox_threads(user):
+    """
+    Annotated queryset backing the messages inbox.
+
+    Each thread carries its latest message (latest_msg_id, latest_msg_content,
+    latest_msg_timestamp), the user's unread_count and, once evaluated, the
+    counterparty list in other_participants - without per-thread queries.
+
+    Args:
+        user: CustomAccount object - the inbox owner
+
+    Returns:
+        QuerySet of Thread ordered newest first by (last_updated, id)
+    """
+    latest = Message.objects.filter(thread=OuterRef('pk')).order_by('-timestamp', '-id')
+    # Correlated per returned thread, served by readstatus_user_unread_idx, so the page bounds the work
+    unread = (
+        ReadStatus.objects.filter(user=user, read=False, message__thread=OuterRef('pk'))
+        .order_by().values('message__thread').annotate(total=Count('id')).values('total')
+    )
+
+    if user.role == 'patient':
+        counterparts = CustomAccount.objects.filter(role='pharmacy admin').select_related('pharmacyprofile')
+    elif user.role in ['pharmacy admin', 'pharmacist']:
+        counterparts = CustomAccount.objects.filter(role='patient')
+    else:
+        counterparts = CustomAccount.objects.exclude(id=user.id)
+
+    return (
+        Thread.objects.filter(participant=user)
+        .exclude(participant__role='system')
+        .annotate(
+            latest_msg_id=Subquery(latest.values('id')[:1]),
+            latest_msg_content=Subquery(latest.values('content')[:1]),
+            latest_msg_timestamp=Subquery(latest.values('timestamp')[:1]),
+            unread_count=Coalesce(Subquery(unread[:1]), 0),
+        )
+        .prefetch_related(Prefetch('participant', queryset=counterparts.order_by('id'), to_attr='other_participants'))
+        .order_by('-last_updated', '-id')
     )
+
+
+def inbox_page(user, cursor=None, page_size=INBOX_PAGE_SIZE):
+    """
+    Return one newest-first page of a user's message threads.
+
+    Args:
+        user: CustomAccount object - the inbox owner
+        cursor: str - cursor returned by the previous page, or None for the newest page
+        page_size: int - maximum number of threads to return
+
+    Returns:
+        (list of Thread, next cursor or None when there are no older threads)
+    """
+    threads = inbox_threads(user)
+
+    if cursor:
+        last_updated, thread_id = _decode_cursor(cursor)
+        threads = threads.filter(Q(last_updated__lt=last_updated) | Q(last_updated=last_updated, id__lt=thread_id))
+
+    # Fetch one extra row to know whether another page exists
+    page = list(threads[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = _encode_cursor(page[-1].last_updated, page[-1].id)
+
+    # Patients and pharmacy staff only ever see their single counterparty
+    if user.role in ['patient', 'pharmacy admin', 'pharmacist']:
+        for thread in page:
+            thread.other_participants = thread.other_participants[:1]
+
+    return page, next_cursor
+
+
+def thread_history(user, thread, cursor=None, page_size=THREAD_PAGE_SIZE):
+    """
+    Return one page of a thread's messages, walking backwards from the newest.
+
+    Args:
+        user: CustomAccount object - the viewer, whose ReadStatus fills user_read
+        thread: Thread object or id - the thread to read
+        cursor: str - cursor returned by the previous page, or None for the newest page
+        page_size: int - maximum number of messages to return
+
+    Returns:
+        (list of Message oldest first, cursor for the older page or None at the start of the thread)
+    """
+    messages = Message.objects.filter(thread=thread).select_related('sender').annotate(
+        user_read=Exists(ReadStatus.objects.filter(message=OuterRef('pk'), user=user, read=True))
+    ).order_by('-timestamp', '-id')
+
+    if cursor:
+        timestamp, message_id = _decode_cursor(cursor)
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+
+    # Fetch one extra row to know whether another page exists
+    page = list(messages[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = _encode_cursor(page[-1].timestamp, page[-1].id)
+
+    page.reverse()
+    return page, next_cursor
+
+
+def serialize_message(message, user):
+    """Flatten a thread_history message into the fields threads.html renders"""
+    return {
+        'id': message.id,
+        'sender': f"{message.sender.first_name} {message.sender.last_name}",
+        'is_sender': message.sender_id == user.id,
+        'content': message.content,
+        'link': message.link,
+        'read': message.user_read,
+        'timestamp': date_format(timezone.localtime(message.timestamp), 'DATETIME_FORMAT'),
+    }
@@ -1,5 +1,5 @@
 from django.shortcuts import render, redirect
-from .models import Message, Notifications, CustomAccount, Thread, ReadStatus
+from .models import Message, Notifications, CustomAccount, Thread, ReadStatus, UnreadCounter
 from .forms import UserRegistrationForm, LoginForm, AccountUpdateForm, PasswordUpdateForm, MessageForm
 from pharmacy.forms import PharmacyProfileForm, PharmacistProfileForm
 from patients.forms import PatientProfileForm
@@ -14,12 +14,11 @@ import json
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.timezone import localtime
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Count, Q
 from django.shortcuts import render, get_object_or_404
 from django.views.decorators.cache import never_cache
+from .utils import inbox_page, notification_page, push_unread_counts, serialize_message, serialize_notification, thread_history
 
 
 # Create your views here.
@@ -214,67 +213,32 @@ def account_messages(request):
     patient = None
 
     if request.user.role == 'patient':
-        patient = PatientProfile.objects.get(user=request.user)
-  
-    user_threads = (
-        Thread.objects.filter(participant=request.user)
-        .exclude(participant__role='system')
-        .distinct()
-        .order_by('-last_updated')
-    )
+        patient = request.patient_profile
 
-    for thread in user_threads:
-        
-        if request.user.role == 'patient':
-            pharmacy_admin = thread.participant.filter(role='pharmacy admin').first()
-            thread.other_participants = [pharmacy_admin] if pharmacy_admin else []
-        elif request.user.role in ['pharmacy admin', 'pharmacist']:
-            patient_user = thread.participant.filter(role='patient').first()
-            thread.other_participants = [patient_user] if patient_user else []
-        else:
-            thread.other_participants = thread.participant.exclude(id=request.user.id)
-
-        latest = thread.latest_message
-        thread.latest_msg = latest
-
-        if latest:
-            read_status = ReadStatus.objects.filter(
-                message=latest,
-                user=request.user
-            ).first()
-
-            thread.user_read = read_status.read if read_status else False
-            thread.unread_count = ReadStatus.objects.filter(
-                message__thread=thread,
-                user=request.user,
-                read=False
-            ).count()
-        else:
-            thread.user_read = True
-            thread.unread_count = 0
-            thread.latest_msg = None
+    try:
+        user_threads, next_cursor = inbox_page(request.user, request.GET.get('cursor') or None)
+    except ValueError:
+        user_threads, next_cursor = inbox_page(request.user)
 
     return render(request, 'messages.html', {
         'threads': user_threads,
+        'next_cursor': next_cursor,
         'pharmacy_name': pharmacy_name,
         'patient': patient
     })
 
 
 def message_search(request):
-    thread = Thread.objects.filter(participant=request.user).all()
-    messages = Message.objects.filter(thread__in=thread).all()
-
     query = request.GET.get('q', '').strip()
 
     if query:
-        items = messages.filter(content__icontains=query)
+        items = Message.objects.filter(thread__participant=request.user).search(query)
 
         results= [
             {
                 'content': item.content, 
                 'id': item.id, 
-                'thread_id': item.thread.id
+                'thread_id': item.thread_id
             } 
             for item in items
         ]
@@ -286,39 +250,25 @@ def message_search(request):
 
 def thread_view(request, thread_id):
     thread = get_object_or_404(Thread, id=thread_id)
-    messages = thread.messages.all().order_by("timestamp")
 
-    ReadStatus.objects.filter(
+    marked_read = ReadStatus.objects.filter(
         message__thread=thread,
         user=request.user,
         read=False
     ).update(read=True)
+    UnreadCounter.adjust(request.user.id, messages=-marked_read)
 
-    Notifications.objects.filter(
+    thread_notifications = Notifications.objects.filter(
         user=request.user,
         message__thread=thread,
-    ).delete()
-
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"user_{request.user.id}",
-        {
-            "type": "send_notification",
-            "notification": {
-                "id": 0, 
-                "unread_count": Notifications.objects.filter(user=request.user, is_read=False).count(),
-                "unread_messages": ReadStatus.objects.filter(user=request.user, read=False).count(),
-            },
-        }
     )
+    UnreadCounter.uncount(notifications=thread_notifications)
+    thread_notifications.delete()
+
+    push_unread_counts([request.user.id])
 
-    read_status = ReadStatus.objects.filter(
-        message__in=messages,
-        user=request.user
-    ).values_list('message_id', 'read')
-    read_map = dict(read_status)
-    for message in messages:
-        message.user_read = read_map.get(message.id, False)
+    # Only the newest page is rendered; older pages load through thread_messages or the socket
+    messages, next_cursor = thread_history(request.user, thread)
 
     system_user = thread.participant.all().filter(role='system').first()
     can_message = True  # Default to allowing messaging
@@ -341,11 +291,11 @@ def thread_view(request, thread_id):
             from pharmacy.models import PharmacyProfile
 
             try:
-                patient_profile = PatientProfile.objects.get(user=request.user)
+                patient_profile = request.patient_profile
                 thread_pharmacy = PharmacyProfile.objects.get(user=other_user)
 
                 # Patient can only message if their current pharmacy matches the thread pharmacy
-                can_message = patient_profile.pharmacy == thread_pharmacy
+                can_message = patient_profile is not None and patient_profile.pharmacy_id == thread_pharmacy.id
             except (PatientProfile.DoesNotExist, PharmacyProfile.DoesNotExist):
                 can_message = False
     else:
@@ -357,11 +307,46 @@ def thread_view(request, thread_id):
     return render(request, 'threads.html', {
         'thread': thread,
         'messages': messages,
+        'next_cursor': next_cursor,
         'form': form,
         'other_user': other_user,
         'can_message': can_message
     })
 
+
+@login_required
+def thread_messages(request, thread_id):
+    """
+    AJAX endpoint returning older messages of a thread, one cursor page at a time
+    """
+    thread = get_object_or_404(Thread, id=thread_id, participant=request.user)
+
+    try:
+        messages, next_cursor = thread_history(request.user, thread, request.GET.get('cursor') or None)
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+
+    return JsonResponse({
+        'messages': [serialize_message(message, request.user) for message in messages],
+        'next_cursor': next_cursor,
+    })
+
+
+@login_required
+def notification_feed(request):
+    """
+    AJAX endpoint returning older dropdown notifications, one cursor page at a time
+    """
+    try:
+        notifications, next_cursor = notification_page(request.user, request.GET.get('cursor') or None)
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+
+    return JsonResponse({
+        'notifications': [serialize_notification(noti) for noti in notifications],
+        'next_cursor': next_cursor,
+    })
+
         
 def delete_notification(request):
     if request.method == 'POST':
@@ -376,24 +361,13 @@ def delete_notification(request):
             except ObjectDoesNotExist:
                 return JsonResponse({"error": "Notification not found"}, status=404)
 
+            # Deletes send no counter signals; a single row needs no grouped count
+            if not notification.is_read:
+                UnreadCounter.adjust(notification.user_id, notifications=-1)
             notification.delete()
 
-            # Calculate fresh counts after deletion
-            unread_count = Notifications.objects.filter(user=request.user, is_read=False).count()
-            unread_messages = ReadStatus.objects.filter(user=request.user, read=False).count()
-
-            # Send count-only update via WebSocket
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"user_{request.user.id}",
-                {
-                    "type": "send_notification",
-                    "notification": {
-                        "unread_count": unread_count,
-                        "unread_messages": unread_messages,
-                    }
-                }
-            )
+            # Count-only update, coalesced by the notification socket
+            push_unread_counts([request.user.id])
 
             return JsonResponse({"success": True})
 
@@ -416,11 +390,10 @@ def patient_thread(request):
 
         if request.user.role == 'pharmacy admin':
             pharmacy_user = request.user
-            pharmacy = PharmacyProfile.objects.get(user=request.user)
+            pharmacy = request.pharmacy
 
         elif request.user.role == 'pharmacist':
-            pharmacist_profile = PharmacistProfile.objects.get(user=request.user)
-            pharmacy = pharmacist_profile.pharmacy
+            pharmacy = request.pharmacy
             pharmacy_user = pharmacy.user
         else:
             pharmacy = patient_profile.pharmacy
@@ -465,25 +438,12 @@ def read_notification(request):
             except ObjectDoesNotExist:
                 return JsonResponse({"error": "Notification not found"}, status=404)
 
-            notification.is_read = True
-            notification.save()
-
-            # Calculate fresh counts after marking as read
-            unread_count = Notifications.objects.filter(user=request.user, is_read=False).count()
-            unread_messages = ReadStatus.objects.filter(user=request.user, read=False).count()
-
-            # Send count-only update via WebSocket
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"user_{request.user.id}",
-                {
-                    "type": "send_notification",
-                    "notification": {
-                        "unread_count": unread_count,
-                        "unread_messages": unread_messages,
-                    }
-                }
-            )
+            # Conditional update so only a real unread -> read transition moves the counter
+            if Notifications.objects.filter(id=notification.id, is_read=False).update(is_read=True):
+                UnreadCounter.adjust(notification.user_id, notifications=-1)
+
+            # Count-only update, coalesced by the notification socket
+            push_unread_counts([request.user.id])
 
             return JsonResponse({"success": True})
         except json.JSONDecodeError:
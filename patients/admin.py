@@ -1,4 +1,5 @@
 from django.contrib import admin
+from accounts.admin import UnreadCounterAdmin
 from .models import PatientProfile, MedicationReminder, ReminderTime
 
 # Register your models here.
@@ -7,8 +8,8 @@ class ReminderTimeInline(admin.TabularInline):
     extra = 1      # Show 1 empty form by default
     max_num = 5    # Allow a max of 5 total ReminderTime entries
 
-class MedicationReminderAdmin(admin.ModelAdmin):
+class MedicationReminderAdmin(UnreadCounterAdmin):
     inlines = [ReminderTimeInline]
 
-admin.site.register(PatientProfile)
+admin.site.register(PatientProfile, UnreadCounterAdmin)
 admin.site.register(MedicationReminder, MedicationReminderAdmin)
@@ -147,4 +147,4 @@ class ReminderForm(forms.ModelForm):
         })
 
         if patient:
-            self.fields['prescription'].queryset = Prescription.objects.filter(patient=patient)
\ No newline at end of file
+            self.fields['prescription'].queryset = Prescription.objects.filter(patient=patient).select_related('medicine')
\ No newline at end of file
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:05
+
+from datetime import datetime, timedelta
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def schedule_active_times(apps, schema_editor):
+    """Give every active reminder time its first next_fire_at so it keeps firing"""
+    ReminderTime = apps.get_model('patients', 'ReminderTime')
+    now = timezone.localtime()
+    to_update = []
+    for reminder_time in ReminderTime.objects.filter(
+        is_active=True, reminder__is_active=True, reminder__is_archived=False
+    ):
+        candidate = timezone.make_aware(datetime.combine(now.date(), reminder_time.time))
+        if candidate <= now:
+            candidate = timezone.make_aware(datetime.combine(now.date() + timedelta(days=1), reminder_time.time))
+        reminder_time.next_fire_at = candidate
+        to_update.append(reminder_time)
+    ReminderTime.objects.bulk_update(to_update, ['next_fire_at'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0020_alter_patientprofile_gender'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='remindertime',
+            name='task_id',
+        ),
+        migrations.AddField(
+            model_name='remindertime',
+            name='next_fire_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(schedule_active_times, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:40
+
+from django.db import migrations
+
+POSTGRES_FORWARDS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS patients_patientprofile_first_name_trgm ON patients_patientprofile USING gin (first_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS patients_patientprofile_last_name_trgm ON patients_patientprofile USING gin (last_name gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS patients_patientprofile_first_name_trgm",
+    "DROP INDEX IF EXISTS patients_patientprofile_last_name_trgm",
+]
+
+
+def run_postgres_sql(statements):
+    # Trigram indexes only exist on PostgreSQL; other backends search an in-process trie
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0021_remindertime_next_fire_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgres_sql(POSTGRES_FORWARDS), run_postgres_sql(POSTGRES_BACKWARDS)),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0022_patientprofile_name_trigram_indexes'),
+        ('pharmacy', '0017_drug_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicationreminder',
+            index=models.Index(fields=['user', 'is_archived', 'is_active'], name='reminder_user_state_idx'),
+        ),
+        migrations.AlterField(
+            model_name='medicationreminder',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='patients.patientprofile'),
+        ),
+    ]
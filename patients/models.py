@@ -1,12 +1,9 @@
 from django.db import models
 from accounts.models import CustomAccount
 from pharmacy.models import PharmacyProfile, Prescription
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from django.utils import timezone
 from django.core.validators import MinValueValidator
-from django.db.models.signals import pre_delete
-from django.dispatch import receiver
-from celery import current_app
 
 class PatientProfile(models.Model):
     GENDER_CHOICES = [
@@ -28,7 +25,8 @@ class PatientProfile(models.Model):
         return f"{self.user}"
 
 class MedicationReminder(models.Model):
-    user = models.ForeignKey(PatientProfile, on_delete=models.CASCADE)
+    # Indexed as the prefix of reminder_user_state_idx
+    user = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, db_index=False)
     prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE)
     frequency = models.PositiveIntegerField(choices=[(i, f"{i}") for i in range(1, 6)])
     start_date = models.DateField(default=date.today)
@@ -38,6 +36,12 @@ class MedicationReminder(models.Model):
     remaining_days = models.PositiveIntegerField(null=True, blank=True)
     restoration_time = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # Active / archived reminder lists of one patient
+            models.Index(fields=['user', 'is_archived', 'is_active'], name='reminder_user_state_idx'),
+        ]
+
     def __str__(self):
         status = "Archived" if self.is_archived else "Active"
         return f"{self.user} - {self.prescription.medicine.name} | {self.id} | {status} | {self.remaining_days} days left"
@@ -63,18 +67,28 @@ class ReminderTime(models.Model):
     reminder = models.ForeignKey(MedicationReminder, on_delete=models.CASCADE, related_name='times')
     time = models.TimeField()
     is_active = models.BooleanField(default=True)
-    task_id = models.CharField(max_length=255, blank=True, null=True)
+    # Next moment the scheduler tick should fire this time; None while paused
+    next_fire_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def compute_next_fire(self, now=None, include_current_minute=False):
+        """
+        Next local occurrence of this reminder's wall-clock time.
+
+        include_current_minute lets a time set for the current minute fire on
+        the next tick instead of tomorrow (used when a reminder is created).
+        """
+        now = timezone.localtime(now)
+        candidate = timezone.make_aware(datetime.combine(now.date(), self.time))
+
+        if include_current_minute:
+            passed = candidate < now.replace(second=0, microsecond=0)
+        else:
+            passed = candidate <= now
 
+        if passed:
+            candidate = timezone.make_aware(datetime.combine(now.date() + timedelta(days=1), self.time))
+        return candidate
 
-# Signal to cancel Celery tasks when reminder is deleted
-@receiver(pre_delete, sender=MedicationReminder)
-def cancel_reminder_tasks(sender, instance, **kwargs):
-    """Cancel all Celery tasks associated with a reminder before deletion"""
-    for reminder_time in instance.times.all():
-        if reminder_time.task_id:
-            try:
-                current_app.control.revoke(reminder_time.task_id, terminate=True)
-                print(f"Revoked task {reminder_time.task_id} for deleted reminder {instance.id}")
-            except Exception as e:
-                print(f"Failed to revoke task {reminder_time.task_id}: {e}")
-   
+    def schedule(self, now=None, include_current_minute=False):
+        """Set next_fire_at to the next occurrence (caller saves)"""
+        self.next_fire_at = self.compute_next_fire(now, include_current_minute)
@@ -1,3 +1,95 @@
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
 from django.test import TestCase
+from django.utils import timezone
+from accounts.models import CustomAccount, Notifications
+from accounts.tasks import REMINDER_GRACE, dispatch_due_reminders
+from patients.models import MedicationReminder, PatientProfile, ReminderTime
+from pharmacy.models import Drug, Prescription
 
-# Create your tests here.
+
+def local(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class ComputeNextFireTests(TestCase):
+    def reminder_time(self, hour, minute):
+        return ReminderTime(time=time(hour, minute))
+
+    def test_later_today(self):
+        self.assertEqual(self.reminder_time(9, 0).compute_next_fire(local(2026, 5, 4, 8, 30)), local(2026, 5, 4, 9, 0))
+
+    def test_passed_or_current_time_moves_to_tomorrow(self):
+        for now in (local(2026, 5, 4, 9, 0), local(2026, 5, 4, 9, 0, 30), local(2026, 5, 4, 17, 0)):
+            self.assertEqual(self.reminder_time(9, 0).compute_next_fire(now), local(2026, 5, 5, 9, 0))
+
+    def test_include_current_minute(self):
+        reminder_time = self.reminder_time(9, 0)
+        self.assertEqual(reminder_time.compute_next_fire(local(2026, 5, 4, 9, 0, 30), include_current_minute=True),
+                         local(2026, 5, 4, 9, 0))
+        self.assertEqual(reminder_time.compute_next_fire(local(2026, 5, 4, 9, 1), include_current_minute=True),
+                         local(2026, 5, 5, 9, 0))
+
+    def test_keeps_wall_clock_time_across_dst(self):
+        # US clocks spring forward on 2026-03-08
+        next_fire = self.reminder_time(9, 0).compute_next_fire(local(2026, 3, 7, 10, 0))
+        self.assertEqual(timezone.localtime(next_fire).time(), time(9, 0))
+        # Only 23 real hours after the previous 09:00
+        self.assertEqual(next_fire.astimezone(dt_timezone.utc) - local(2026, 3, 7, 9, 0).astimezone(dt_timezone.utc),
+                         timedelta(hours=23))
+
+
+class DispatchDueRemindersTests(TestCase):
+    def setUp(self):
+        self.user = CustomAccount.objects.create(username='patient', email='patient@example.com', role='patient')
+        patient = PatientProfile.objects.create(user=self.user, first_name='Pa', last_name='Tient',
+                                                dob=date(1980, 1, 1), gender='F', phone_number='555-0100')
+        drug = Drug.objects.create(name='Ibuprofen', brand='Advil', description='Pain reliever', dosage='200mg')
+        prescription = Prescription.objects.create(patient=patient, medicine=drug, quantity=30,
+                                                   expiration_date=date.today() + timedelta(days=90))
+        self.reminder = MedicationReminder.objects.create(user=patient, prescription=prescription,
+                                                          frequency=1, day_amount=30)
+
+    def due(self, ago, **fields):
+        now = timezone.now()
+        return ReminderTime.objects.create(
+            reminder=self.reminder, time=timezone.localtime(now - ago).time(), next_fire_at=now - ago, **fields
+        )
+
+    def test_sends_due_times_and_advances_them(self):
+        reminder_time = self.due(timedelta(minutes=1))
+
+        self.assertEqual(dispatch_due_reminders(), 1)
+
+        self.assertEqual(Notifications.objects.filter(user=self.user, reminder=self.reminder).count(), 1)
+        reminder_time.refresh_from_db()
+        self.assertGreater(reminder_time.next_fire_at, timezone.now())
+        self.assertEqual(timezone.localtime(reminder_time.next_fire_at).time(), reminder_time.time)
+        # Advanced, so the next tick has nothing to send
+        self.assertEqual(dispatch_due_reminders(), 0)
+
+    def test_skips_times_missed_beyond_the_grace_period(self):
+        reminder_time = self.due(REMINDER_GRACE + timedelta(minutes=5))
+
+        self.assertEqual(dispatch_due_reminders(), 0)
+
+        self.assertFalse(Notifications.objects.exists())
+        reminder_time.refresh_from_db()
+        self.assertGreater(reminder_time.next_fire_at, timezone.now())
+
+    def test_ignores_future_and_paused_times(self):
+        future = ReminderTime.objects.create(reminder=self.reminder, time=time(9, 0),
+                                             next_fire_at=timezone.now() + timedelta(hours=1))
+        paused = self.due(timedelta(minutes=1), is_active=False)
+
+        self.assertEqual(dispatch_due_reminders(), 0)
+
+        for reminder_time, next_fire_at in ((future, future.next_fire_at), (paused, paused.next_fire_at)):
+            reminder_time.refresh_from_db()
+            self.assertEqual(reminder_time.next_fire_at, next_fire_at)
+
+    def test_ignores_archived_reminders(self):
+        self.due(timedelta(minutes=1))
+        MedicationReminder.objects.filter(id=self.reminder.id).update(is_active=False, is_archived=True)
+
+        self.assertEqual(dispatch_due_reminders(), 0)
+        self.assertFalse(Notifications.objects.exists())
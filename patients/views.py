@@ -1,8 +1,7 @@
 from django.shortcuts import render, redirect
 from pharmacy.models import Prescription, PharmacistProfile
 from .models import PatientProfile, MedicationReminder, ReminderTime
-from accounts.models import CustomAccount, Notifications, Message, Thread
-from accounts.utils import send_notification_with_counts
+from accounts.models import CustomAccount, Notifications, Message, Thread, UnreadCounter
 from django.db.models import Prefetch
 from .forms import ReminderForm, PharmacyForm
 from datetime import datetime, date, timedelta
@@ -10,16 +9,16 @@ from django.http import JsonResponse
 from django.utils import timezone
 from django.utils.timezone import now as tz_now
 import json
-from accounts.tasks import send_reminder
-from celery import current_app
+from accounts.tasks import event_key, notify_refill_requested
+from django.db import transaction
 from django.contrib import messages
 from django.urls import reverse
 
 def patient_home(request):
-    patient = PatientProfile.objects.get(user=request.user)
+    patient = request.patient_profile
 
     #prescription preview
-    recent_prescriptions = patient.prescription.with_latest_ordering()[:3]
+    recent_prescriptions = patient.prescription.select_related('medicine').with_latest_ordering()[:3]
 
     # Prescription count (unexpired only)
     from django.db.models import Q
@@ -47,9 +46,10 @@ def patient_home(request):
 
     for reminder in active_reminders:
         now = timezone.localtime().time()
-        times_today = reminder.times.filter(is_active=True).order_by('time')
+        # Filter the prefetched times in Python rather than querying per reminder
+        times_today = sorted((t for t in reminder.times.all() if t.is_active), key=lambda t: t.time)
         reminder.next_time = next((t.time for t in times_today if t.time > now),
-                                  times_today.first().time if times_today.exists() else None)
+                                  times_today[0].time if times_today else None)
 
         if reminder.next_time:
             if any(t.time > now for t in times_today):
@@ -106,16 +106,16 @@ def patient_home(request):
     return render(request, 'patient_home.html', context)
 
 def prescriptions(request):
-    patient = PatientProfile.objects.get(user=request.user)
-    all_prescriptions = patient.prescription.with_latest_ordering()
+    patient = request.patient_profile
+    all_prescriptions = patient.prescription.select_related('medicine', 'prescribed_by__pharmacy').with_latest_ordering()
     return render(request, 'prescriptions.html', {
         'prescriptions': all_prescriptions,
     })
 
 def my_pharmacy(request):
-    patient = PatientProfile.objects.get(user=request.user)
+    patient = request.patient_profile
     current_pharmacy = patient.pharmacy
-    pharmacists = PharmacistProfile.objects.filter(pharmacy=current_pharmacy).all()
+    pharmacists = PharmacistProfile.objects.filter(pharmacy=current_pharmacy).select_related('user')
 
     if request.method == 'POST':
         form = PharmacyForm(request.POST, instance=patient)
@@ -132,18 +132,20 @@ def my_pharmacy(request):
     })
 
 def account(request):
-    return render(request, 'account.html')
+    # Patients manage their account on the shared settings page; there is no account.html
+    return redirect('account_settings')
 
 def reminders(request):
-    patient = PatientProfile.objects.get(user=request.user)
+    patient = request.patient_profile
 
     reminders = MedicationReminder.objects.filter(user=patient,is_archived=False, is_active=True)
     for reminder in reminders:
         if reminder.days_left() == 0:
             reminder.archive()
             
-    all_reminders = MedicationReminder.objects.filter(user=patient, is_archived=False).order_by('-restoration_time').all()
-    archived_reminders = MedicationReminder.objects.filter(user=patient, is_archived=True).order_by('-restoration_time').all()
+    reminder_rows = MedicationReminder.objects.select_related('prescription__medicine').prefetch_related('times')
+    all_reminders = reminder_rows.filter(user=patient, is_archived=False).order_by('-restoration_time')
+    archived_reminders = reminder_rows.filter(user=patient, is_archived=True).order_by('-restoration_time')
 
     time_values = [] 
     selected_prescription_id = None
@@ -175,21 +177,10 @@ def reminders(request):
                     time_str = request.POST[time]
                     if time_str:
                         time_obj = datetime.strptime(time_str, "%H:%M").time().replace(second=0, microsecond=0)
-                        rt = ReminderTime.objects.create(reminder=reminder, time=time_obj)
-                        now = timezone.localtime()
-                        eta = timezone.make_aware(datetime.combine(date.today(), time_obj))
-                        if eta < now:
-                            eta += timedelta(days=1)
-                        
-                        if eta.hour == now.hour and eta.minute == now.minute:
-                            eta = now + timedelta(seconds=1)
-
-                        task = send_reminder.apply_async(
-                            args=[rt.id],
-                            eta=eta
-                        )
-                        rt.task_id = task.id
-                        rt.save(update_fields=["task_id"])
+                        rt = ReminderTime(reminder=reminder, time=time_obj)
+                        # A time in the current minute fires on the next scheduler tick
+                        rt.schedule(include_current_minute=True)
+                        rt.save()
 
             return redirect('reminders')
     else:
@@ -223,6 +214,10 @@ def toggle_time(request):
             time_id = data.get('time_id')
             reminder_time = ReminderTime.objects.get(id=time_id)
             reminder_time.is_active = not reminder_time.is_active
+            if reminder_time.is_active:
+                reminder_time.schedule()
+            else:
+                reminder_time.next_fire_at = None
             reminder_time.save()
             return JsonResponse({"success": True})
         except json.JSONDecodeError:
@@ -240,35 +235,17 @@ def toggle_reminder(request):
                 end_date = reminder.start_date + timedelta(days=reminder.day_amount)
                 remaining = (end_date - date.today()).days
                 reminder.remaining_days = max(0, remaining)
-                reminder.times.update(is_active = False)
+                reminder.times.update(is_active = False, next_fire_at = None)
             else:
                 # Turning ON: Reset start_date and clear remaining_days
                 reminder.start_date = date.today()
                 reminder.remaining_days = None
-                reminder.times.update(is_active = True)
 
-                for time_entry in reminder.times.all():
+                time_entries = list(reminder.times.all())
+                for time_entry in time_entries:
                     time_entry.is_active = True
-
-                    if time_entry.task_id:
-                        try:
-                            current_app.control.revoke(time_entry.task_id)
-                        except Exception:
-                            pass
-
-                    now = timezone.localtime()
-                    eta = timezone.make_aware(
-                        datetime.combine(date.today(), time_entry.time)
-                    )
-                    if eta <= now:
-                        eta += timedelta(days=1)
-                    
-                    task = send_reminder.apply_async(
-                        args=[time_entry.id],
-                        eta=eta
-                    )
-                    time_entry.task_id = task.id
-                    time_entry.save(update_fields=["is_active", "task_id"])
+                    time_entry.schedule()
+                ReminderTime.objects.bulk_update(time_entries, ["is_active", "next_fire_at"])
 
             reminder.is_active = not reminder.is_active
             reminder.save()
@@ -283,36 +260,18 @@ def unarchive(request):
             reminder = MedicationReminder.objects.get(id=reminder_id)
             reminder.is_active = True
             reminder.is_archived = False
-            reminder.times.update(is_active = True)
             reminder.start_date = date.today()
             reminder.remaining_days = reminder.day_amount
             reminder.restoration_time = timezone.now()
             reminder.save()
 
-            for time_entry in reminder.times.all():
+            time_entries = list(reminder.times.all())
+            for time_entry in time_entries:
                 time_entry.is_active = True
+                time_entry.schedule()
+            ReminderTime.objects.bulk_update(time_entries, ["is_active", "next_fire_at"])
 
-                if time_entry.task_id:
-                    try:
-                        current_app.control.revoke(time_entry.task_id)
-                    except Exception:
-                        pass
-                
-                now = timezone.localtime()
-                eta = timezone.make_aware(
-                    datetime.combine(date.today(), time_entry.time)
-                )
-                if eta <= now:
-                    eta += timedelta(days=1)
-                
-                task = send_reminder.apply_async(
-                    args=[time_entry.id],
-                    eta=eta
-                )
-                time_entry.task_id = task.id
-                time_entry.save(update_fields=["is_active", "task_id"])
-
-            patient = PatientProfile.objects.get(user=request.user)
+            patient = request.patient_profile
             archive_count = MedicationReminder.objects.filter(user=patient, is_archived=True).count()
 
             return JsonResponse({"success": True, "day_amount": reminder.day_amount, 'archive_count': archive_count})
@@ -325,15 +284,11 @@ def delete_reminder(request):
         reminder_id = data.get('reminder_id')
         reminder = MedicationReminder.objects.get(id=reminder_id)
 
-        # Cancel all pending Celery tasks for this reminder
-        for reminder_time in reminder.times.all():
-            if reminder_time.task_id:
-                try:
-                    current_app.control.revoke(reminder_time.task_id, terminate=True)
-                except Exception as e:
-                    print(f"Failed to revoke task {reminder_time.task_id}: {e}")
-
-        reminder.delete()
+        # Deleting the times is enough: the scheduler only fires existing rows
+        with transaction.atomic():
+            # Its notifications go with it, some of them possibly still unread
+            UnreadCounter.uncount(notifications=reminder.reminders.all())
+            reminder.delete()
         return JsonResponse({"success": True})
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON"}, status=400)
@@ -370,29 +325,10 @@ def edit_reminder(request):
                             "error": f"You already have a reminder set for {parsed_time.strftime('%I:%M %p')}"
                         }, status=400)
 
-                    # Revoke old task BEFORE updating time
-                    if time_entry.task_id:
-                        try:
-                            # Revoke using both methods for reliability
-                            current_app.control.revoke(time_entry.task_id, terminate=True, signal='SIGKILL')
-                            from celery.result import AsyncResult
-                            old_task = AsyncResult(time_entry.task_id, app=current_app)
-                            old_task.revoke(terminate=True, signal='SIGKILL')
-                            print(f"[REVOKE] Revoked old task {time_entry.task_id} for time {time_entry.time}")
-                        except Exception as e:
-                            print(f"[REVOKE ERROR] Failed to revoke {time_entry.task_id}: {e}")
-
                     time_entry.time = parsed_time
-
-                    now = timezone.localtime()
-                    eta = timezone.make_aware(datetime.combine(date.today(), parsed_time))
-                    if eta <= now:
-                        eta += timedelta(days=1)
-
-                    task = send_reminder.apply_async((time_entry.id,), eta=eta)
-                    time_entry.task_id = task.id
+                    if time_entry.is_active:
+                        time_entry.schedule()
                     time_entry.save()
-                    print(f"[RESCHEDULE] New task {task.id} scheduled for {eta} (time: {parsed_time})")
 
 
                 except ReminderTime.DoesNotExist:
@@ -414,43 +350,23 @@ def edit_reminder(request):
 
 def refill(request, prescription_id):
     if request.method == 'POST':
-        prescription = Prescription.objects.get(id=prescription_id)
-
-        # Validate refills remaining
-        if prescription.refills_left <= 0:
-            messages.error(request, "No refills remaining for this prescription.")
-            return redirect('patient_profile')
-
-        prescription.refills_left -= 1
-        prescription.refill_pending = True
-        prescription.save()
-
-        patient = PatientProfile.objects.get(user=request.user)
-        pharmacy = patient.pharmacy
-        pharmacists = CustomAccount.objects.filter(pharmacistprofile__pharmacy=pharmacy)
-
-        content = f"A refill request from {patient.first_name} {patient.last_name} has been sent."
-        link = reverse('refill_form', args=[prescription.id])
-
-        for u in pharmacists:
-            notification_obj = Notifications.objects.create(
-                user=u,
-                content=content,
-                link=link,
-                prescription=prescription
-            )
-
-            # Send notification with automatic unread counts
-            send_notification_with_counts(
-                user=u,
-                notification_data={
-                    "id": notification_obj.id,
-                    "type": "refill_request",
-                    "content": content,
-                    "timestamp": timezone.localtime(notification_obj.time).strftime("%b %d, %I:%M %p"),
-                    "link": link
-                }
-            )
+        with transaction.atomic():
+            prescription = Prescription.objects.select_for_update().get(id=prescription_id)
+
+            # Validate refills remaining
+            if prescription.refills_left <= 0:
+                messages.error(request, "No refills remaining for this prescription.")
+                return redirect('patient_profile')
+
+            prescription.refills_left -= 1
+            prescription.refill_pending = True
+            prescription.refill_requests += 1
+            prescription.save()
+
+            # Pharmacist notifications run in Celery after commit, keyed by this request's number
+            transaction.on_commit(lambda: notify_refill_requested.delay(
+                event_key('refill_requested', prescription.id, prescription.refill_requests), prescription.id
+            ))
 
         messages.success(request, "Refill request submitted.")
         return redirect('prescriptions')
@@ -1,9 +1,10 @@
 from django.contrib import admin
+from accounts.admin import UnreadCounterAdmin
 from .models import PharmacyProfile, PharmacistProfile, Prescription, Drug
 
 # Register your models here.
-admin.site.register(Prescription)
-admin.site.register(Drug)
+admin.site.register(Prescription, UnreadCounterAdmin)
+admin.site.register(Drug, UnreadCounterAdmin)
 
 
 class PharmacistInline(admin.TabularInline):  # or admin.StackedInline for a bigger form
@@ -12,10 +13,10 @@ class PharmacistInline(admin.TabularInline):  # or admin.StackedInline for a big
     fields = ('first_name', 'last_name', 'user')
 
 @admin.register(PharmacyProfile)
-class PharmacyProfileAdmin(admin.ModelAdmin):
+class PharmacyProfileAdmin(UnreadCounterAdmin):
     list_display = ('pharmacy_name', 'city', 'state')
     inlines = [PharmacistInline]
 
 @admin.register(PharmacistProfile)
-class PharmacistProfileAdmin(admin.ModelAdmin):
+class PharmacistProfileAdmin(UnreadCounterAdmin):
     list_display = ('first_name', 'last_name', 'pharmacy')
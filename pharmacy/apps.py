@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PharmacyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pharmacy'
+
+    def ready(self):
+        # Connect the catalog cache and autocomplete index invalidation receivers
+        from . import catalog, search  # noqa: F401
@@ -0,0 +1,93 @@
+"""
+Read-through cache of each pharmacy's drug catalog.
+
+Drug text fields (name, brand, description, dosage, route) almost never
+change, while stock and status change on every prescription. Views load only
+the volatile columns from the database and take the text from a per-pharmacy
+catalog kept in the Django cache under a version token, which Drug writes
+replace.
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from accounts.utils import bump_cache_version, cache_version
+from .models import Drug
+
+# Fields served from the cache
+CATALOG_FIELDS = ('name', 'brand', 'description', 'dosage', 'route')
+
+# Fields always read from the database
+VOLATILE_FIELDS = ('id', 'pharmacy', 'stock', 'status', 'resupply_pending')
+
+# Catalog entries outlive any realistic gap between writes; the version token
+# is what actually invalidates them
+CATALOG_CACHE_TTL = 60 * 60
+
+
+def catalog_version_key(pharmacy_id):
+    return f"drug_catalog_version_{pharmacy_id}"
+
+
+def invalidate_catalog(pharmacy_id):
+    bump_cache_version(catalog_version_key(pharmacy_id))
+
+
+def drug_catalog(pharmacy_id):
+    """
+    Text fields of every drug a pharmacy stocks.
+
+    Args:
+        pharmacy_id: int - id of the PharmacyProfile
+
+    Returns:
+        dict mapping drug id to a dict of CATALOG_FIELDS
+    """
+    key = f"drug_catalog_{pharmacy_id}_{cache_version(catalog_version_key(pharmacy_id))}"
+    catalog = cache.get(key)
+    if catalog is None:
+        catalog = {
+            row['id']: row
+            for row in Drug.objects.filter(pharmacy_id=pharmacy_id).values('id', *CATALOG_FIELDS)
+        }
+        cache.set(key, catalog, CATALOG_CACHE_TTL)
+    return catalog
+
+
+def with_catalog(drugs, pharmacy_id):
+    """
+    Fill in the text fields of drugs loaded with only VOLATILE_FIELDS.
+
+    Args:
+        drugs: iterable of Drug objects - typically `queryset.only(*VOLATILE_FIELDS)`
+        pharmacy_id: int - id of the PharmacyProfile the drugs belong to
+
+    Returns:
+        list of Drug objects whose text fields no longer trigger deferred loads
+    """
+    drugs = list(drugs)
+    catalog = drug_catalog(pharmacy_id)
+
+    # A drug created since the catalog was cached: rebuild once under a fresh version
+    if any(drug.id not in catalog for drug in drugs):
+        invalidate_catalog(pharmacy_id)
+        catalog = drug_catalog(pharmacy_id)
+
+    for drug in drugs:
+        entry = catalog.get(drug.id)
+        if entry is None:
+            continue
+        for field in CATALOG_FIELDS:
+            setattr(drug, field, entry[field])
+    return drugs
+
+
+@receiver(post_save, sender=Drug)
+def invalidate_catalog_on_save(sender, instance, update_fields=None, **kwargs):
+    # Stock, status and resupply saves leave the catalog untouched
+    if update_fields is None or set(update_fields) & {*CATALOG_FIELDS, 'pharmacy'}:
+        invalidate_catalog(instance.pharmacy_id)
+
+
+@receiver(post_delete, sender=Drug)
+def invalidate_catalog_on_delete(sender, instance, **kwargs):
+    invalidate_catalog(instance.pharmacy_id)
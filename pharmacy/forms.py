@@ -3,6 +3,7 @@ from django.core.exceptions import ValidationError
 import re
 from .models import PharmacyProfile, PharmacistProfile, Prescription, Drug
 from patients.models import PatientProfile
+from .catalog import VOLATILE_FIELDS
 
 class PharmacyProfileForm(forms.ModelForm):
     class Meta:
@@ -156,7 +157,8 @@ class PrescriptionForm(forms.ModelForm):
               self.add_error('medicine', 'Please enter a medication.')
             else:
                 try:
-                    medicine = Drug.objects.get(id=medicine_id)
+                    # Only the stock check and the prescription FK need this row
+                    medicine = Drug.objects.only(*VOLATILE_FIELDS).get(id=medicine_id)
                     cleaned_data['medicine'] = medicine
                 except Drug.DoesNotExist:
                     self.add_error('medicine', 'Invalid medication selected.')
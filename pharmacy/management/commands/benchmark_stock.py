@@ -0,0 +1,111 @@
+"""
+Management command that hammers one drug's stock from many threads and checks
+that Drug.objects.reserve_stock never loses a decrement.
+
+Usage:
+    python manage.py benchmark_stock [--threads 16] [--attempts 50] [--stock 500] [--quantity 1]
+"""
+import threading
+import time
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, OperationalError
+from pharmacy.models import Drug
+from pharmacy.seeding import delete_seeded, seed_pharmacy
+
+
+class Command(BaseCommand):
+    help = 'Concurrency benchmark for atomic stock reservation on a single drug'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Number of concurrent workers')
+        parser.add_argument('--attempts', type=int, default=50, help='Reservations attempted per worker')
+        parser.add_argument('--stock', type=int, default=500, help='Starting stock of the benchmark drug')
+        parser.add_argument('--quantity', type=int, default=1, help='Units taken per reservation')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        attempts = options['attempts']
+        quantity = options['quantity']
+        starting_stock = options['stock']
+
+        prefix = f'bench_stock_{uuid.uuid4().hex[:8]}'
+        try:
+            self.run(prefix, threads, attempts, quantity, starting_stock)
+        finally:
+            delete_seeded(prefix)
+
+    def run(self, prefix, threads, attempts, quantity, starting_stock):
+        pharmacy = seed_pharmacy(0, prefix, {
+            'pharmacists': 0, 'patients': 0, 'drugs': 1, 'prescriptions': 0, 'messages': 0, 'notifications': 0,
+        }, password='!')['pharmacy']
+        drug = pharmacy.drugs.get()
+        drug.stock = starting_stock
+        drug.update_status()
+        drug.save(update_fields=['stock', 'status'])
+
+        results = []
+        errors = []
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(threads)
+
+        def worker():
+            local_results = []
+            start_barrier.wait()
+            try:
+                for _ in range(attempts):
+                    # SQLite serializes writers; retry when the database is briefly locked
+                    while True:
+                        try:
+                            local_results.append(Drug.objects.reserve_stock(drug.id, quantity))
+                            break
+                        except OperationalError as e:
+                            if 'locked' not in str(e):
+                                raise
+                            time.sleep(0.001)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                with lock:
+                    results.extend(local_results)
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        drug.refresh_from_db()
+        successes = [r for r in results if r is not None]
+        expected_successes = min(threads * attempts, starting_stock // quantity)
+        expected_stock = starting_stock - len(successes) * quantity
+
+        self.stdout.write(f'Backend: {connection.vendor}')
+        self.stdout.write(f'Reservations: {len(results)} attempted, {len(successes)} succeeded in {elapsed:.2f}s '
+                          f'({len(results) / elapsed:.0f}/s)')
+        self.stdout.write(f'Final stock: {drug.stock} (expected {expected_stock}), status: {drug.status}')
+
+        # The status written by the UPDATE must agree with Drug.update_status()
+        final_status = drug.status
+        drug.update_status()
+
+        failures = []
+        if errors:
+            failures.append(f'{len(errors)} workers failed, first error: {errors[0]}')
+        if drug.stock != expected_stock or len(successes) != expected_successes:
+            failures.append('lost or phantom decrements detected')
+        if final_status != drug.status:
+            failures.append(f'status {final_status} does not match stock level {drug.stock}')
+        if len(set(successes)) != len(successes):
+            failures.append('two reservations observed the same new stock level')
+        if successes.count(0) != (1 if expected_successes * quantity == starting_stock else 0):
+            failures.append('out-of-stock threshold was not crossed exactly once')
+
+        if failures:
+            raise CommandError('; '.join(failures))
+
+        self.stdout.write(self.style.SUCCESS('No lost decrements'))
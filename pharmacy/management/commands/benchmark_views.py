@@ -0,0 +1,295 @@
+"""
+Management command that seeds one synthetic pharmacy per scale, requests every
+URL of the accounts, patients and pharmacy apps through the test client as the
+matching role, and records query count, database time and wall time per view.
+
+A view's query budget is its count at the smallest scale, or the value given
+for it in --budgets. The run fails when a view issues more queries than its
+budget at a larger scale, which is what an N+1 loop looks like, or when it
+answers with a server error. The full results are written to --output as JSON.
+
+Celery tasks run eagerly and the channel layer is in-memory (unless --redis),
+so views that enqueue notifications include that work in their numbers.
+
+Usage:
+    python manage.py benchmark_views [--scales 1 5] [--pharmacists 3] [--patients 20] [--drugs 40]
+        [--prescriptions 5] [--messages 10] [--notifications 10] [--repeat 3]
+        [--output benchmark_views.json] [--budgets budgets.json] [--seed 1] [--keep] [--redis]
+"""
+import json
+import statistics
+import time
+import uuid
+from channels.layers import channel_layers
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from accounts import urls as accounts_urls
+from accounts.models import CustomAccount, Message, Notifications, ReadStatus, Thread
+from patients import urls as patients_urls
+from patients.models import MedicationReminder, PatientProfile, ReminderTime
+from pharmacy import urls as pharmacy_urls
+from pharmacy.models import Drug, PharmacistProfile, Prescription
+from pharmacy.seeding import DEFAULT_SIZES, delete_seeded, seed_pharmacy
+from PulseRx.celery import app as celery_app
+
+# url name -> (role, method, request builder). Roles: admin, pharmacist, patient or None for
+# anonymous; methods: get, post (form data) or json (JSON body). The builder maps the
+# scale's targets to (url args, data). Writes come last so they don't change what the
+# reads above them see.
+ROUTES = {
+    # accounts
+    'login': (None, 'get', None),
+    'register': (None, 'get', None),
+    'register_role': (None, 'get', lambda t: (['patient'], None)),
+    'check_username': (None, 'get', lambda t: ([], {'username': t['patient'].user.username})),
+    'check_email': (None, 'get', lambda t: ([], {'email': t['patient'].user.email})),
+    'account_settings': ('patient', 'get', None),
+    'messages': ('patient', 'get', None),
+    'threads': ('patient', 'get', lambda t: ([t['thread'].id], None)),
+    'thread_messages': ('patient', 'get', lambda t: ([t['thread'].id], None)),
+    'message_search': ('patient', 'get', lambda t: ([], {'q': 'refill'})),
+    'notification_feed': ('patient', 'get', None),
+    # patients
+    'patient_home': ('patient', 'get', None),
+    'prescriptions': ('patient', 'get', None),
+    'my_pharmacy': ('patient', 'get', None),
+    'account': ('patient', 'get', None),
+    'reminders': ('patient', 'get', None),
+    # pharmacy
+    'pharmacy_home': ('admin', 'get', None),
+    'pharmacist_home': ('pharmacist', 'get', None),
+    'create_prescriptions': ('pharmacist', 'get', None),
+    'refill_form': ('pharmacist', 'get', lambda t: ([t['prescription'].id], None)),
+    'patient_search': ('pharmacist', 'get', lambda t: ([], {'q': t['patient'].first_name[:3]})),
+    'medicine_search': ('pharmacist', 'get', lambda t: ([], {'q': t['drug'].name[:3]})),
+    'my_patients': ('pharmacist', 'get', None),
+    'patient_profile': ('pharmacist', 'get', lambda t: ([t['patient'].id], None)),
+    'inventory': ('pharmacist', 'get', None),
+    'drug_detail': ('pharmacist', 'get', lambda t: ([t['drug'].id], None)),
+    'all_prescriptions': ('pharmacist', 'get', None),
+    'all_refill_requests': ('pharmacist', 'get', None),
+    # writes
+    'reminder_suggestions': ('patient', 'json', lambda t: ([], {'prescription_id': t['prescription'].id})),
+    'toggle_time': ('patient', 'json', lambda t: ([], {'time_id': t['reminder_time'].id})),
+    'toggle_reminder': ('patient', 'json', lambda t: ([], {'reminder_id': t['reminder'].id})),
+    'edit_reminder': ('patient', 'json', lambda t: ([], {
+        'reminder_id': t['reminder'].id, 'days': 30,
+        'times': [{'id': t['reminder_time'].id, 'time': '07:45'}],
+    })),
+    'unarchive': ('patient', 'json', lambda t: ([], {'reminder_id': t['archived_reminder'].id})),
+    'delete_reminder': ('patient', 'json', lambda t: ([], {'reminder_id': t['spare_reminder'].id})),
+    'read_notification': ('patient', 'json', lambda t: ([], {'notification_id': t['notifications'][0].id})),
+    'delete_notification': ('patient', 'json', lambda t: ([], {'notification_id': t['notifications'][1].id})),
+    'refill': ('patient', 'post', lambda t: ([t['prescription'].id], None)),
+    'patient_thread': ('pharmacist', 'post', lambda t: ([], {'patientID': t['patient'].id})),
+    'contact_admin': ('pharmacist', 'get', lambda t: ([t['drug'].id], None)),
+    'resupply': ('admin', 'post', lambda t: ([t['low_drug'].id], None)),
+    'regenerate_code': ('admin', 'post', None),
+    'logout': ('patient', 'get', None),
+}
+
+
+class Command(BaseCommand):
+    help = 'Query count, DB time and wall time of every view at growing data sizes, with query budgets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=int, nargs='+', default=[1, 5],
+                            help='Multipliers of the per-pharmacy sizes, one pharmacy each')
+        for name, default in DEFAULT_SIZES.items():
+            parser.add_argument(f'--{name}', type=int, default=default, help=f'{name.capitalize()} at scale 1')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed requests per read view after a warm-up')
+        parser.add_argument('--output', default='benchmark_views.json', help='Path of the JSON report')
+        parser.add_argument('--budgets', help='JSON file of {url name: max queries} overriding the smallest scale')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the dataset')
+        parser.add_argument('--keep', action='store_true', help='Leave the synthetic data in place afterwards')
+        parser.add_argument('--redis', action='store_true', help='Use the configured channel layer instead of an in-memory one')
+
+    def handle(self, *args, **options):
+        names = [
+            pattern.name for urls in (accounts_urls, patients_urls, pharmacy_urls) for pattern in urls.urlpatterns
+        ]
+        missing = [name for name in names if name not in ROUTES]
+        if missing:
+            raise CommandError(f'No benchmark request defined for: {", ".join(missing)}')
+
+        budgets = {}
+        if options['budgets']:
+            with open(options['budgets']) as f:
+                budgets = json.load(f)
+
+        if not options['redis']:
+            settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            channel_layers.backends.clear()
+        celery_app.conf.task_always_eager = True
+        setup_test_environment()
+
+        scales = sorted(set(options['scales']))
+        prefix = f'bench_{uuid.uuid4().hex[:8]}'
+        results = {name: {} for name in ROUTES}
+
+        try:
+            if not CustomAccount.objects.filter(role='system').exists():
+                CustomAccount.objects.create(username=f'{prefix}_system', email=f'{prefix}_system@example.com',
+                                             role='system', first_name='PulseRx', password='!')
+
+            for index, scale in enumerate(scales):
+                sizes = {name: options[name] * scale for name in DEFAULT_SIZES}
+                seeded = seed_pharmacy(index, prefix, sizes, seed=options['seed'], password='!')
+                self.stdout.write(f'Scale {scale}: {seeded["users"]:,} users, {seeded["prescriptions"]:,} prescriptions, '
+                                  f'{seeded["messages"]:,} messages, {seeded["notifications"]:,} notifications')
+
+                targets = self.targets(seeded['pharmacy'])
+                for name, (role, method, build) in ROUTES.items():
+                    args, data = build(targets) if build else ([], None)
+                    results[name][scale] = self.measure(
+                        targets['users'].get(role), method, reverse(name, args=args), data,
+                        1 if method != 'get' or name in ('contact_admin', 'logout') else options['repeat'],
+                    )
+        finally:
+            teardown_test_environment()
+            if options['keep']:
+                self.stdout.write(self.style.WARNING(f'Kept synthetic data for users prefixed {prefix}_'))
+            else:
+                delete_seeded(prefix)
+
+        report, failures = self.report(results, scales, budgets, options)
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f'Report written to {options["output"]}')
+
+        if failures:
+            raise CommandError(f'{len(failures)} views over budget or failing: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS(f'All {len(ROUTES)} views within their query budgets'))
+
+    def targets(self, pharmacy):
+        """Rows of one seeded pharmacy that the requests in ROUTES point at"""
+        patient = PatientProfile.objects.filter(pharmacy=pharmacy).select_related('user').order_by('id').first()
+        reminders = MedicationReminder.objects.filter(user=patient).order_by('id')
+        active = list(reminders.filter(is_archived=False))
+        targets = {
+            'users': {
+                'admin': pharmacy.user,
+                'pharmacist': PharmacistProfile.objects.filter(pharmacy=pharmacy).select_related('user')
+                .order_by('id').first().user,
+                'patient': patient.user,
+            },
+            'patient': patient,
+            'drug': Drug.objects.filter(pharmacy=pharmacy).order_by('id').first(),
+            'low_drug': Drug.objects.filter(pharmacy=pharmacy, stock__lte=30).order_by('id').first(),
+            'prescription': Prescription.objects.filter(patient=patient, refills_left__gt=0).order_by('id').first(),
+            'reminder': active[0] if active else None,
+            'spare_reminder': active[-1] if len(active) > 1 else None,
+            'archived_reminder': reminders.filter(is_archived=True).first(),
+            'reminder_time': ReminderTime.objects.filter(reminder__in=active[:1]).order_by('id').first(),
+            'thread': Thread.objects.filter(participant=patient.user).order_by('id').first(),
+        }
+        # The seeded read states are random; give the writes the same unread rows at every scale
+        # so they issue the same counter updates
+        thread = targets['thread']
+        if thread:
+            message = Message.objects.create(thread=thread, sender=targets['users']['pharmacist'],
+                                             recipient=patient.user, content='Benchmark message')
+            ReadStatus.objects.create(message=message, user=patient.user, read=False)
+        targets['notifications'] = [
+            Notifications.objects.create(user=patient.user, content='Benchmark notification', is_read=False)
+            for _ in range(2)
+        ]
+
+        empty = [name for name, value in targets.items() if not value]
+        if empty:
+            raise CommandError(f'Seeded pharmacy is too small to benchmark every view, missing: {", ".join(empty)}')
+        return targets
+
+    def measure(self, user, method, url, data, repeat):
+        """Warm up read views once, then time `repeat` requests with a fresh client"""
+        client = Client(raise_request_exception=False)
+        if user is not None:
+            client.force_login(user)
+
+        def request():
+            if method == 'json':
+                return client.post(url, json.dumps(data), content_type='application/json')
+            return getattr(client, method)(url, data)
+
+        if repeat > 1:
+            request()
+
+        durations = []
+
+        def timed(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                durations.append(time.perf_counter() - started)
+
+        runs = []
+        for _ in range(repeat):
+            durations.clear()
+            started = time.perf_counter()
+            with connection.execute_wrapper(timed):
+                response = request()
+            runs.append({
+                'status': response.status_code,
+                'queries': len(durations),
+                'db_ms': sum(durations) * 1000,
+                'wall_ms': (time.perf_counter() - started) * 1000,
+            })
+
+        return {
+            'status': runs[-1]['status'],
+            'queries': max(run['queries'] for run in runs),
+            'db_ms': round(statistics.median(run['db_ms'] for run in runs), 2),
+            'wall_ms': round(statistics.median(run['wall_ms'] for run in runs), 2),
+        }
+
+    def report(self, results, scales, budgets, options):
+        """JSON-ready report and the names of the views that broke their budget"""
+        failures = []
+        views = {}
+        header = ''.join(f"{f'x{scale} queries':>12}{'db ms':>9}{'wall ms':>9}" for scale in scales)
+        self.stdout.write(f"\n{'view':<24}{'budget':>8}{header}")
+
+        for name, (role, method, _) in ROUTES.items():
+            by_scale = results[name]
+            budget = budgets.get(name, by_scale[scales[0]]['queries'])
+            over = [scale for scale in scales if by_scale[scale]['queries'] > budget]
+            server_error = any(by_scale[scale]['status'] >= 500 for scale in scales)
+            passed = not over and not server_error
+            if not passed:
+                failures.append(name)
+
+            views[name] = {
+                'role': role or 'anonymous',
+                'method': method,
+                'budget': budget,
+                'passed': passed,
+                'server_error': server_error,
+                'results': {str(scale): by_scale[scale] for scale in scales},
+            }
+
+            cells = ''.join(
+                f"{by_scale[scale]['queries']:>12}{by_scale[scale]['db_ms']:>9.1f}{by_scale[scale]['wall_ms']:>9.1f}"
+                for scale in scales
+            )
+            row = f'{name:<24}{budget:>8}{cells}'
+            if server_error:
+                statuses = '/'.join(str(by_scale[scale]['status']) for scale in scales)
+                row = f'{row}  status {statuses}'
+            if not passed:
+                self.stdout.write(self.style.ERROR(row))
+            else:
+                self.stdout.write(self.style.SUCCESS(row))
+
+        report = {
+            'backend': connection.vendor,
+            'scales': scales,
+            'sizes': {name: options[name] for name in DEFAULT_SIZES},
+            'repeat': options['repeat'],
+            'views': views,
+        }
+        return report, failures
@@ -0,0 +1,183 @@
+"""
+Management command to export the database as newline-delimited JSON records
+that load_production_data can load: one {"model", "pk", "fields"} object per
+line, fields keyed by database column, primary keys kept.
+
+Every table is streamed with a server-side cursor by its own worker process
+into a part file; the parts are then joined in dependency order into --output
+(gzip-compressed when it ends in .gz). Memory stays flat however large the
+tables are.
+
+Next to the output a manifest records each table's watermark: the newest
+timestamp for messages, prescriptions and notifications, the highest primary
+key for everything else. Passing that manifest to --since exports only the
+rows added after it, so a nightly snapshot costs only the delta. A timestamp
+is taken when the row is saved, not when its transaction commits, so a row
+can become visible after a newer one was exported; deltas therefore start
+--overlap minutes before the timestamp watermarks, and load_production_data
+matches the repeated rows to the ones it loaded before by their source id.
+Updates to rows exported before are otherwise not picked up.
+
+Usage:
+    python manage.py export_data [--output production_data.ndjson.gz] [--since previous.ndjson.gz.manifest.json]
+        [--overlap 60] [--workers 4] [--chunk-size 2000]
+"""
+import gzip
+import json
+import os
+import shutil
+import time
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+from django.contrib.postgres.search import SearchVectorField
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+from accounts.models import Message, Notifications
+from pharmacy.management.commands.load_production_data import LOADED
+from pharmacy.models import Prescription
+from pharmacy.seeding import init_worker
+
+# Tables exported incrementally by creation time; the rest by primary key. Deltas repeat
+# their overlap window, so the loader matches these by source id (MATCHED_BY_SOURCE)
+WATERMARKS = {
+    Message: 'timestamp',
+    Prescription: 'prescribed_on',
+    Notifications: 'time',
+}
+
+
+def _model(label):
+    return next(model for model in LOADED if model._meta.label_lower == label)
+
+
+def watermark_field(model):
+    return WATERMARKS.get(model, model._meta.pk.attname)
+
+
+def _export_table(label, path, since, until, chunk_size):
+    """Stream the rows of one table between the watermarks into an NDJSON part file"""
+    model = _model(label)
+    field = watermark_field(model)
+    # The trigger-maintained search vector is rebuilt where the data is loaded
+    columns = [
+        f.attname for f in model._meta.concrete_fields
+        if not f.primary_key and not isinstance(f, SearchVectorField)
+    ]
+
+    rows = model.objects.order_by(field, 'pk')
+    if until is None:
+        # Empty table when the export started
+        rows = rows.none()
+    else:
+        if since is not None:
+            rows = rows.filter(**{f'{field}__gt': since})
+        rows = rows.filter(**{f'{field}__lte': until})
+
+    count = 0
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        # iterator() keeps a server-side cursor open on PostgreSQL instead of fetching every row
+        for pk, *values in rows.values_list('pk', *columns).iterator(chunk_size=chunk_size):
+            record = {'model': label, 'pk': pk, 'fields': dict(zip(columns, values))}
+            f.write(json.dumps(record, default=str) + '\n')
+            count += 1
+    return label, count
+
+
+class Command(BaseCommand):
+    help = 'Export the database to NDJSON in parallel, optionally only what was added since an earlier export'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            type=str,
+            default='production_data.ndjson.gz',
+            help='Output file, gzip-compressed if it ends in .gz (default: production_data.ndjson.gz)'
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='Manifest of an earlier export; only rows added after it are exported'
+        )
+        parser.add_argument(
+            '--overlap',
+            type=int,
+            default=60,
+            help='Minutes before the timestamp watermarks of --since to export again, for rows committed late (default: 60)'
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parallel worker processes')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the cursor at a time')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        since = self.read_manifest(options['since']) if options['since'] else {}
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+        # Upper watermarks are taken children first: a row inside its table's bound only points
+        # at rows that existed before it, which are inside their own tables' later-taken bounds
+        until = {}
+        for model in reversed(LOADED):
+            field = watermark_field(model)
+            until[model._meta.label_lower] = model.objects.aggregate(value=Max(field))['value']
+
+        jobs = []
+        for index, model in enumerate(LOADED):
+            label = model._meta.label_lower
+            lower = since.get(label)
+            if lower is not None and model in WATERMARKS:
+                # Rows saved before the watermark may have committed after the earlier export read it
+                lower = parse_datetime(lower) - timedelta(minutes=options['overlap'])
+            part = f'{output}.{index:02d}.part'
+            if output.endswith('.gz'):
+                part += '.gz'
+            jobs.append((label, part, lower, until[label], options['chunk_size']))
+
+        started = time.perf_counter()
+        counts = {}
+        workers = max(1, min(options['workers'], len(jobs)))
+        if workers == 1:
+            for job in jobs:
+                label, counts[label] = _export_table(*job)
+        else:
+            # Children must open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+                for label, count in pool.map(_export_table, *zip(*jobs)):
+                    counts[label] = count
+
+        # Parts are joined in dependency order; concatenated gzip members form one valid gzip file
+        with open(output, 'wb') as out:
+            for job in jobs:
+                with open(job[1], 'rb') as part:
+                    shutil.copyfileobj(part, out)
+                os.remove(job[1])
+
+        manifest = {
+            'output': os.path.basename(output),
+            'watermarks': {
+                label: value if value is not None else since.get(label)
+                for label, value in until.items()
+            },
+            'counts': counts,
+        }
+        with open(f'{output}.manifest.json', 'w') as f:
+            json.dump(manifest, f, indent=2, default=str)
+
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {total:,} records to {output} in {elapsed:.1f}s with {workers} workers'
+        ))
+        for label, count in counts.items():
+            if count:
+                self.stdout.write(f'  {label}: {count:,}')
+        self.stdout.write(f'Watermarks saved to {output}.manifest.json; pass it to --since for the next export')
+
+    def read_manifest(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)['watermarks']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Cannot read manifest "{path}": {e}')
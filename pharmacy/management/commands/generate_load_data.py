@@ -0,0 +1,110 @@
+"""
+Management command that generates a production-sized synthetic dataset for
+load testing: pharmacies with their staff, patients, inventory,
+prescriptions, reminders, message threads, read statuses and notifications.
+
+Rows are written with chunked bulk_create and every user shares one
+precomputed password hash. Pharmacies are independent of each other, so they
+are generated in parallel worker processes, and each pharmacy is seeded from
+(--seed, pharmacy index), so a run is reproducible whatever the worker count.
+
+Every generated username starts with --prefix; --clear removes a previous run
+with the same prefix first.
+
+Usage:
+    python manage.py generate_load_data [--pharmacies 10] [--pharmacists 3] [--patients 2000] [--drugs 200]
+        [--prescriptions 5] [--messages 10] [--notifications 10] [--workers 4] [--batch-size 1000]
+        [--chunk-size 500] [--seed 1] [--prefix load] [--password pulserx-load] [--clear]
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from accounts.models import CustomAccount
+from pharmacy.seeding import (
+    BATCH_SIZE, DEFAULT_SIZES, PATIENT_CHUNK, delete_seeded, init_worker, seed_pharmacy, shared_password
+)
+
+# Per-pharmacy sizes at 100x the demo data: seed_fake_data's 20 patients per pharmacy become 2,000
+LOAD_SIZES = {**DEFAULT_SIZES, 'patients': 2000, 'drugs': 200}
+
+SIZE_HELP = {
+    'pharmacists': 'Pharmacists per pharmacy',
+    'patients': 'Patients per pharmacy',
+    'drugs': 'Drugs per pharmacy',
+    'prescriptions': 'Prescriptions per patient',
+    'messages': 'Messages in every patient thread',
+    'notifications': 'Notifications per patient and pharmacist',
+}
+
+
+def _seed_one(index, prefix, sizes, seed, password, batch_size, chunk_size):
+    counts = seed_pharmacy(index, prefix, sizes, seed=seed, password=password,
+                           batch_size=batch_size, chunk_size=chunk_size)
+    # The PharmacyProfile itself doesn't need to travel back to the parent
+    counts.pop('pharmacy')
+    return index, counts
+
+
+class Command(BaseCommand):
+    help = 'Generate a large, reproducible synthetic dataset for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pharmacies', type=int, default=10, help='Number of pharmacies')
+        for name, default in LOAD_SIZES.items():
+            parser.add_argument(f'--{name}', type=int, default=default, help=SIZE_HELP[name])
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parallel worker processes')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per INSERT')
+        parser.add_argument('--chunk-size', type=int, default=PATIENT_CHUNK, help='Patients per transaction')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the dataset')
+        parser.add_argument('--prefix', default='load', help='Username prefix of every generated user')
+        parser.add_argument('--password', default='pulserx-load', help='Password of every generated user')
+        parser.add_argument('--clear', action='store_true', help='Delete data generated earlier with the same prefix first')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        sizes = {name: options[name] for name in LOAD_SIZES}
+        workers = max(1, min(options['workers'], options['pharmacies']))
+
+        if options['clear']:
+            delete_seeded(prefix)
+            self.stdout.write(f'Removed data generated with prefix {prefix}')
+        elif CustomAccount.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(f'Users prefixed {prefix}_ already exist; pass --clear or another --prefix')
+
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stdout.write(self.style.WARNING('SQLite allows a single writer, so running with one worker'))
+            workers = 1
+
+        password = shared_password(options['password'])
+        jobs = [
+            (index, prefix, sizes, options['seed'], password, options['batch_size'], options['chunk_size'])
+            for index in range(options['pharmacies'])
+        ]
+        totals = {}
+        started = time.perf_counter()
+
+        if workers == 1:
+            results = (_seed_one(*job) for job in jobs)
+            self.collect(results, totals, started, len(jobs))
+        else:
+            # Children must open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+                futures = [pool.submit(_seed_one, *job) for job in jobs]
+                self.collect((future.result() for future in as_completed(futures)), totals, started, len(jobs))
+
+        elapsed = time.perf_counter() - started
+        rows = sum(totals.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {rows:,} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s) with {workers} workers'
+        ))
+        for name, count in totals.items():
+            self.stdout.write(f'  {name}: {count:,}')
+
+    def collect(self, results, totals, started, total):
+        for done, (index, counts) in enumerate(results, start=1):
+            for name, count in counts.items():
+                totals[name] = totals.get(name, 0) + count
+            self.stdout.write(f'Pharmacy {index} done ({done}/{total}, {time.perf_counter() - started:.1f}s)')
@@ -1,16 +1,47 @@
+"""
+Management command to import drugs from the OpenFDA label API into one or
+more pharmacies.
+
+Labels are fetched concurrently through one pooled session and summarized
+with LexRank in a process pool. Both the raw label JSON and the summaries are
+cached on disk keyed by drug name, so a rerun, or an import into another
+pharmacy, neither downloads nor summarizes again. The drugs are then
+bulk-created into every pharmacy of the run.
+
+--fixtures reads label JSON files (<drug-name-slug>.json, as stored in the
+cache's labels/ directory) from a local directory instead of the network. It
+needs its own --cache-dir, so fixture data never ends up in the shared cache
+that real runs read.
+
+Usage:
+    python manage.py import_drugs --pharmacy 1 [2 ...] | --all-pharmacies [--fetch-workers 8] [--workers 4]
+        [--cache-dir .cache/openfda] [--refresh] [--fixtures path/to/labels]
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
 import requests
-from django.core.management.base import BaseCommand
-from pharmacy.models import Drug
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.text import slugify
+from pharmacy.catalog import invalidate_catalog
+from pharmacy.models import Drug, PharmacyProfile
+from pharmacy.seeding import init_worker
 from sumy.parsers.plaintext import PlaintextParser
 from sumy.nlp.tokenizers import Tokenizer
 from sumy.summarizers.lex_rank import LexRankSummarizer
 
 import nltk
 
+# NLTK 3.9+ tokenizes sentences with the punkt_tab data
 try:
-    nltk.data.find('tokenizers/punkt')
+    nltk.data.find('tokenizers/punkt_tab')
 except LookupError:
-    nltk.download('punkt')
+    nltk.download('punkt_tab')
 
 def summarize_text(text, sentences_count=3):
     parser = PlaintextParser.from_string(text, Tokenizer("english"))
@@ -21,67 +52,250 @@ def summarize_text(text, sentences_count=3):
 POPULAR_DRUGS = [
     "Acetaminophen", "Hydrocodone", "Albuterol", "Alendronate", "Allopurinol", "Alprazolam", "Amoxicillin", "Amoxicillin/Clavulanate", "Amphetamine/Dextroamphetamine", "Amlodipine", "Aripiprazole", "Atenolol", "Atorvastatin", "Azithromycin", "Baclofen", "Benazepril", "Bisoprolol", "Bupropion", "Buspirone", "Butalbital/Acetaminophen/Caffeine", "Buprenorphine/Naloxone", "Captopril", "Carvedilol", "Cefdinir", "Cefuroxime", "Celecoxib", "Cetirizine", "Ciprofloxacin", "Citalopram", "Clindamycin", "Clonazepam", "Clopidogrel", "Cyclobenzaprine", "Dapagliflozin", "Desvenlafaxine", "Diazepam", "Diclofenac", "Dicyclomine", "Digoxin", "Diltiazem", "Diphenhydramine", "Divalproex", "Doxycycline", "Dulaglutide", "Enalapril", "Escitalopram", "Esomeprazole", "Estradiol", "Eszopiclone", "Fentanyl", "Fexofenadine", "Finasteride", "Fluconazole", "Fluoxetine", "Fluticasone", "Fluticasone/Salmeterol", "Gabapentin", "Gemfibrozil", "Glimepiride", "Glipizide", "Hydrochlorothiazide", "Hydrocodone/Acetaminophen", "Hydroxychloroquine", "Ibuprofen", "Insulin Aspart", "Insulin Detemir", "Insulin Glargine", "Insulin Lispro", "Ipratropium/Albuterol", "Isosorbide Mononitrate", "Lamotrigine", "Lansoprazole", "Levetiracetam", "Levothyroxine", "Lisinopril", "Lorazepam", "Losartan", "Lovastatin", "Lurasidone", "Meloxicam", "Memantine", "Metformin", "Methadone", "Methocarbamol", "Methylphenidate", "Metoprolol", "Metronidazole", "Mirtazapine", "Montelukast", "Naproxen", "Nitroglycerin", "Nortriptyline", "Omeprazole", "Ondansetron", "Oxycodone", "Oxycodone/Acetaminophen", "Pantoprazole", "Paroxetine", "Penicillin", "Phenytoin", "Pioglitazone", "Prednisone", "Pregabalin", "Promethazine", "Propranolol", "Quetiapine", "Rabeprazole", "Ranitidine", "Risperidone", "Rosuvastatin", "Sertraline", "Sildenafil", "Simvastatin", "Sitagliptin", "Spironolactone", "Tamsulosin", "Temazepam", "Terazosin", "Tizanidine", "Topiramate", "Tramadol", "Trazodone", "Triamterene/Hydrochlorothiazide", "Valsartan", "Venlafaxine", "Verapamil", "Warfarin", "Zaleplon", "Zolpidem", "Zolmitriptan",
 ]
+
+OPENFDA_LABEL_URL = "https://api.fda.gov/drug/label.json"
+
+
+def label_key(drug_name):
+    """File name stem of a drug in the cache and fixture directories"""
+    return slugify(drug_name.replace('/', ' '))
+
+
+class OpenFDAFetcher:
+    """Fetches labels from the OpenFDA API through one pooled, retrying session"""
+
+    def __init__(self, pool_size=8, timeout=10):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            # The API answers 429 when the per-minute quota is exceeded
+            max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]),
+        )
+        self.session.mount("https://", adapter)
+
+    def fetch(self, drug_name):
+        """
+        First label matching a generic name.
+
+        Returns:
+            The label dict, or None when OpenFDA has no label for the drug
+        """
+        response = self.session.get(
+            OPENFDA_LABEL_URL,
+            params={"search": f'openfda.generic_name:"{drug_name}"', "limit": 1},
+            timeout=self.timeout,
+        )
+        # OpenFDA reports "no matches" as a 404
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        results = response.json().get("results", [])
+        return results[0] if results else None
+
+
+class FixtureFetcher:
+    """Reads labels from <directory>/<label_key>.json; a missing file means no label"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def fetch(self, drug_name):
+        path = self.directory / f"{label_key(drug_name)}.json"
+        if not path.exists():
+            return None
+        return json.loads(path.read_text())
+
+
+class DiskCache:
+    """JSON values stored under <root>/<kind>/<label_key>.json"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, kind, drug_name):
+        return self.root / kind / f"{label_key(drug_name)}.json"
+
+    def get(self, kind, drug_name):
+        """
+        Cached value of a drug.
+
+        Returns:
+            (True, value) when cached, value possibly None for "no label"; (False, None) otherwise
+        """
+        path = self.path(kind, drug_name)
+        if not path.exists():
+            return False, None
+        return True, json.loads(path.read_text())
+
+    def set(self, kind, drug_name, value):
+        path = self.path(kind, drug_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so an interrupted run never leaves a truncated entry behind
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(value))
+        os.replace(tmp, path)
+
+
+def summarize_label(label):
+    """
+    Drug fields of an OpenFDA label, with LexRank summaries of its description and dosage.
+
+    Runs in the summary worker processes.
+
+    Returns:
+        Dict of Drug field values, or None if the label has no generic name
+    """
+    openfda = label.get("openfda", {})
+    name = openfda.get("generic_name", [None])[0]
+    if not name:
+        return None
+    return {
+        "name": name,
+        "brand": openfda.get("brand_name", [""])[0],
+        "route": openfda.get("route", [""])[0],
+        "description": summarize_text(label.get("description", [""])[0], sentences_count=3),
+        "dosage": summarize_text(label.get("dosage_and_administration", [""])[0], sentences_count=3),
+    }
+
+
 class Command(BaseCommand):
     help = 'Import drugs from OpenFDA API'
 
     def add_arguments(self, parser):
-        parser.add_argument(
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument(
             '--pharmacy',
             type=int,
-            help='Pharmacy ID to assign drugs to (required)',
-            required=True
+            nargs='+',
+            help='IDs of the pharmacies to assign drugs to'
+        )
+        target.add_argument(
+            '--all-pharmacies',
+            action='store_true',
+            help='Assign drugs to every pharmacy'
+        )
+        parser.add_argument('--fetch-workers', type=int, default=8, help='Concurrent label downloads')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Summary worker processes')
+        parser.add_argument(
+            '--cache-dir',
+            type=str,
+            help='Directory of cached labels and summaries (default: .cache/openfda; required with --fixtures)'
         )
+        parser.add_argument('--refresh', action='store_true', help='Ignore the cache and fetch and summarize again')
+        parser.add_argument('--fixtures', type=str, help='Read labels from this directory instead of the OpenFDA API')
 
-    def handle(self, *args, **kwargs):
-        from pharmacy.models import PharmacyProfile
+    def handle(self, *args, **options):
+        if options['all_pharmacies']:
+            pharmacies = list(PharmacyProfile.objects.all())
+        else:
+            pharmacies = list(PharmacyProfile.objects.filter(id__in=options['pharmacy']))
+            missing = set(options['pharmacy']) - {pharmacy.id for pharmacy in pharmacies}
+            if missing:
+                raise CommandError(f"Pharmacy with ID {', '.join(map(str, sorted(missing)))} does not exist")
+        if not pharmacies:
+            raise CommandError("There are no pharmacies to import drugs into")
 
-        pharmacy_id = kwargs['pharmacy']
+        if options['fixtures']:
+            if not options['cache_dir']:
+                raise CommandError("--fixtures needs its own --cache-dir, away from the shared OpenFDA cache")
+            fetcher = FixtureFetcher(options['fixtures'])
+        else:
+            fetcher = OpenFDAFetcher(pool_size=options['fetch_workers'])
+        cache = DiskCache(options['cache_dir'] or settings.BASE_DIR / '.cache' / 'openfda')
 
-        try:
-            pharmacy = PharmacyProfile.objects.get(id=pharmacy_id)
-            self.stdout.write(f"Importing drugs for pharmacy: {pharmacy.pharmacy_name}")
-        except PharmacyProfile.DoesNotExist:
-            self.stderr.write(f"Pharmacy with ID {pharmacy_id} does not exist")
-            return
+        summaries = self.summaries(fetcher, cache, options)
+        drugs = [summaries[name] for name in POPULAR_DRUGS if summaries.get(name)]
+        self.stdout.write(f"{len(drugs)} of {len(POPULAR_DRUGS)} drugs ready")
+
+        for pharmacy in pharmacies:
+            created = self.import_into(pharmacy, drugs)
+            self.stdout.write(self.style.SUCCESS(
+                f"Added {created} drugs to {pharmacy.pharmacy_name} ({len(drugs) - created} already present)"
+            ))
+
+    def summaries(self, fetcher, cache, options):
+        """Drug fields of every POPULAR_DRUGS entry, from the cache where possible: {drug name: fields or None}"""
+        summaries, labels = {}, {}
+        to_fetch = []
         for drug_name in POPULAR_DRUGS:
-            self.stdout.write(f"Processing: {drug_name}")
-            try:
-                response = requests.get(
-                    "https://api.fda.gov/drug/label.json",
-                    params={
-                        "search": f'openfda.generic_name:"{drug_name}"',
-                        "limit": 1
-                    },
-                    timeout=10
-                )
-                response.raise_for_status()
-                results = response.json().get("results", [])
-                if not results:
-                    self.stdout.write(f"No data found for {drug_name}")
+            if not options['refresh']:
+                cached, summary = cache.get('summaries', drug_name)
+                if cached:
+                    summaries[drug_name] = summary
                     continue
-                data = results[0]
-                openfda = data.get("openfda", {})
-            
-                name = openfda.get('generic_name', [None])[0]
-                brand = openfda.get('brand_name', [None])[0]
-                route = openfda.get('route', [None])[0]
-                description = data.get("description", [""])[0]
-                dosage = data.get("dosage_and_administration", [""])[0]
-                summary_description = summarize_text(description, sentences_count=3)
-                summary_dosage = summarize_text(dosage, sentences_count=3)
-
-                Drug.objects.create(
-                    pharmacy=pharmacy,
-                    name=name,
-                    brand=brand,
-                    route=route,
-                    description=summary_description,
-                    dosage=summary_dosage,
-                    stock=100,
-                    status='in_stock'
-                )
-                self.stdout.write(self.style.SUCCESS(f"Added drug: {name}"))
-            except requests.RequestException as e:
-                self.stderr.write(f"Request error for {drug_name}: {e}")
+                cached, label = cache.get('labels', drug_name)
+                if cached:
+                    labels[drug_name] = label
+                    continue
+            to_fetch.append(drug_name)
+
+        if to_fetch:
+            self.stdout.write(f"Fetching {len(to_fetch)} labels...")
+            with ThreadPoolExecutor(max_workers=options['fetch_workers']) as pool:
+                futures = {drug_name: pool.submit(fetcher.fetch, drug_name) for drug_name in to_fetch}
+                for drug_name, future in futures.items():
+                    try:
+                        label = future.result()
+                    except requests.RequestException as e:
+                        # Left out of the cache, so the next run tries again
+                        self.stderr.write(f"Request error for {drug_name}: {e}")
+                        continue
+                    except ValueError as e:
+                        self.stderr.write(f"Invalid label JSON for {drug_name}: {e}")
+                        continue
+                    cache.set('labels', drug_name, label)
+                    labels[drug_name] = label
+
+        for drug_name, label in list(labels.items()):
+            if label is None:
+                self.stdout.write(f"No data found for {drug_name}")
+                cache.set('summaries', drug_name, None)
+                summaries[drug_name] = None
+                del labels[drug_name]
+
+        if labels:
+            self.stdout.write(f"Summarizing {len(labels)} labels...")
+            if options['workers'] <= 1:
+                results = ((drug_name, lambda label=label: summarize_label(label)) for drug_name, label in labels.items())
+                self.collect_summaries(results, cache, summaries)
+            else:
+                with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+                    futures = {drug_name: pool.submit(summarize_label, label) for drug_name, label in labels.items()}
+                    self.collect_summaries(
+                        ((drug_name, future.result) for drug_name, future in futures.items()), cache, summaries
+                    )
+        return summaries
+
+    def collect_summaries(self, results, cache, summaries):
+        """Cache and collect (drug name, callable returning its summary) pairs, reporting failures"""
+        for drug_name, result in results:
+            try:
+                summary = result()
             except Exception as e:
-                self.stderr.write(f"Error processing {drug_name}: {e}")
\ No newline at end of file
+                self.stderr.write(f"Error processing {drug_name}: {e}")
+                continue
+            cache.set('summaries', drug_name, summary)
+            summaries[drug_name] = summary
+
+    def import_into(self, pharmacy, drugs):
+        """bulk_create the drugs a pharmacy doesn't have yet; returns how many were added"""
+        existing = set(pharmacy.drugs.values_list('name', 'brand'))
+        new = []
+        for fields in drugs:
+            values = {
+                field: (fields[field] or '')[:Drug._meta.get_field(field).max_length or None]
+                for field in ('name', 'brand', 'route', 'description', 'dosage')
+            }
+            key = (values['name'], values['brand'])
+            if key in existing:
+                continue
+            existing.add(key)
+            new.append(Drug(pharmacy=pharmacy, stock=100, status='in_stock', **values))
+
+        with transaction.atomic():
+            Drug.objects.bulk_create(new, batch_size=500)
+        # bulk_create sends no post_save signals, so drop the cached catalog here
+        invalidate_catalog(pharmacy.id)
+        return len(new)
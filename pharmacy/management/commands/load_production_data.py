@@ -2,19 +2,135 @@
 Management command to load production data from JSON file.
 This avoids database schema issues by using Django ORM directly.
 
+The file is read incrementally, so memory stays flat however large it is.
+Records are grouped by model and written with bulk_create in chunks of
+--chunk-size records, each chunk in its own transaction. Primary keys are
+remapped: every row gets a new id here, and the source id -> new id pairs of
+rows that other records point at are stored in LoadedRecord, where later
+files (such as incremental exports of the same database) find them too. Rows
+that already exist by natural key, and rows an earlier file loaded from the
+same source row, are updated with bulk_update instead. The
+number of records consumed is committed with each chunk, so an interrupted
+load picks up after its last committed chunk when run again, and a finished
+file is not loaded twice. Files are told apart by a hash of their content.
+
+Accepts a JSON array of {"model", "pk", "fields"} records (Django fixture
+layout, fields as exported from the database columns) or the same records one
+per line, optionally gzip-compressed (.gz), as written by export_data.
+
 Usage:
-    python manage.py load_production_data [--file path/to/data.json]
+    python manage.py load_production_data [--file path/to/data.json] [--chunk-size 2000] [--restart] [--clear]
 """
+import gzip
+import hashlib
 import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
-from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
-from accounts.models import CustomAccount, Message, Thread
-from pharmacy.models import PharmacyProfile, PharmacistProfile, Drug, Prescription
-from patients.models import PatientProfile
-
-CustomUser = get_user_model()
+from django.db import models, transaction
+from django.utils import timezone
+from accounts.models import CustomAccount, Message, Notifications, ReadStatus, Thread, UnreadCounter
+from pharmacy.catalog import invalidate_catalog
+from pharmacy.models import DataLoad, Drug, LoadedRecord, PharmacistProfile, PharmacyProfile, Prescription
+from patients.models import MedicationReminder, PatientProfile, ReminderTime
+
+# Models in dependency order: (labels used in data files, model, natural key). Rows whose
+# natural key already exists in the database are matched to that row and updated with the
+# record's other fields instead of inserted.
+MODELS = [
+    (('accounts.customaccount',), CustomAccount, ('username',)),
+    (('pharmacy.pharmacyprofile',), PharmacyProfile, ('user',)),
+    (('pharmacy.pharmacistprofile',), PharmacistProfile, ('user',)),
+    (('patients.patientprofile',), PatientProfile, ('user',)),
+    (('pharmacy.drug',), Drug, ('pharmacy', 'name', 'brand')),
+    (('pharmacy.prescription',), Prescription, None),
+    (('patients.medicationreminder',), MedicationReminder, None),
+    (('patients.remindertime',), ReminderTime, None),
+    (('accounts.thread',), Thread, None),
+    (('accounts.thread_participant',), Thread.participant.through, ('thread', 'customaccount')),
+    # Older exports label messages with the app they used to live in
+    (('accounts.message', 'pharmacy.message'), Message, None),
+    (('accounts.notifications',), Notifications, None),
+    (('accounts.readstatus',), ReadStatus, ('message', 'user')),
+]
+
+LABELS = {label: model for labels, model, _ in MODELS for label in labels}
+NATURAL_KEYS = {model: key for _, model, key in MODELS}
+LOADED = [model for _, model, _ in MODELS]
+
+# Only rows that other records point at need their new id remembered
+REFERENCED = {
+    field.related_model for model in LOADED for field in model._meta.concrete_fields
+    if field.is_relation and field.related_model in LOADED
+}
+
+# Tables export_data exports by creation time, repeating the rows of an overlap window in the
+# next delta; a repeated row has no natural key, so it is matched by the id it had in the source
+MATCHED_BY_SOURCE = {Prescription, Message, Notifications}
+
+READ_SIZE = 1 << 16
+
+
+def iter_records(path):
+    """
+    Yield the records of a data file one at a time.
+
+    Handles a JSON array as well as newline-delimited records, reading
+    READ_SIZE characters at a time.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    decoder = json.JSONDecoder()
+    with opener(path, 'rt', encoding='utf-8') as f:
+        buffer, pos, eof = '', 0, False
+        while True:
+            # Skip the separators between records: whitespace, the array brackets and commas
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n[],':
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    return
+                buffer, pos = f.read(READ_SIZE), 0
+                eof = not buffer
+                continue
+
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Record cut off by the end of the buffer; read on unless there is nothing left
+                more = f.read(READ_SIZE)
+                if not more:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield record
+            pos = end
+
+
+def file_digest(path):
+    """SHA-256 of a file's bytes, read READ_SIZE bytes at a time"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def keep_timestamps():
+    """Let bulk_create store the file's values in auto_now/auto_now_add fields instead of now()"""
+    fields = [
+        field for model in LOADED for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
 
 
 class Command(BaseCommand):
@@ -27,6 +143,17 @@ class Command(BaseCommand):
             default='production_data.json',
             help='Path to the JSON data file (default: production_data.json)'
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Records committed per transaction (default: 2000)'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the checkpoint of an earlier load of this file and start from the first record'
+        )
         parser.add_argument(
             '--clear',
             action='store_true',
@@ -35,113 +162,234 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         file_path = options['file']
-
-        try:
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-        except FileNotFoundError:
+        if not os.path.exists(file_path):
             raise CommandError(f'File "{file_path}" not found')
-        except json.JSONDecodeError:
-            raise CommandError(f'Invalid JSON in file "{file_path}"')
 
         if options['clear']:
             self.stdout.write(self.style.WARNING('Clearing existing data...'))
             self.clear_data()
 
-        self.stdout.write(self.style.SUCCESS(f'Loading data from {file_path}...'))
+        # Files are identified by content, so deltas written under one name stay distinct
+        source = f'sha256:{file_digest(file_path)}'
+        load, _ = DataLoad.objects.get_or_create(source=source)
+        if options['restart'] and load.records:
+            load.loaded_records.all().delete()
+            load.records, load.completed = 0, False
+            load.save()
+        if load.completed:
+            self.stdout.write(self.style.SUCCESS(f'{file_path} was already loaded; pass --restart to load it again'))
+            return
+        if load.records:
+            self.stdout.write(self.style.WARNING(f'Resuming after record {load.records:,}'))
 
-        # Process data in dependency order
-        with transaction.atomic():
-            stats = {
-                'users': 0,
-                'pharmacies': 0,
-                'pharmacists': 0,
-                'patients': 0,
-                'drugs': 0,
-                'prescriptions': 0,
-                'threads': 0,
-                'messages': 0,
-            }
+        self.stdout.write(self.style.SUCCESS(f'Loading data from {file_path}...'))
+        self.stats = {model: {'created': 0, 'existing': 0, 'skipped': 0} for model in LOADED}
+        self.pharmacies = set()
 
-            # Track PKs for reference
-            pk_map = {}
-
-            for item in data:
-                model_name = item.get('model')
-                pk = item.get('pk')
-                fields = item.get('fields', {})
-
-                if not model_name or not fields:
-                    self.stdout.write(
-                        self.style.WARNING(f'Skipping invalid item: {item}')
-                    )
-                    continue
-
-                try:
-                    if model_name == 'accounts.customaccount':
-                        obj = self.load_user(pk, fields)
-                        if pk:
-                            pk_map[f'user_{pk}'] = obj.pk
-                        stats['users'] += 1
-
-                    elif model_name == 'pharmacy.pharmacyprofile':
-                        obj = self.load_pharmacy(pk, fields, pk_map)
-                        if obj and pk:
-                            pk_map[f'pharmacy_{pk}'] = obj.pk
-                        if obj:
-                            stats['pharmacies'] += 1
-
-                    elif model_name == 'pharmacy.pharmacistprofile':
-                        obj = self.load_pharmacist(pk, fields, pk_map)
-                        if obj and pk:
-                            pk_map[f'pharmacist_{pk}'] = obj.pk
-                        if obj:
-                            stats['pharmacists'] += 1
-
-                    elif model_name == 'patients.patientprofile':
-                        obj = self.load_patient(pk, fields, pk_map)
-                        if obj and pk:
-                            pk_map[f'patient_{pk}'] = obj.pk
-                        if obj:
-                            stats['patients'] += 1
-
-                    elif model_name == 'pharmacy.drug':
-                        obj = self.load_drug(pk, fields, pk_map)
-                        if pk:
-                            pk_map[f'drug_{pk}'] = obj.pk
-                        stats['drugs'] += 1
-
-                    elif model_name == 'pharmacy.prescription':
-                        obj = self.load_prescription(pk, fields, pk_map)
-                        if obj:
-                            if pk:
-                                pk_map[f'prescription_{pk}'] = obj.pk
-                            stats['prescriptions'] += 1
-
-                    elif model_name == 'accounts.thread':
-                        obj = self.load_thread(pk, fields, pk_map)
-                        if pk:
-                            pk_map[f'thread_{pk}'] = obj.pk
-                        stats['threads'] += 1
-
-                    elif model_name == 'accounts.message':
-                        obj = self.load_message(pk, fields, pk_map)
-                        if obj:
-                            if pk:
-                                pk_map[f'message_{pk}'] = obj.pk
-                            stats['messages'] += 1
-
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(f'Error loading {model_name} (pk={pk}): {str(e)}')
-                    )
-                    raise
+        buffers = {model: [] for model in LOADED}
+        buffered = consumed = 0
+        try:
+            with keep_timestamps():
+                for consumed, record in enumerate(iter_records(file_path), start=1):
+                    if consumed <= load.records:
+                        continue
+                    model = LABELS.get(record.get('model'))
+                    if model is None or not record.get('fields'):
+                        self.stdout.write(self.style.WARNING(f'Skipping invalid item: {str(record)[:200]}'))
+                    else:
+                        buffers[model].append((record.get('pk'), record['fields']))
+                        buffered += 1
+
+                    if buffered >= options['chunk_size']:
+                        self.flush(load, buffers, consumed)
+                        buffered = 0
+                self.flush(load, buffers, consumed, completed=True)
+        except json.JSONDecodeError as e:
+            raise CommandError(f'Invalid JSON in file "{file_path}" after record {consumed:,}: {e}')
+
+        # bulk_create sends no signals, so invalidate the drug catalogs it would have
+        for pharmacy_id in self.pharmacies:
+            invalidate_catalog(pharmacy_id)
 
         # Print statistics
         self.stdout.write(self.style.SUCCESS('\nData loaded successfully:'))
-        for model, count in stats.items():
-            if count > 0:
-                self.stdout.write(f'  {model.capitalize()}: {count}')
+        for model, counts in self.stats.items():
+            if any(counts.values()):
+                self.stdout.write(f'  {model._meta.label}: {counts["created"]} created, '
+                                  f'{counts["existing"]} updated, {counts["skipped"]} skipped')
+
+    def flush(self, load, buffers, consumed, completed=False):
+        """Write every buffered record and the checkpoint in one transaction"""
+        self.counter_users = set()
+        with transaction.atomic():
+            for model in LOADED:
+                if buffers[model]:
+                    self.load_rows(load, model, buffers[model])
+                    buffers[model] = []
+            # bulk_create skips the signals that keep unread counters current; the
+            # dropped rows are reseeded from the real counts on next access
+            UnreadCounter.objects.filter(user_id__in=self.counter_users).delete()
+            load.records = max(load.records, consumed)
+            load.completed = completed
+            load.save(update_fields=['records', 'completed', 'updated_at'])
+        self.stdout.write(f'  committed {load.records:,} records')
+
+    def load_rows(self, load, model, rows):
+        """Remap, match and bulk_create one model's records of a chunk"""
+        label = model._meta.label_lower
+        stats = self.stats[model]
+        targets = self.resolve_targets(load, model, rows)
+
+        instances = []
+        for source_pk, fields in rows:
+            instance = self.build(model, source_pk, fields, targets)
+            if instance is None:
+                stats['skipped'] += 1
+            else:
+                instances.append((source_pk, fields, instance))
+
+        # Rows that already exist, found by natural key or an earlier load of the same source row,
+        # keep their id and take the file's values
+        matched = self.match_existing(model, instances)
+        new, updates = [], {}
+        for source_pk, fields, instance in instances:
+            key = self.record_key(model, source_pk, instance)
+            if key is not None and key in matched:
+                # A later duplicate in the same chunk maps onto the row created for the first
+                instance.pk = matched[key]
+                if not isinstance(instance.pk, models.Model):
+                    # The last record of a row wins, as with update_or_create
+                    updates[instance.pk] = (self.update_fields(model, fields), instance)
+                stats['existing'] += 1
+            else:
+                new.append(instance)
+                if key is not None:
+                    matched[key] = instance
+        model.objects.bulk_create(new, batch_size=500)
+        stats['created'] += len(new)
+        updated = self.update_existing(model, updates.values())
+
+        for source_pk, _, instance in instances:
+            if isinstance(instance.pk, models.Model):
+                instance.pk = instance.pk.pk
+        if model is Drug:
+            self.pharmacies.update(instance.pharmacy_id for instance in new + updated if instance.pharmacy_id)
+        if model in (Notifications, ReadStatus):
+            self.counter_users.update(instance.user_id for instance in new + updated)
+        if model in REFERENCED or model in MATCHED_BY_SOURCE:
+            LoadedRecord.objects.bulk_create([
+                LoadedRecord(load=load, model=label, source_pk=source_pk, target_pk=instance.pk)
+                for source_pk, _, instance in instances if source_pk is not None
+            ], batch_size=500, ignore_conflicts=True)
+
+    def resolve_targets(self, load, model, rows):
+        """New ids of every row the chunk's foreign keys point at: {related model: {source id: id}}"""
+        targets = {}
+        for field in model._meta.concrete_fields:
+            if not field.is_relation or field.related_model not in REFERENCED:
+                continue
+            source_ids = {
+                value for _, fields in rows
+                for value in [fields.get(field.attname, fields.get(field.name))] if value is not None
+            }
+            related = field.related_model._meta.label_lower
+            targets.setdefault(field.related_model, {}).update(
+                # Incremental exports point at rows loaded from earlier files; the current load wins
+                LoadedRecord.objects.filter(model=related, source_pk__in=source_ids)
+                .order_by('load__updated_at').values_list('source_pk', 'target_pk')
+            )
+        return targets
+
+    def build(self, model, source_pk, fields, targets):
+        """Unsaved instance of a record, or None if a required row it points at is missing"""
+        values = {}
+        for field in model._meta.concrete_fields:
+            if field.primary_key:
+                continue
+            if field.attname in fields:
+                value = fields[field.attname]
+            elif field.name in fields:
+                value = fields[field.name]
+            else:
+                continue
+
+            if field.is_relation:
+                if field.related_model in REFERENCED and value is not None:
+                    value = targets[field.related_model].get(value)
+                if value is None and not field.null:
+                    self.stdout.write(self.style.WARNING(
+                        f'Skipping {model._meta.model_name} {source_pk}: {field.attname} '
+                        f'{fields.get(field.attname, fields.get(field.name))} not found'
+                    ))
+                    return None
+            elif value is not None:
+                value = field.to_python(value)
+                if isinstance(value, datetime) and timezone.is_naive(value):
+                    # Database exports store UTC without an offset
+                    value = timezone.make_aware(value, dt_timezone.utc)
+                if isinstance(value, str) and field.max_length:
+                    value = value[:field.max_length]
+            values[field.attname] = value
+
+        for field in model._meta.concrete_fields:
+            if (getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)) and not values.get(field.attname):
+                values[field.attname] = timezone.now()
+
+        instance = model(**values)
+        if model is ReminderTime and instance.is_active and instance.next_fire_at is None:
+            instance.schedule()
+        return instance
+
+    def record_key(self, model, source_pk, instance):
+        """What a record is matched to an existing row by: its natural key or its source id, if any"""
+        if model in MATCHED_BY_SOURCE:
+            return source_pk
+        key = NATURAL_KEYS[model]
+        if key is None:
+            return None
+        return tuple(getattr(instance, model._meta.get_field(name).attname) for name in key)
+
+    def match_existing(self, model, instances):
+        """{record key: id} of rows already in the database with the key of one of `instances`"""
+        if model in MATCHED_BY_SOURCE:
+            source_ids = {source_pk for source_pk, _, _ in instances if source_pk is not None}
+            # Like resolve_targets, the latest load of a source row wins
+            return dict(
+                LoadedRecord.objects.filter(model=model._meta.label_lower, source_pk__in=source_ids)
+                .order_by('load__updated_at').values_list('source_pk', 'target_pk')
+            )
+        key = NATURAL_KEYS[model]
+        if key is None or not instances:
+            return {}
+        instances = [instance for _, _, instance in instances]
+        attnames = [model._meta.get_field(name).attname for name in key]
+        lookups = {
+            f'{attname}__in': {getattr(instance, attname) for instance in instances}
+            for attname in attnames
+        }
+        return {
+            tuple(row[1:]): row[0]
+            for row in model.objects.filter(**lookups).values_list('pk', *attnames)
+        }
+
+    def update_fields(self, model, fields):
+        """Columns a record sets on a matched row: those in the record, besides the natural key"""
+        key = {model._meta.get_field(name).attname for name in NATURAL_KEYS[model] or ()}
+        return tuple(
+            field.attname for field in model._meta.concrete_fields
+            if not field.primary_key and field.attname not in key
+            and (field.attname in fields or field.name in fields or getattr(field, 'auto_now', False))
+        )
+
+    def update_existing(self, model, updates):
+        """bulk_update matched rows, grouped by the columns their records set; returns the updated instances"""
+        groups = {}
+        for update_fields, instance in updates:
+            if update_fields:
+                groups.setdefault(update_fields, []).append(instance)
+        for update_fields, instances in groups.items():
+            model.objects.bulk_update(instances, update_fields, batch_size=500)
+        return [instance for instances in groups.values() for instance in instances]
 
     def clear_data(self):
         """Clear existing data"""
@@ -152,247 +400,5 @@ class Command(BaseCommand):
         PharmacistProfile.objects.all().delete()
         PharmacyProfile.objects.all().delete()
         CustomAccount.objects.all().delete()
+        DataLoad.objects.all().delete()
         self.stdout.write(self.style.SUCCESS('Existing data cleared'))
-
-    def load_user(self, pk, fields):
-        """Load or update a CustomAccount"""
-        obj, created = CustomAccount.objects.update_or_create(
-            username=fields['username'],
-            defaults={
-                'email': fields.get('email', ''),
-                'first_name': fields.get('first_name', ''),
-                'last_name': fields.get('last_name', ''),
-                'is_active': fields.get('is_active', True),
-                'is_staff': fields.get('is_staff', False),
-                'is_superuser': fields.get('is_superuser', False),
-                'date_joined': fields.get('date_joined'),
-                'role': fields.get('role', 'patient'),
-            }
-        )
-        # Set password and last_login if provided
-        update_fields = []
-        if 'password' in fields:
-            obj.password = fields['password']
-            update_fields.append('password')
-        if 'last_login' in fields and fields['last_login']:
-            obj.last_login = fields['last_login']
-            update_fields.append('last_login')
-        if update_fields:
-            obj.save(update_fields=update_fields)
-        return obj
-
-    def load_pharmacy(self, pk, fields, pk_map):
-        """Load or update a PharmacyProfile"""
-        user_pk = pk_map.get(f'user_{fields.get("user_id")}') if fields.get("user_id") else None
-
-        # Skip if user doesn't exist (orphaned data)
-        if not user_pk:
-            self.stdout.write(
-                self.style.WARNING(f'Skipping pharmacy {pk}: user_id {fields.get("user_id")} not found')
-            )
-            return None
-
-        user = CustomAccount.objects.get(pk=user_pk)
-
-        obj, created = PharmacyProfile.objects.update_or_create(
-            user=user,
-            defaults={
-                'pharmacy_name': fields['pharmacy_name'],
-                'street_address': fields.get('street_address', ''),
-                'city': fields.get('city', ''),
-                'state': fields.get('state', ''),
-                'zip_code': fields.get('zip_code', ''),
-                'join_code': fields.get('join_code', ''),
-            }
-        )
-        return obj
-
-    def load_pharmacist(self, pk, fields, pk_map):
-        """Load or update a PharmacistProfile"""
-        user_pk = pk_map.get(f'user_{fields.get("user_id")}') if fields.get("user_id") else None
-        pharmacy_pk = pk_map.get(f'pharmacy_{fields.get("pharmacy_id")}') if fields.get("pharmacy_id") else None
-
-        # Skip if user doesn't exist (orphaned data)
-        if not user_pk:
-            self.stdout.write(
-                self.style.WARNING(f'Skipping pharmacist {pk}: user_id {fields.get("user_id")} not found')
-            )
-            return None
-
-        # Skip if pharmacy doesn't exist (pharmacy is required for pharmacist)
-        if not pharmacy_pk:
-            self.stdout.write(
-                self.style.WARNING(f'Skipping pharmacist {pk}: pharmacy_id {fields.get("pharmacy_id")} not found')
-            )
-            return None
-
-        user = CustomAccount.objects.get(pk=user_pk)
-        pharmacy = PharmacyProfile.objects.get(pk=pharmacy_pk)
-
-        obj, created = PharmacistProfile.objects.update_or_create(
-            user=user,
-            defaults={
-                'pharmacy': pharmacy,
-                'first_name': fields['first_name'],
-                'last_name': fields['last_name'],
-            }
-        )
-        return obj
-
-    def load_patient(self, pk, fields, pk_map):
-        """Load or update a PatientProfile"""
-        user_pk = pk_map.get(f'user_{fields.get("user_id")}') if fields.get("user_id") else None
-        pharmacy_pk = pk_map.get(f'pharmacy_{fields.get("pharmacy_id")}') if fields.get("pharmacy_id") else None
-
-        # Skip if user doesn't exist (orphaned data)
-        if not user_pk:
-            self.stdout.write(
-                self.style.WARNING(f'Skipping patient {pk}: user_id {fields.get("user_id")} not found')
-            )
-            return None
-
-        user = CustomAccount.objects.get(pk=user_pk)
-        pharmacy = PharmacyProfile.objects.get(pk=pharmacy_pk) if pharmacy_pk else None
-
-        obj, created = PatientProfile.objects.update_or_create(
-            user=user,
-            defaults={
-                'first_name': fields['first_name'],
-                'last_name': fields['last_name'],
-                'dob': fields.get('dob'),
-                'gender': fields.get('gender', 'N'),
-                'phone_number': fields.get('phone_number', ''),
-                'pharmacy': pharmacy,
-            }
-        )
-        return obj
-
-    def load_drug(self, pk, fields, pk_map):
-        """Load or update a Drug"""
-        pharmacy_pk = pk_map.get(f'pharmacy_{fields.get("pharmacy_id")}') if fields.get("pharmacy_id") else None
-        pharmacy = PharmacyProfile.objects.get(pk=pharmacy_pk) if pharmacy_pk else None
-
-        # Aggressive truncation to handle migration not being applied yet
-        # Will truncate to 100 chars (old limit) to be safe, migration will increase to 2000
-        dosage = str(fields.get('dosage', ''))[:100]
-        route = str(fields.get('route', ''))[:100]
-        name = str(fields.get('name', ''))[:255]
-        brand = str(fields.get('brand', ''))[:255]
-
-        obj, created = Drug.objects.update_or_create(
-            name=name,
-            brand=brand,
-            pharmacy=pharmacy,
-            defaults={
-                'description': fields.get('description', ''),
-                'dosage': dosage,
-                'route': route,
-                'stock': fields.get('stock', 100),
-                'status': fields.get('status', 'in_stock'),
-                'resupply_pending': fields.get('resupply_pending', False),
-            }
-        )
-        return obj
-
-    def load_prescription(self, pk, fields, pk_map):
-        """Load or update a Prescription"""
-        patient_pk = pk_map.get(f'patient_{fields.get("patient_id")}') if fields.get("patient_id") else None
-        drug_pk = pk_map.get(f'drug_{fields.get("medicine_id")}') if fields.get("medicine_id") else None
-        pharmacist_pk = pk_map.get(f'pharmacist_{fields.get("prescribed_by_id")}') if fields.get("prescribed_by_id") else None
-
-        # Skip if required foreign keys are missing
-        if not patient_pk:
-            self.stdout.write(
-                self.style.WARNING(f'Skipping prescription {pk}: patient_id {fields.get("patient_id")} not found')
-            )
-            return None
-        if not drug_pk:
-            self.stdout.write(
-                self.style.WARNING(f'Skipping prescription {pk}: medicine_id {fields.get("medicine_id")} not found')
-            )
-            return None
-
-        patient = PatientProfile.objects.get(pk=patient_pk)
-        medicine = Drug.objects.get(pk=drug_pk)
-        pharmacist = PharmacistProfile.objects.get(pk=pharmacist_pk) if pharmacist_pk else None
-
-        obj = Prescription.objects.create(
-            patient=patient,
-            medicine=medicine,
-            quantity=fields.get('quantity', 0),
-            prescribed_by=pharmacist,
-            expiration_date=fields['expiration_date'],
-            refills_left=fields.get('refills_left', 3),
-            refill_pending=fields.get('refill_pending', False),
-        )
-
-        # Set timestamps manually if provided
-        if 'prescribed_on' in fields:
-            Prescription.objects.filter(pk=obj.pk).update(prescribed_on=fields['prescribed_on'])
-        if fields.get('refilled_on'):
-            Prescription.objects.filter(pk=obj.pk).update(refilled_on=fields['refilled_on'])
-
-        return obj
-
-    def load_thread(self, pk, fields, pk_map):
-        """Load or update a Thread"""
-        obj = Thread.objects.create()
-
-        # Set timestamps manually if provided
-        update_fields = {}
-        if 'created_at' in fields:
-            update_fields['created_at'] = fields['created_at']
-        if 'last_updated' in fields:
-            update_fields['last_updated'] = fields['last_updated']
-        if update_fields:
-            Thread.objects.filter(pk=obj.pk).update(**update_fields)
-
-        # Add participants (this is a ManyToMany relationship)
-        # The fixture may have participant IDs we need to add after thread creation
-        # This will be handled in a separate pass if needed
-
-        return obj
-
-    def load_message(self, pk, fields, pk_map):
-        """Load or update a Message"""
-        sender_pk = pk_map.get(f'user_{fields.get("sender_id")}') if fields.get("sender_id") else None
-        recipient_pk = pk_map.get(f'user_{fields.get("recipient_id")}') if fields.get("recipient_id") else None
-        thread_pk = pk_map.get(f'thread_{fields.get("thread_id")}') if fields.get("thread_id") else None
-        prescription_pk = pk_map.get(f'prescription_{fields.get("prescription_id")}') if fields.get("prescription_id") else None
-        drug_pk = pk_map.get(f'drug_{fields.get("drug_id")}') if fields.get("drug_id") else None
-
-        # Skip if required foreign keys are missing
-        if not sender_pk:
-            self.stdout.write(
-                self.style.WARNING(f'Skipping message {pk}: sender_id {fields.get("sender_id")} not found')
-            )
-            return None
-        if not thread_pk:
-            self.stdout.write(
-                self.style.WARNING(f'Skipping message {pk}: thread_id {fields.get("thread_id")} not found')
-            )
-            return None
-
-        sender = CustomAccount.objects.get(pk=sender_pk)
-        recipient = CustomAccount.objects.get(pk=recipient_pk) if recipient_pk else None
-        thread = Thread.objects.get(pk=thread_pk)
-        prescription = Prescription.objects.get(pk=prescription_pk) if prescription_pk else None
-        drug = Drug.objects.get(pk=drug_pk) if drug_pk else None
-
-        obj = Message.objects.create(
-            sender=sender,
-            recipient=recipient,
-            thread=thread,
-            content=fields.get('content', ''),
-            link=fields.get('link'),
-            prescription=prescription,
-            refill_fulfilled=fields.get('refill_fulfilled'),
-            drug=drug,
-            resupply_fulfilled=fields.get('resupply_fulfilled'),
-        )
-
-        # Set timestamp manually if provided
-        if 'timestamp' in fields:
-            Message.objects.filter(pk=obj.pk).update(timestamp=fields['timestamp'])
-
-        return obj
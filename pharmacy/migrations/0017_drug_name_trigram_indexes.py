@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:40
+
+from django.db import migrations
+
+POSTGRES_FORWARDS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS pharmacy_drug_name_trgm ON pharmacy_drug USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS pharmacy_drug_brand_trgm ON pharmacy_drug USING gin (brand gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS pharmacy_drug_name_trgm",
+    "DROP INDEX IF EXISTS pharmacy_drug_brand_trgm",
+]
+
+
+def run_postgres_sql(statements):
+    # Trigram indexes only exist on PostgreSQL; other backends search an in-process trie
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0016_alter_drug_dosage_alter_drug_route'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgres_sql(POSTGRES_FORWARDS), run_postgres_sql(POSTGRES_BACKWARDS)),
+    ]
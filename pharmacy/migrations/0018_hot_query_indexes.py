@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0023_hot_query_indexes'),
+        ('pharmacy', '0017_drug_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['pharmacy', 'status'], name='drug_pharmacy_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['prescribed_by', '-prescribed_on'], name='rx_prescriber_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(condition=models.Q(('refill_pending', True)), fields=['prescribed_by', '-prescribed_on'], name='rx_refill_pending_idx'),
+        ),
+        migrations.AlterField(
+            model_name='drug',
+            name='pharmacy',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='drugs', to='pharmacy.pharmacyprofile'),
+        ),
+        migrations.AlterField(
+            model_name='prescription',
+            name='prescribed_by',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pharmacist', to='pharmacy.pharmacistprofile'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0018_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataLoad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, unique=True)),
+                ('records', models.BigIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoadedRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('source_pk', models.BigIntegerField()),
+                ('target_pk', models.BigIntegerField()),
+                ('load', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loaded_records', to='pharmacy.dataload')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='loadedrecord',
+            constraint=models.UniqueConstraint(fields=('load', 'model', 'source_pk'), name='loaded_record_source_unique'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 16:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0019_data_load_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drug',
+            name='resupply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='prescription',
+            name='refill_requests',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
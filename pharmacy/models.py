@@ -1,6 +1,8 @@
 from django.db import models
 from accounts.models import CustomAccount
 import uuid
+from django.db import transaction
+from django.db.models import Case, F, Value, When
 from django.db.models.functions import Coalesce
 
 def generate_join_code():
@@ -27,6 +29,34 @@ class PharmacistProfile(models.Model):
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.pharmacy.pharmacy_name})"
 
+class DrugQuerySet(models.QuerySet):
+    def reserve_stock(self, drug_id, quantity):
+        """
+        Atomically take `quantity` units of a drug with a conditional UPDATE.
+
+        Runs `UPDATE ... SET stock = stock - quantity WHERE stock >= quantity`
+        and recomputes status in the same statement, so concurrent pharmacists
+        can never lose a decrement and only the stock/status columns are written.
+
+        Returns:
+            int - the new stock level, or None if there was not enough stock
+        """
+        with transaction.atomic():
+            # SET expressions see the pre-update stock, hence the `quantity` offsets
+            updated = self.filter(id=drug_id, stock__gte=quantity).update(
+                stock=F('stock') - quantity,
+                status=Case(
+                    When(stock=quantity, then=Value('out_of_stock')),
+                    When(stock__lte=quantity + 30, then=Value('low_stock')),
+                    default=Value('in_stock'),
+                ),
+            )
+            if not updated:
+                return None
+
+            # Our UPDATE holds the row lock until commit, so this read is exactly our result
+            return self.filter(id=drug_id).values_list('stock', flat=True).get()
+
 class Drug(models.Model):
     STOCK_STATUS_CHOICES = [
         ('in_stock', 'In Stock'),
@@ -34,7 +64,8 @@ class Drug(models.Model):
         ('out_of_stock', 'Out of Stock'),
     ]
 
-    pharmacy = models.ForeignKey(PharmacyProfile, on_delete=models.CASCADE, related_name='drugs', null=True)
+    # Indexed as the prefix of drug_pharmacy_status_idx
+    pharmacy = models.ForeignKey(PharmacyProfile, on_delete=models.CASCADE, related_name='drugs', null=True, db_index=False)
     name = models.CharField(max_length=255)
     brand = models.CharField(max_length=255, blank=True)
     description = models.TextField()
@@ -43,6 +74,16 @@ class Drug(models.Model):
     stock = models.IntegerField(default=100)
     status = models.CharField(max_length=20, choices=STOCK_STATUS_CHOICES, default='in_stock')
     resupply_pending = models.BooleanField(default=False)
+    # Bumped by every resupply; keys the notification events of each resupply cycle
+    resupply_count = models.PositiveIntegerField(default=0)
+
+    objects = DrugQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Dashboard stock alerts and low stock counts
+            models.Index(fields=['pharmacy', 'status'], name='drug_pharmacy_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.brand}"
@@ -66,16 +107,63 @@ class Prescription (models.Model):
     patient = models.ForeignKey('patients.PatientProfile', related_name='prescription', on_delete=models.SET_NULL, null=True)
     medicine = models.ForeignKey(Drug, related_name='drug', on_delete=models.PROTECT)
     quantity = models.IntegerField(default=0)
-    prescribed_by = models.ForeignKey(PharmacistProfile, related_name='pharmacist', on_delete=models.SET_NULL, null=True)
+    # Indexed as the prefix of rx_prescriber_recent_idx
+    prescribed_by = models.ForeignKey(PharmacistProfile, related_name='pharmacist', on_delete=models.SET_NULL, null=True, db_index=False)
     prescribed_on = models.DateTimeField(auto_now_add=True)
     refilled_on = models.DateTimeField(null=True, blank=True)
     expiration_date = models.DateField()
     refills_left = models.IntegerField(default=3)
     refill_pending = models.BooleanField(default=False)
+    # Bumped by every refill request; keys its notification event
+    refill_requests = models.PositiveIntegerField(default=0)
 
     objects = PrescriptionQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            # Newest prescriptions of a pharmacy's pharmacists (dashboards, all_prescriptions)
+            models.Index(fields=['prescribed_by', '-prescribed_on'], name='rx_prescriber_recent_idx'),
+            # Pending refill requests are a small slice of all prescriptions
+            models.Index(
+                fields=['prescribed_by', '-prescribed_on'],
+                condition=models.Q(refill_pending=True),
+                name='rx_refill_pending_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.medicine.name} ({self.medicine.brand})"
 
 
+
+class DataLoad(models.Model):
+    """
+    Progress of load_production_data through one data file.
+
+    Updated in the same transaction as every chunk it commits, so an
+    interrupted load resumes after the last committed record.
+    """
+    # sha256:<hex digest of the file's bytes>
+    source = models.CharField(max_length=255, unique=True)
+    # Records of the file consumed by committed chunks
+    records = models.BigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} ({self.records} records{', completed' if self.completed else ''})"
+
+class LoadedRecord(models.Model):
+    """Primary key a record of a data file was given in this database"""
+    load = models.ForeignKey(DataLoad, on_delete=models.CASCADE, related_name='loaded_records')
+    model = models.CharField(max_length=100)
+    source_pk = models.BigIntegerField()
+    target_pk = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['load', 'model', 'source_pk'], name='loaded_record_source_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.source_pk} -> {self.target_pk}"
@@ -0,0 +1,274 @@
+"""
+Autocomplete backend for patient_search and medicine_search.
+
+PostgreSQL answers from the pg_trgm GIN indexes on the name columns (see
+patients migration 0022 and pharmacy migration 0017). Other databases use an
+in-process prefix trie per pharmacy, rebuilt lazily whenever that pharmacy's
+patients or drugs change; a process keeps the tries of the MAX_INDEXES most
+recently searched pharmacies. The drug trie shares the version token of the
+drug catalog cache and is built from it.
+"""
+import heapq
+import re
+import threading
+from collections import OrderedDict
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from patients.models import PatientProfile
+from accounts.utils import bump_cache_version, cache_version
+from .catalog import catalog_version_key, drug_catalog
+from .models import Drug
+
+# Maximum number of suggestions returned for one keystroke
+SEARCH_LIMIT = 10
+
+PATIENTS = 'patients'
+DRUGS = 'drugs'
+
+# Tries kept per process, least recently used dropped first
+MAX_INDEXES = 64
+
+# (kind, pharmacy id) -> (version, PrefixIndex) for this process, in order of use
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text):
+    return re.findall(r'\w+', str(text).lower())
+
+
+class _Node:
+    __slots__ = ('children', 'ids', 'exact')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = set()
+        self.exact = set()
+
+
+class PrefixIndex:
+    """Character trie mapping every token prefix to the records containing it"""
+
+    def __init__(self, records, tokens_for, sort_key):
+        self.records = {}
+        self.tokens = {}
+        self.sort_key = sort_key
+        self._root = _Node()
+        for record in records:
+            self.records[record['id']] = record
+            self.tokens[record['id']] = tokens_for(record)
+            for token in self.tokens[record['id']]:
+                self._insert(token, record['id'])
+
+    def _insert(self, token, record_id):
+        node = self._root
+        for char in token:
+            node = node.children.setdefault(char, _Node())
+            node.ids.add(record_id)
+        node.exact.add(record_id)
+
+    def _find(self, term):
+        node = self._root
+        for char in term:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def search(self, terms, limit=SEARCH_LIMIT):
+        """
+        Records matching every term as a prefix of one of their tokens.
+
+        Whole-token matches score higher than prefix matches; ties fall back
+        to the index's sort_key. When that leaves fewer than `limit` records,
+        records containing every term anywhere in their tokens, as the
+        icontains lookups on PostgreSQL find them, are ranked after those.
+        """
+        scores = None
+        for term in terms:
+            node = self._find(term)
+            matched = {} if node is None else {
+                record_id: 2 if record_id in node.exact else 1 for record_id in node.ids
+            }
+            if scores is None:
+                scores = matched
+            else:
+                scores = {record_id: scores[record_id] + matched[record_id] for record_id in scores.keys() & matched.keys()}
+
+        if len(scores) < limit:
+            for record_id, tokens in self.tokens.items():
+                if record_id not in scores and all(any(term in token for token in tokens) for term in terms):
+                    scores[record_id] = 0
+
+        best = heapq.nsmallest(
+            limit, scores, key=lambda record_id: (-scores[record_id], self.sort_key(self.records[record_id]))
+        )
+        return [self.records[record_id] for record_id in best]
+
+
+def _build_patient_index(pharmacy_id):
+    records = PatientProfile.objects.filter(pharmacy_id=pharmacy_id).values(
+        'id', 'first_name', 'last_name', 'user_id', email=F('user__email')
+    )
+    return PrefixIndex(
+        records,
+        lambda r: tokenize(r['first_name']) + tokenize(r['last_name']) + [str(r['id'])],
+        lambda r: (r['first_name'].lower(), r['last_name'].lower()),
+    )
+
+
+def _build_drug_index(pharmacy_id):
+    return PrefixIndex(
+        drug_catalog(pharmacy_id).values(),
+        lambda r: tokenize(r['name']) + tokenize(r['brand']) + [str(r['id'])],
+        lambda r: (r['name'].lower(), r['brand'].lower()),
+    )
+
+
+_BUILDERS = {
+    PATIENTS: _build_patient_index,
+    DRUGS: _build_drug_index,
+}
+
+
+_VERSION_KEYS = {
+    PATIENTS: lambda pharmacy_id: f"search_index_version_{PATIENTS}_{pharmacy_id}",
+    DRUGS: catalog_version_key,
+}
+
+
+def invalidate(kind, pharmacy_id):
+    """
+    Mark a pharmacy's index stale.
+
+    The version lives in the shared cache so every process rebuilds on its
+    next lookup, not just the one that handled the write.
+    """
+    if pharmacy_id is None:
+        return
+    bump_cache_version(_VERSION_KEYS[kind](pharmacy_id))
+    with _indexes_lock:
+        _indexes.pop((kind, pharmacy_id), None)
+
+
+def get_index(kind, pharmacy_id):
+    key = (kind, pharmacy_id)
+    version = cache_version(_VERSION_KEYS[kind](pharmacy_id))
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == version:
+            _indexes.move_to_end(key)
+            return cached[1]
+
+    # Built outside the lock so other pharmacies are not held up by the query
+    index = _BUILDERS[kind](pharmacy_id)
+    with _indexes_lock:
+        _indexes[key] = (version, index)
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def search_patients(pharmacy, query, limit=SEARCH_LIMIT):
+    """
+    Ranked patient suggestions within one pharmacy.
+
+    Args:
+        pharmacy: PharmacyProfile object - the pharmacy whose patients are searched
+        query: str - raw text from the autocomplete box
+        limit: int - maximum number of suggestions
+
+    Returns:
+        list of dicts with id, first_name, last_name, user_id and email
+    """
+    terms = tokenize(query)
+    if not terms or pharmacy is None:
+        return []
+
+    if connection.vendor != 'postgresql':
+        return get_index(PATIENTS, pharmacy.id).search(terms, limit)
+
+    patients = PatientProfile.objects.filter(pharmacy=pharmacy)
+    for term in terms:
+        condition = Q(first_name__icontains=term) | Q(last_name__icontains=term)
+        if term.isdigit():
+            condition |= Q(id=int(term))
+        patients = patients.filter(condition)
+
+    return list(patients.annotate(
+        similarity=TrigramSimilarity(Concat('first_name', Value(' '), 'last_name'), ' '.join(terms))
+    ).order_by('-similarity', 'first_name', 'last_name').values(
+        'id', 'first_name', 'last_name', 'user_id', email=F('user__email')
+    )[:limit])
+
+
+def search_drugs(pharmacy, query, limit=SEARCH_LIMIT):
+    """
+    Ranked drug suggestions within one pharmacy.
+
+    Args:
+        pharmacy: PharmacyProfile object - the pharmacy whose inventory is searched
+        query: str - raw text from the autocomplete box
+        limit: int - maximum number of suggestions
+
+    Returns:
+        list of dicts with id, name and brand
+    """
+    terms = tokenize(query)
+    if not terms or pharmacy is None:
+        return []
+
+    if connection.vendor != 'postgresql':
+        return get_index(DRUGS, pharmacy.id).search(terms, limit)
+
+    drugs = Drug.objects.filter(pharmacy=pharmacy)
+    for term in terms:
+        condition = Q(name__icontains=term) | Q(brand__icontains=term)
+        if term.isdigit():
+            condition |= Q(id=int(term))
+        drugs = drugs.filter(condition)
+
+    return list(drugs.annotate(
+        similarity=TrigramSimilarity(Concat('name', Value(' '), 'brand'), ' '.join(terms))
+    ).order_by('-similarity', 'name', 'brand').values('id', 'name', 'brand')[:limit])
+
+
+def _touches(update_fields, fields):
+    return update_fields is None or bool(set(update_fields) & fields)
+
+
+@receiver(pre_save, sender=PatientProfile)
+def remember_patient_pharmacy(sender, instance, update_fields=None, **kwargs):
+    # A patient switching pharmacies must also drop out of the old pharmacy's index
+    instance._search_previous_pharmacy_id = None
+    if instance.pk and _touches(update_fields, {'pharmacy'}):
+        instance._search_previous_pharmacy_id = PatientProfile.objects.filter(
+            pk=instance.pk
+        ).values_list('pharmacy_id', flat=True).first()
+
+
+@receiver(post_save, sender=PatientProfile)
+def invalidate_patient_index_on_save(sender, instance, update_fields=None, **kwargs):
+    if _touches(update_fields, {'first_name', 'last_name', 'pharmacy', 'user'}):
+        invalidate(PATIENTS, instance.pharmacy_id)
+    previous = getattr(instance, '_search_previous_pharmacy_id', None)
+    if previous != instance.pharmacy_id:
+        invalidate(PATIENTS, previous)
+
+
+@receiver(post_delete, sender=PatientProfile)
+def invalidate_patient_index_on_delete(sender, instance, **kwargs):
+    invalidate(PATIENTS, instance.pharmacy_id)
+
+
+@receiver(post_save, sender='accounts.CustomAccount')
+def invalidate_patient_index_on_email_change(sender, instance, update_fields=None, **kwargs):
+    # Email is shown in the patient suggestions
+    if instance.role == 'patient' and _touches(update_fields, {'email'}):
+        pharmacy_id = PatientProfile.objects.filter(user=instance).values_list('pharmacy_id', flat=True).first()
+        invalidate(PATIENTS, pharmacy_id)
@@ -0,0 +1,279 @@
+"""
+Bulk generation of synthetic pharmacies for benchmarks and load tests.
+
+seed_pharmacy() builds one complete pharmacy - admin, pharmacists, patients,
+inventory, prescriptions, reminders, message threads and notifications - with
+bulk_create, using the scenario mix of seed_demo_scenarios: out of stock, low
+stock and resupply-pending drugs, pending refills, active and archived
+reminders, and read and unread messages. Rows are drawn from a random.Random
+seeded with (seed, index), so the same arguments always produce the same data,
+and every username starts with the given prefix so delete_seeded() can remove
+it again. Join codes are unique, so they are drawn from the prefix instead.
+"""
+import os
+import random
+from datetime import date, time, timedelta
+import django
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+from django.utils import timezone
+from accounts.models import CustomAccount, Message, Notifications, ReadStatus, Thread
+from patients.models import MedicationReminder, PatientProfile, ReminderTime
+from .models import Drug, PharmacistProfile, PharmacyProfile, Prescription
+
+# Rows per pharmacy, per patient or per user; scaled by the commands that seed
+DEFAULT_SIZES = {
+    'pharmacists': 3,
+    'patients': 20,
+    'drugs': 40,
+    'prescriptions': 5,
+    'messages': 10,
+    'notifications': 10,
+}
+
+BATCH_SIZE = 1000
+
+# Patients committed per transaction
+PATIENT_CHUNK = 500
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+               'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Carlos', 'Karen']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Lee']
+
+# (name, brand, description, dosage) from seed_demo_scenarios
+DRUGS = [
+    ('Amoxicillin', 'Amoxil', 'Antibiotic used to treat bacterial infections', '500mg capsules'),
+    ('Lisinopril', 'Prinivil', 'ACE inhibitor for high blood pressure', '10mg tablets'),
+    ('Metformin', 'Glucophage', 'Diabetes medication', '500mg tablets'),
+    ('Atorvastatin', 'Lipitor', 'Cholesterol medication', '20mg tablets'),
+    ('Omeprazole', 'Prilosec', 'Proton pump inhibitor for acid reflux', '20mg capsules'),
+    ('Levothyroxine', 'Synthroid', 'Thyroid hormone replacement', '50mcg tablets'),
+]
+
+MESSAGES = [
+    "Hi, I need a refill for my prescription. I'm running low.",
+    "I've received your refill request. We'll have it ready for pickup tomorrow.",
+    "Do you have this medication in stock? I need to fill my prescription.",
+    "Unfortunately it is currently out of stock. I'll notify you when it arrives.",
+    "What are your pharmacy hours on weekends?",
+    "We're open Saturday 9am-5pm and Sunday 10am-4pm. Let me know if you need anything!",
+]
+
+REMINDER_TIMES = [time(8, 0), time(12, 0), time(16, 0), time(20, 0), time(22, 0)]
+
+
+def shared_password(raw='pulserx-load'):
+    """One password hash for every generated user; hashing per user dominates seeding time"""
+    return make_password(raw)
+
+
+def init_worker():
+    """ProcessPoolExecutor initializer for the commands that seed, export or import in worker processes"""
+    # Spawned workers start without Django; forked ones must not reuse the parent's connection
+    if not apps.ready:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'PulseRx.settings')
+        django.setup()
+    connections.close_all()
+
+
+def _join_code(rng):
+    return ''.join(rng.choice('0123456789ABCDEF') for _ in range(6))
+
+
+def _name(rng):
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def _user(username, role, first_name, last_name, password):
+    return CustomAccount(username=username, email=f'{username}@example.com', role=role,
+                         first_name=first_name, last_name=last_name, password=password)
+
+
+def _drug(rng, n, pharmacy):
+    name, brand, description, dosage = DRUGS[n % len(DRUGS)]
+    # Out of stock, out of stock awaiting resupply, low stock and in stock, as in the demo inventory
+    stock = rng.choice([0, 0, 15, 25, 150, 200, 300, 500])
+    drug = Drug(pharmacy=pharmacy, name=f'{name} {n}', brand=f'{brand} {n}', description=description,
+                dosage=dosage, route='Oral', stock=stock, resupply_pending=stock == 0 and rng.random() < 0.5)
+    drug.update_status()
+    return drug
+
+
+def seed_pharmacy(index, prefix, sizes=None, seed=0, password=None, batch_size=BATCH_SIZE, chunk_size=PATIENT_CHUNK):
+    """
+    Create one synthetic pharmacy and everything that belongs to it.
+
+    Every patient has `prescriptions` prescriptions, a reminder on two in
+    three of them (half of those archived), one thread with the pharmacy
+    admin and every pharmacist holding `messages` messages, and `notifications`
+    notifications. Each pharmacist gets `notifications` notifications too.
+
+    The pharmacy and its staff are committed first, then the patients in
+    chunks of chunk_size, each chunk in its own transaction, so memory and
+    transaction size stay flat however many patients a pharmacy has.
+
+    Args:
+        index: int - position of the pharmacy; part of usernames and the random seed
+        prefix: str - username prefix of every generated user
+        sizes: dict - overrides of DEFAULT_SIZES
+        seed: int - random seed shared by a whole run
+        password: str - password hash for every user, from shared_password()
+        batch_size: int - rows per INSERT
+        chunk_size: int - patients per transaction
+
+    Returns:
+        dict - the pharmacy and the number of rows created per model
+    """
+    sizes = {**DEFAULT_SIZES, **(sizes or {})}
+    rng = random.Random(f'{seed}:{index}')
+    password = password or shared_password()
+
+    def create(model, objs):
+        return model.objects.bulk_create(objs, batch_size=batch_size)
+
+    with transaction.atomic():
+        first, last = _name(rng)
+        admin = create(CustomAccount, [_user(f'{prefix}_{index}_admin', 'pharmacy admin', first, last, password)])[0]
+        pharmacy = create(PharmacyProfile, [PharmacyProfile(
+            user=admin, pharmacy_name=f'{last} Pharmacy {index}', street_address=f'{index + 1} Main St',
+            city='Newark', state='NJ', zip_code='07102', join_code=_join_code(random.Random(f'{prefix}:{index}')),
+        )])[0]
+
+        staff_names = [_name(rng) for _ in range(sizes['pharmacists'])]
+        staff_users = create(CustomAccount, [
+            _user(f'{prefix}_{index}_pharmacist_{n}', 'pharmacist', first, last, password)
+            for n, (first, last) in enumerate(staff_names)
+        ])
+        pharmacists = create(PharmacistProfile, [
+            PharmacistProfile(user=user, pharmacy=pharmacy, first_name=user.first_name, last_name=user.last_name)
+            for user in staff_users
+        ])
+        drugs = create(Drug, [_drug(rng, n, pharmacy) for n in range(sizes['drugs'])])
+        staff_notifications = create(Notifications, [
+            Notifications(user=user, content=f'New message: {MESSAGES[n % len(MESSAGES)]}',
+                          link='/accounts/messages', is_read=rng.random() < 0.7)
+            for user in staff_users for n in range(sizes['notifications'])
+        ])
+
+    counts = {
+        'pharmacy': pharmacy,
+        'users': 1 + len(staff_users),
+        'drugs': len(drugs),
+        'prescriptions': 0,
+        'reminders': 0,
+        'reminder_times': 0,
+        'messages': 0,
+        'read_statuses': 0,
+        'notifications': len(staff_notifications),
+    }
+    staff = (admin, [user.id for user in staff_users], pharmacists, drugs)
+    for start in range(0, sizes['patients'], chunk_size):
+        numbers = range(start, min(start + chunk_size, sizes['patients']))
+        with transaction.atomic():
+            for model, created in _seed_patients(rng, index, prefix, sizes, password, pharmacy, staff, numbers, create).items():
+                counts[model] += created
+    return counts
+
+
+def _seed_patients(rng, index, prefix, sizes, password, pharmacy, staff, numbers, create):
+    """Patients `numbers` of one pharmacy with their prescriptions, reminders, thread and notifications"""
+    admin, staff_ids, pharmacists, drugs = staff
+    staff_ids = [admin.id, *staff_ids]
+    now = timezone.now()
+    today = date.today()
+
+    patient_names = [_name(rng) for _ in numbers]
+    patient_users = create(CustomAccount, [
+        _user(f'{prefix}_{index}_patient_{n}', 'patient', first, last, password)
+        for n, (first, last) in zip(numbers, patient_names)
+    ])
+    patients = create(PatientProfile, [
+        PatientProfile(user=user, pharmacy=pharmacy, first_name=user.first_name, last_name=user.last_name,
+                       dob=date(rng.randint(1940, 2005), rng.randint(1, 12), rng.randint(1, 28)),
+                       gender=rng.choice(['M', 'F']), phone_number=f'555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}')
+        for user in patient_users
+    ])
+
+    prescriptions = create(Prescription, [
+        Prescription(
+            patient=patient, medicine=rng.choice(drugs), prescribed_by=rng.choice(pharmacists),
+            quantity=rng.choice([20, 30, 60, 90]), refills_left=rng.randint(0, 3),
+            expiration_date=today + timedelta(days=rng.choice([-30, 15, 60, 90, 180, 365])),
+            refill_pending=rng.random() < 0.1,
+        )
+        for patient in patients for _ in range(sizes['prescriptions'])
+    ])
+
+    reminders = create(MedicationReminder, [
+        MedicationReminder(
+            user=prescription.patient, prescription=prescription, frequency=rng.randint(1, 3),
+            start_date=today - timedelta(days=rng.randint(0, 20)), day_amount=30,
+            is_active=not archived, is_archived=archived, remaining_days=0 if archived else None,
+            restoration_time=now - timedelta(days=rng.randint(0, 60)),
+        )
+        for n, prescription in enumerate(prescriptions) if n % 3 != 2
+        for archived in [n % 3 == 1]
+    ])
+    reminder_times = []
+    for reminder in reminders:
+        for slot in REMINDER_TIMES[:reminder.frequency]:
+            reminder_time = ReminderTime(reminder=reminder, time=slot, is_active=reminder.is_active)
+            if reminder.is_active:
+                reminder_time.schedule(now)
+            reminder_times.append(reminder_time)
+    create(ReminderTime, reminder_times)
+
+    threads = create(Thread, [Thread() for _ in patients])
+    through = Thread.participant.through
+    create(through, [
+        through(thread_id=thread.id, customaccount_id=user_id)
+        for thread, patient in zip(threads, patients)
+        for user_id in [patient.user_id, *staff_ids]
+    ])
+
+    messages = create(Message, [
+        Message(thread=thread, sender_id=sender_id, content=MESSAGES[m % len(MESSAGES)],
+                recipient_id=patient.user_id if sender_id != patient.user_id else admin.id)
+        for thread, patient in zip(threads, patients) for m in range(sizes['messages'])
+        for sender_id in [patient.user_id if m % 2 == 0 else rng.choice(staff_ids)]
+    ])
+    participants = {thread.id: [patient.user_id, *staff_ids] for thread, patient in zip(threads, patients)}
+    read_statuses = []
+    for n, message in enumerate(messages):
+        # The last two messages of every thread are the ones likely still unread
+        recent = n % sizes['messages'] >= sizes['messages'] - 2
+        read_statuses.extend(
+            ReadStatus(message=message, user_id=user_id, read=not recent or rng.random() < 0.5)
+            for user_id in participants[message.thread_id] if user_id != message.sender_id
+        )
+    create(ReadStatus, read_statuses)
+
+    notifications = create(Notifications, [
+        Notifications(user_id=patient.user_id, content=f'New message: {MESSAGES[n % len(MESSAGES)]}',
+                      link=f'/accounts/thread/{thread.id}', is_read=rng.random() < 0.7)
+        for thread, patient in zip(threads, patients) for n in range(sizes['notifications'])
+    ])
+
+    return {
+        'users': len(patient_users),
+        'prescriptions': len(prescriptions),
+        'reminders': len(reminders),
+        'reminder_times': len(reminder_times),
+        'messages': len(messages),
+        'read_statuses': len(read_statuses),
+        'notifications': len(notifications),
+    }
+
+
+def delete_seeded(prefix):
+    """Remove every row created by seed_pharmacy() under a username prefix"""
+    users = CustomAccount.objects.filter(username__startswith=f'{prefix}_')
+    with transaction.atomic():
+        # Threads take their messages and read statuses with them; Message.sender is PROTECT
+        Thread.objects.filter(participant__in=users).distinct().delete()
+        # Prescription.medicine is PROTECT and Prescription.patient is SET_NULL
+        Prescription.objects.filter(prescribed_by__user__in=users).delete()
+        Prescription.objects.filter(patient__user__in=users).delete()
+        users.delete()
@@ -1,3 +1,286 @@
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+import nltk
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.urls import reverse
+from accounts.models import CustomAccount, Notifications
+from pharmacy import search
+from pharmacy.management.commands.import_drugs import DiskCache, label_key
+from pharmacy.models import Drug, PharmacistProfile, PharmacyProfile
 
-# Create your tests here.
+
+def has_punkt():
+    try:
+        nltk.data.find('tokenizers/punkt_tab')
+        return True
+    except LookupError:
+        return False
+
+
+def openfda_label(generic_name, brand_name):
+    """Minimal OpenFDA label result as the API returns it"""
+    return {
+        "openfda": {"generic_name": [generic_name], "brand_name": [brand_name], "route": ["ORAL"]},
+        "description": [f"{brand_name} tablets contain {generic_name}. Each tablet is white. Store at room temperature."],
+        "dosage_and_administration": [f"Take one {brand_name} tablet daily. Do not exceed the dose. Swallow whole."],
+    }
+
+
+class ImportDrugsTests(TestCase):
+    def setUp(self):
+        self.pharmacies = [
+            PharmacyProfile.objects.create(
+                user=CustomAccount.objects.create(username=f'admin{n}', email=f'admin{n}@example.com', role='pharmacy admin'),
+                pharmacy_name=f'Pharmacy {n}', street_address='1 Main St', city='Newark', state='NJ', zip_code='07102',
+            )
+            for n in range(2)
+        ]
+        fixtures = tempfile.TemporaryDirectory()
+        cache = tempfile.TemporaryDirectory()
+        self.addCleanup(fixtures.cleanup)
+        self.addCleanup(cache.cleanup)
+        self.fixtures, self.cache_dir = Path(fixtures.name), Path(cache.name)
+
+        self.labels = {
+            "Ibuprofen": openfda_label("IBUPROFEN", "Advil"),
+            "Hydrocodone/Acetaminophen": openfda_label("HYDROCODONE BITARTRATE AND ACETAMINOPHEN", "Norco"),
+        }
+        for drug_name, label in self.labels.items():
+            (self.fixtures / f"{label_key(drug_name)}.json").write_text(json.dumps(label))
+
+    def import_drugs(self, *args):
+        call_command(
+            'import_drugs', '--pharmacy', *[str(pharmacy.id) for pharmacy in self.pharmacies],
+            '--fixtures', str(self.fixtures), '--cache-dir', str(self.cache_dir), '--workers', '1', *args,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+
+    def cache_summaries(self):
+        """Store summaries as a previous run would have, so no summarizing is needed"""
+        cache = DiskCache(self.cache_dir)
+        for drug_name, label in self.labels.items():
+            openfda = label["openfda"]
+            cache.set('summaries', drug_name, {
+                "name": openfda["generic_name"][0], "brand": openfda["brand_name"][0], "route": "ORAL",
+                "description": "Cached description.", "dosage": "Cached dosage.",
+            })
+
+    def test_fixtures_require_own_cache_dir(self):
+        with self.assertRaises(CommandError):
+            call_command('import_drugs', '--pharmacy', str(self.pharmacies[0].id), '--fixtures', str(self.fixtures),
+                         stdout=StringIO())
+
+    def test_imports_into_every_pharmacy_from_cache(self):
+        self.cache_summaries()
+        # Emptying the fixtures proves nothing is fetched when the summaries are cached
+        for path in self.fixtures.iterdir():
+            path.unlink()
+
+        self.import_drugs()
+
+        for pharmacy in self.pharmacies:
+            self.assertEqual(
+                set(pharmacy.drugs.values_list('brand', 'description')),
+                {("Advil", "Cached description."), ("Norco", "Cached description.")},
+            )
+
+    def test_rerun_skips_drugs_already_present(self):
+        self.cache_summaries()
+        self.import_drugs()
+        self.import_drugs()
+
+        self.assertEqual(Drug.objects.count(), 2 * len(self.pharmacies))
+
+    @skipUnless(has_punkt(), "NLTK punkt_tab data is not installed")
+    def test_fetches_and_caches_labels_and_summaries(self):
+        self.import_drugs()
+
+        self.assertEqual(Drug.objects.filter(pharmacy=self.pharmacies[1], brand="Advil").count(), 1)
+        cache = DiskCache(self.cache_dir)
+        self.assertEqual(cache.get('labels', "Ibuprofen"), (True, self.labels["Ibuprofen"]))
+        cached, summary = cache.get('summaries', "Ibuprofen")
+        self.assertTrue(cached)
+        self.assertEqual(summary["name"], "IBUPROFEN")
+        # Drugs without a fixture are cached as having no label
+        self.assertEqual(cache.get('summaries', "Zolpidem"), (True, None))
+
+
+class ResupplyEventKeyTests(TestCase):
+    def setUp(self):
+        admin = CustomAccount.objects.create(username='admin', email='admin@example.com', role='pharmacy admin')
+        self.pharmacy = PharmacyProfile.objects.create(
+            user=admin, pharmacy_name='Main Pharmacy', street_address='1 Main St', city='Newark', state='NJ',
+            zip_code='07102',
+        )
+        self.pharmacist = CustomAccount.objects.create(username='rx', email='rx@example.com', role='pharmacist')
+        PharmacistProfile.objects.create(user=self.pharmacist, pharmacy=self.pharmacy, first_name='R', last_name='X')
+        self.drug = Drug.objects.create(pharmacy=self.pharmacy, name='Ibuprofen', brand='Advil',
+                                        description='Pain reliever', dosage='200mg', stock=0, status='out_of_stock')
+        self.client.force_login(self.pharmacist)
+
+    def dispatched_key(self, task, url):
+        """Event key the view hands to `task` once its transaction commits"""
+        with mock.patch(f'pharmacy.views.{task}.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
+        return delay.call_args.args[0]
+
+    def test_each_resupply_cycle_gets_its_own_keys(self):
+        contact = reverse('contact_admin', args=[self.drug.id])
+        first_request = self.dispatched_key('notify_resupply_requested', contact)
+        self.assertEqual(self.dispatched_key('notify_resupply_requested', contact), first_request)
+
+        resupplied = self.dispatched_key('notify_drug_resupplied', reverse('resupply', args=[self.drug.id]))
+        Drug.objects.filter(id=self.drug.id).update(stock=0)
+        # The resupply task has not run, so no event row exists yet for this cycle
+        second_request = self.dispatched_key('notify_resupply_requested', contact)
+
+        self.assertEqual(resupplied, f'drug_resupplied:{self.drug.id}:1')
+        self.assertNotEqual(second_request, first_request)
+
+
+class ReserveStockTests(TestCase):
+    def setUp(self):
+        self.drug = Drug.objects.create(name='Ibuprofen', brand='Advil', description='Pain reliever',
+                                        dosage='200mg', stock=35)
+
+    def test_returns_new_stock_and_recomputes_status(self):
+        self.assertEqual(Drug.objects.reserve_stock(self.drug.id, 4), 31)
+        self.drug.refresh_from_db()
+        self.assertEqual((self.drug.stock, self.drug.status), (31, 'in_stock'))
+
+        self.assertEqual(Drug.objects.reserve_stock(self.drug.id, 1), 30)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.status, 'low_stock')
+
+    def test_taking_the_last_units_crosses_to_out_of_stock(self):
+        self.assertEqual(Drug.objects.reserve_stock(self.drug.id, 35), 0)
+        self.drug.refresh_from_db()
+        self.assertEqual((self.drug.stock, self.drug.status), (0, 'out_of_stock'))
+
+    def test_returns_none_without_enough_stock(self):
+        self.assertIsNone(Drug.objects.reserve_stock(self.drug.id, 36))
+        self.drug.refresh_from_db()
+        self.assertEqual((self.drug.stock, self.drug.status), (35, 'in_stock'))
+
+    def test_status_matches_update_status(self):
+        for quantity in (1, 3, 1, 30):
+            Drug.objects.reserve_stock(self.drug.id, quantity)
+            self.drug.refresh_from_db()
+            status = self.drug.status
+            self.drug.update_status()
+            self.assertEqual(status, self.drug.status)
+
+
+class LoadProductionDataTests(TestCase):
+    def setUp(self):
+        user = CustomAccount.objects.create(username='admin', email='old@example.com', role='pharmacy admin')
+        self.pharmacy = PharmacyProfile.objects.create(user=user, pharmacy_name='Old Name', street_address='1 Main St',
+                                                       city='Newark', state='NJ', zip_code='07102')
+        self.drug = Drug.objects.create(pharmacy=self.pharmacy, name='Ibuprofen', brand='Advil',
+                                        description='Old description.', dosage='200mg', stock=100)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'data.ndjson'
+
+    def load(self, records):
+        self.path.write_text('\n'.join(json.dumps(record) for record in records))
+        call_command('load_production_data', '--file', str(self.path), stdout=StringIO())
+
+    def test_rows_matched_by_natural_key_take_the_files_values(self):
+        self.load([
+            {"model": "accounts.customaccount", "pk": 7,
+             "fields": {"username": "admin", "email": "new@example.com", "role": "pharmacy admin"}},
+            {"model": "pharmacy.pharmacyprofile", "pk": 3,
+             "fields": {"user": 7, "pharmacy_name": "New Name", "street_address": "1 Main St",
+                        "city": "Newark", "state": "NJ", "zip_code": "07102"}},
+            {"model": "pharmacy.drug", "pk": 11,
+             "fields": {"pharmacy": 3, "name": "Ibuprofen", "brand": "Advil", "description": "New description.",
+                        "dosage": "400mg", "stock": 12, "status": "low_stock"}},
+        ])
+
+        self.assertEqual(CustomAccount.objects.get().email, 'new@example.com')
+        self.assertEqual(PharmacyProfile.objects.get().pharmacy_name, 'New Name')
+        drug = Drug.objects.get()
+        self.assertEqual(drug.id, self.drug.id)
+        self.assertEqual((drug.description, drug.dosage, drug.stock, drug.status),
+                         ('New description.', '400mg', 12, 'low_stock'))
+        # Fields the file leaves out keep their values
+        self.assertEqual(PharmacyProfile.objects.get().join_code, self.pharmacy.join_code)
+
+    def test_rows_repeated_by_a_later_delta_are_updated_not_duplicated(self):
+        account = {"model": "accounts.customaccount", "pk": 8,
+                   "fields": {"username": "patient", "email": "patient@example.com", "role": "patient"}}
+        notification = {"model": "accounts.notifications", "pk": 40,
+                        "fields": {"user": 8, "content": "Refill ready", "time": "2026-01-05T23:30:00Z", "is_read": False}}
+        self.load([account, notification])
+        # The next delta repeats the overlap window, with the row changed in between
+        notification["fields"]["is_read"] = True
+        self.load([notification, {"model": "accounts.notifications", "pk": 41,
+                                  "fields": {"user": 8, "content": "Late", "time": "2026-01-05T23:40:00Z"}}])
+
+        self.assertEqual(sorted(Notifications.objects.values_list('content', 'is_read')),
+                         [('Late', False), ('Refill ready', True)])
+
+
+class ExportDataTests(TestCase):
+    def setUp(self):
+        self.user = CustomAccount.objects.create(username='patient', email='patient@example.com', role='patient')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def export(self, name, *args):
+        output = self.directory / name
+        call_command('export_data', '--output', str(output), '--workers', '1', *args, stdout=StringIO())
+        return [json.loads(line) for line in output.read_text().splitlines()]
+
+    def test_delta_repeats_rows_committed_late_within_the_overlap(self):
+        first = Notifications.objects.create(user=self.user, content='First')
+        self.export('full.ndjson')
+        # Saved before the watermark was read, but only visible afterwards
+        late = Notifications.objects.create(user=self.user, content='Late')
+        Notifications.objects.filter(pk=late.pk).update(time=first.time - timedelta(minutes=5))
+        manifest = str(self.directory / 'full.ndjson.manifest.json')
+
+        exported = {record['pk'] for record in self.export('delta.ndjson', '--since', manifest)
+                    if record['model'] == 'accounts.notifications'}
+        self.assertEqual(exported, {first.pk, late.pk})
+
+        exported = {record['pk'] for record in self.export('strict.ndjson', '--since', manifest, '--overlap', '0')
+                    if record['model'] == 'accounts.notifications'}
+        self.assertEqual(exported, set())
+
+
+class PrefixIndexTests(TestCase):
+    def setUp(self):
+        self.pharmacy = PharmacyProfile.objects.create(
+            user=CustomAccount.objects.create(username='admin', email='admin@example.com', role='pharmacy admin'),
+            pharmacy_name='Main Pharmacy', street_address='1 Main St', city='Newark', state='NJ', zip_code='07102',
+        )
+        for name, brand in (('Ibuprofen', 'Advil'), ('Acetaminophen', 'Tylenol'), ('Naproxen', 'Aleve')):
+            Drug.objects.create(pharmacy=self.pharmacy, name=name, brand=brand, description='-', dosage='-')
+        self.addCleanup(search._indexes.clear)
+
+    def names(self, query):
+        return [drug['name'] for drug in search.get_index(search.DRUGS, self.pharmacy.id).search(search.tokenize(query))]
+
+    def test_prefix_matches_rank_before_substring_matches(self):
+        self.assertEqual(self.names('ale'), ['Naproxen'])
+        # "prof" starts no token; substring matches are still found
+        self.assertEqual(self.names('prof'), ['Ibuprofen'])
+        self.assertEqual(self.names('en'), ['Acetaminophen', 'Ibuprofen', 'Naproxen'])
+        self.assertEqual(self.names('xyz'), [])
+
+    def test_keeps_only_the_most_recently_used_indexes(self):
+        with mock.patch.object(search, 'MAX_INDEXES', 2):
+            for pharmacy_id in (self.pharmacy.id, -1, -2):
+                search.get_index(search.DRUGS, pharmacy_id)
+            search.get_index(search.DRUGS, -1)
+
+            self.assertEqual(list(search._indexes), [(search.DRUGS, -2), (search.DRUGS, -1)])
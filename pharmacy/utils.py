@@ -0,0 +1,101 @@
+from django.core.cache import cache
+from django.db.models import F, Func, IntegerField, Subquery
+from django.utils import timezone
+from accounts.models import Thread
+from patients.models import PatientProfile
+from .models import Drug, PharmacyProfile, Prescription
+
+# Dashboard counters are cached per pharmacy for this many seconds
+DASHBOARD_CACHE_TTL = 30
+
+
+def _count_subquery(queryset):
+    """Scalar COUNT(*) subquery over a filtered queryset"""
+    return Subquery(
+        queryset.order_by().annotate(
+            total=Func(F('id'), function='COUNT', output_field=IntegerField())
+        ).values('total')
+    )
+
+
+def dashboard_counts(pharmacy):
+    """
+    Patient, pending refill and low stock totals for a pharmacy.
+
+    All three are computed in a single query and cached per pharmacy for
+    DASHBOARD_CACHE_TTL seconds.
+    """
+    cache_key = f"pharmacy_dashboard_counts_{pharmacy.id}"
+    counts = cache.get(cache_key)
+    if counts is not None:
+        return counts
+
+    # Exclude expired prescriptions from pending refills count
+    today = timezone.now().date()
+    counts = PharmacyProfile.objects.filter(id=pharmacy.id).annotate(
+        total_patients=_count_subquery(PatientProfile.objects.filter(pharmacy=pharmacy)),
+        pending_refills=_count_subquery(Prescription.objects.filter(
+            refill_pending=True,
+            prescribed_by__pharmacy=pharmacy,
+            expiration_date__gt=today
+        )),
+        low_stock=_count_subquery(Drug.objects.filter(status='low_stock', pharmacy=pharmacy)),
+    ).values('total_patients', 'pending_refills', 'low_stock').get()
+
+    cache.set(cache_key, counts, DASHBOARD_CACHE_TTL)
+    return counts
+
+
+def dashboard_context(pharmacy, user):
+    """
+    Template context shared by pharmacy_home and pharmacist_home.
+
+    Loads in a fixed number of queries: one for the counters (zero when
+    cached), one for the stock alert drugs, two for the recent prescription
+    slices and two for the recent threads with their participants.
+    """
+    today = timezone.now().date()
+
+    # One query for both stock alert lists
+    alert_drugs = list(
+        Drug.objects.filter(pharmacy=pharmacy, status__in=['out_of_stock', 'low_stock'])
+        .only('id', 'name', 'brand', 'status', 'resupply_pending')
+    )
+
+    # Use select_related to reduce database queries
+    # Exclude expired prescriptions
+    recent_prescriptions = Prescription.objects.filter(
+        prescribed_by__pharmacy=pharmacy,
+        expiration_date__gt=today
+    ).select_related('medicine', 'patient', 'prescribed_by').order_by('-prescribed_on')[:5]
+
+    recent_requests = Prescription.objects.filter(
+        prescribed_by__pharmacy=pharmacy,
+        refill_pending=True,
+        expiration_date__gt=today
+    ).select_related('medicine', 'patient', 'prescribed_by').order_by('-prescribed_on')[:5]
+
+    # Use prefetch_related for ManyToMany relationships
+    recent_threads = list(Thread.objects.filter(
+        participant=user
+    ).exclude(participant__role='system').prefetch_related('participant').order_by('-id')[:5])
+
+    # Filter the prefetched participants in Python instead of one query per thread
+    for thread in recent_threads:
+        thread.other_participants = [
+            p for p in thread.participant.all()
+            if p.id != user.id and p.role == 'patient'
+        ]
+
+    counts = dashboard_counts(pharmacy)
+
+    return {
+        'total_patients': counts['total_patients'],
+        'low_stock': counts['low_stock'],
+        'pending_refills': counts['pending_refills'],
+        'no_stock': [drug for drug in alert_drugs if drug.status == 'out_of_stock'],
+        'low_stock_drugs': [drug for drug in alert_drugs if drug.status == 'low_stock'],
+        'recent_prescriptions': recent_prescriptions,
+        'recent_threads': recent_threads,
+        'recent_requests': recent_requests
+    }
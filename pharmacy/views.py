@@ -2,78 +2,40 @@ from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.core.paginator import Paginator
 from django.views.decorators.cache import never_cache
-from .models import Drug, PharmacyProfile, PharmacistProfile, Prescription, generate_join_code
+from .models import Drug, PharmacyProfile, Prescription, generate_join_code
 from accounts.models import CustomAccount
 from accounts.models import Message, Thread, Notifications, ReadStatus
-from accounts.utils import send_notification_with_counts
+from accounts.tasks import (
+    event_key, notify_prescription_created, notify_prescription_refilled,
+    notify_drug_resupplied, notify_resupply_requested
+)
 from .forms import PrescriptionForm
+from .catalog import VOLATILE_FIELDS, with_catalog
+from .search import search_drugs, search_patients
+from .utils import dashboard_context
 from patients.models import PatientProfile
 from django.http import JsonResponse
 from django.db.models import Q
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404
 from django.http import HttpResponseForbidden
 from django.utils import timezone
+from django.db import transaction
 
 # Create your views here.
 def pharmacy_home(request):
-    pharmacy = PharmacyProfile.objects.get(user=request.user)
-    total_patients = PatientProfile.objects.filter(pharmacy=pharmacy).count()
+    pharmacy = request.pharmacy
 
-    # Exclude expired prescriptions from pending refills count
-    today = timezone.now().date()
-    pending_refills = Prescription.objects.filter(
-        refill_pending=True,
-        prescribed_by__pharmacy=pharmacy,
-        expiration_date__gt=today
-    ).count()
-
-    # Optimize drug queries - use single queryset for low stock
-    no_stock_drugs = Drug.objects.filter(status='out_of_stock', pharmacy=pharmacy)
-    low_stock_drugs = Drug.objects.filter(status='low_stock', pharmacy=pharmacy)
-    low_stock_count = low_stock_drugs.count()
-
-    # Use select_related to reduce database queries
-    # Exclude expired prescriptions
-    recent_prescriptions = Prescription.objects.filter(
-        prescribed_by__pharmacy=pharmacy,
-        expiration_date__gt=today
-    ).select_related('medicine', 'patient', 'prescribed_by').order_by('-prescribed_on')[:5]
-
-    recent_requests = Prescription.objects.filter(
-        prescribed_by__pharmacy=pharmacy,
-        refill_pending=True,
-        expiration_date__gt=today
-    ).select_related('medicine', 'patient', 'prescribed_by').order_by('-prescribed_on')[:5]
-
-    # Use prefetch_related for ManyToMany relationships
-    recent_threads = Thread.objects.filter(
-        participant=request.user
-    ).exclude(participant__role='system').prefetch_related('participant').order_by('-id')[:5]
-
-    # Add other_participants to each thread
-    for thread in recent_threads:
-        other_participants = thread.get_other_participants(request.user)
-        # Filter to only get patient participants
-        thread.other_participants = [p for p in other_participants if p.role == 'patient']
-
-    return render(request, 'pharmacy_home.html', {
-        'pharmacy': pharmacy,
-        'total_patients': total_patients,
-        'low_stock': low_stock_count,
-        'pending_refills': pending_refills,
-        'no_stock': no_stock_drugs,
-        'low_stock_drugs': low_stock_drugs,
-        'recent_prescriptions': recent_prescriptions,
-        'recent_threads': recent_threads,
-        'recent_requests': recent_requests
-    })
+    context = dashboard_context(pharmacy, request.user)
+    context['pharmacy'] = pharmacy
+    return render(request, 'pharmacy_home.html', context)
 
 @login_required
 def regenerate_code(request):
     if request.method == 'POST':
-        pharmacy = get_object_or_404(PharmacyProfile, user=request.user)
+        pharmacy = request.pharmacy
+        if pharmacy is None or request.user.role != 'pharmacy admin':
+            return HttpResponseForbidden("Only pharmacy admins can regenerate the join code.")
         new_code = generate_join_code()
 
         while PharmacyProfile.objects.filter(join_code=new_code).exists():
@@ -89,64 +51,16 @@ def regenerate_code(request):
 
 
 def pharmacist_home(request):
-    pharmacist = PharmacistProfile.objects.get(user=request.user)
-    pharmacy = pharmacist.pharmacy
-    total_patients = PatientProfile.objects.filter(pharmacy=pharmacy).count()
-
-    # Exclude expired prescriptions from pending refills count
-    today = timezone.now().date()
-    pending_refills = Prescription.objects.filter(
-        refill_pending=True,
-        prescribed_by__pharmacy=pharmacy,
-        expiration_date__gt=today
-    ).count()
+    pharmacist = request.pharmacist
 
-    # Optimize drug queries - use single queryset for low stock
-    no_stock_drugs = Drug.objects.filter(status='out_of_stock', pharmacy=pharmacy)
-    low_stock_drugs = Drug.objects.filter(status='low_stock', pharmacy=pharmacy)
-    low_stock_count = low_stock_drugs.count()
-
-    # Use select_related to reduce database queries
-    # Exclude expired prescriptions
-    recent_prescriptions = Prescription.objects.filter(
-        prescribed_by__pharmacy=pharmacy,
-        expiration_date__gt=today
-    ).select_related('medicine', 'patient', 'prescribed_by').order_by('-prescribed_on')[:5]
-
-    recent_requests = Prescription.objects.filter(
-        prescribed_by__pharmacy=pharmacy,
-        refill_pending=True,
-        expiration_date__gt=today
-    ).select_related('medicine', 'patient', 'prescribed_by').order_by('-prescribed_on')[:5]
-
-    # Use prefetch_related for ManyToMany relationships
-    recent_threads = Thread.objects.filter(
-        participant=request.user
-    ).exclude(participant__role='system').prefetch_related('participant').order_by('-id')[:5]
-
-    # Add other_participants to each thread
-    for thread in recent_threads:
-        other_participants = thread.get_other_participants(request.user)
-        # Filter to only get patient participants
-        thread.other_participants = [p for p in other_participants if p.role == 'patient']
-
-    return render(request, 'pharmacist_home.html', {
-        'pharmacist': pharmacist,
-        'total_patients': total_patients,
-        'low_stock': low_stock_count,
-        'pending_refills': pending_refills,
-        'no_stock': no_stock_drugs,
-        'low_stock_drugs': low_stock_drugs,
-        'recent_prescriptions': recent_prescriptions,
-        'recent_threads': recent_threads,
-        'recent_requests': recent_requests
-    })
+    context = dashboard_context(pharmacist.pharmacy, request.user)
+    context['pharmacist'] = pharmacist
+    return render(request, 'pharmacist_home.html', context)
 
 def create_prescriptions(request):
     form = PrescriptionForm(request.POST or None)
-    pharmacist = PharmacistProfile.objects.get(user=request.user)
-    pharmacy = PharmacyProfile.objects.get(user=request.user) if request.user.role == 'pharmacy admin' else pharmacist.pharmacy
-    pharmacists = CustomAccount.objects.filter(pharmacistprofile__pharmacy=pharmacy)
+    pharmacist = request.pharmacist
+    pharmacy = request.pharmacy
 
     if request.method == "POST":
         if form.is_valid():
@@ -155,104 +69,23 @@ def create_prescriptions(request):
             prescription.patient = form.cleaned_data['patient']
             prescription.medicine = form.cleaned_data['medicine']
 
-            medicine = Drug.objects.get(id=prescription.medicine.id)
-
-            if prescription.quantity > medicine.stock:
-                form.add_error('quantity', 'Not enough stock available.')
-                return render(request, 'create_prescriptions.html', {
-                    'form': form
-                })
-            
-            new_stock = medicine.stock - prescription.quantity
-
-            medicine.stock -= prescription.quantity
-            medicine.update_status()
-            medicine.save()
-            prescription.save()
-
-
-            system_user = CustomAccount.objects.get(role='system')
-            users = [system_user, pharmacy.user] + list(pharmacists) #list of users
-            thread = Thread.objects.create()
-            thread.participant.add(*users)
-            # Create notifications
-            if 1 <= new_stock <= 30:
-                msg = Message.objects.create(
-                    sender=system_user,
-                    thread=thread,
-                    content=f"{medicine.name} ({medicine.brand}) is running low.",
-                    link = reverse('drug_detail', args=[medicine.id])
-                )
-
-                for u in [pharmacy.user] + list(pharmacists):
-                    notification_obj = Notifications.objects.create(user=u, message=msg)
-
-                    if u.id != request.user.id:
-                        # Send notification with automatic unread counts
-                        send_notification_with_counts(
-                            user=u,
-                            notification_data={
-                                "id": notification_obj.id,
-                                "type": "low_stock",
-                                "sender": system_user.first_name,
-                                "thread_id": thread.id,
-                                "message_id": msg.id,
-                                "content": msg.content,
-                                "timestamp": timezone.localtime(msg.timestamp).strftime("%b %d, %I:%M %p"),
-                                "link": msg.link
-                            }
-                        )
-
-            elif new_stock == 0:
-                msg = Message.objects.create(
-                    sender=system_user,
-                    thread=thread,
-                    content=f"{medicine.name} ({medicine.brand}) is out of stock.",
-                    link = reverse('drug_detail', args=[medicine.id])
-                )
-
-                for u in [pharmacy.user] + list(pharmacists):
-                    notification_obj = Notifications.objects.create(user=u, message=msg)
-
-                    if u.id != request.user.id:
-                        # Send notification with automatic unread counts
-                        send_notification_with_counts(
-                            user=u,
-                            notification_data={
-                                "id": notification_obj.id,
-                                "type": "out_of_stock",
-                                "sender": system_user.first_name,
-                                "thread_id": thread.id,
-                                "message_id": msg.id,
-                                "content": msg.content,
-                                "timestamp": timezone.localtime(msg.timestamp).strftime("%b %d, %I:%M %p"),
-                                "link": msg.link
-                            }
-                        )
-            
-            msg = Message.objects.create(
-                sender=system_user,
-                thread=thread,
-                content= f"You have a new prescription.",
-                link=f"{reverse('patient_profile', args=[prescription.patient.id])}#prescription-{prescription.id}"
-            )
+            with transaction.atomic():
+                # Conditional UPDATE: no lost decrements under concurrent pharmacists
+                new_stock = Drug.objects.reserve_stock(prescription.medicine.id, prescription.quantity)
 
-            notification_obj = Notifications.objects.create(user=prescription.patient.user, message=msg)
-
-            # Send notification with automatic unread counts
-            send_notification_with_counts(
-                user=prescription.patient.user,
-                notification_data={
-                    "id": notification_obj.id,
-                    "type": "create_prescription",
-                    "sender": system_user.first_name,
-                    "thread_id": thread.id,
-                    "message_id": msg.id,
-                    "content": msg.content,
-                    "timestamp": timezone.localtime(msg.timestamp).strftime("%b %d, %I:%M %p"),
-                    "link": msg.link
-                }
-            )
+                if new_stock is None:
+                    form.add_error('quantity', 'Not enough stock available.')
+                    return render(request, 'create_prescriptions.html', {
+                        'form': form
+                    })
+
+                prescription.save()
+
+                # Stock alerts and the patient notification run in Celery after commit
+                transaction.on_commit(lambda: notify_prescription_created.delay(
+                    event_key('prescription_created', prescription.id),
+                    prescription.id, pharmacy.id, new_stock, request.user.id
+                ))
 
             messages.success(request, "Prescription created successfully.")
             return redirect(
@@ -269,70 +102,43 @@ def create_prescriptions(request):
     })
 
 def patient_search(request):
-    if request.user.role in ['pharmacist']:
-        pharmacist = PharmacistProfile.objects.get(user=request.user)
-        pharmacy = pharmacist.pharmacy
-    elif request.user.role in ['pharmacy admin']:
-        pharmacy = PharmacyProfile.objects.get(user=request.user)
-
-    if pharmacy:
-        pharmacy_patients = PatientProfile.objects.filter(pharmacy=pharmacy)
+    if request.user.role in ['pharmacist', 'pharmacy admin']:
+        pharmacy = request.pharmacy
     else:
-        pharmacy_patients = PatientProfile.objects.none()
+        return JsonResponse([], safe=False)
 
     query = request.GET.get('q', '').strip()
     email_mode = request.GET.get('email', '') == 'yes'
 
-    if query:
-        name_parts = query.split()
-        if len(name_parts) == 2:
-            first, last = name_parts
-            items = pharmacy_patients.filter(Q(first_name__icontains=first) & Q(last_name__icontains=last))
-        else:
-            items = pharmacy_patients.filter(Q(first_name__icontains=query)| Q(last_name__icontains=query) | Q(id__icontains=query)).order_by('first_name')[:10]
+    results= [
+        {
+            'first_name': item['first_name'],
+            'last_name': item['last_name'],
+            'id': item['user_id'] if email_mode else item['id'],
+            'email': item['email']
+        }
+        for item in search_patients(pharmacy, query)
+    ]
 
-        results= [{'first_name': item.first_name, 'last_name': item.last_name, 'id': item.user.id if email_mode else item.id, 'email': item.user.email} for item in items]
-    else:
-        results = []
-        
     return JsonResponse(results, safe=False)
 
 def medicine_search(request):
     # Get the pharmacy based on user role
-    if request.user.role == 'pharmacist':
-        pharmacist = PharmacistProfile.objects.get(user=request.user)
-        pharmacy = pharmacist.pharmacy
-    elif request.user.role == 'pharmacy admin':
-        pharmacy = PharmacyProfile.objects.get(user=request.user)
+    if request.user.role in ['pharmacist', 'pharmacy admin']:
+        pharmacy = request.pharmacy
     else:
         return JsonResponse([], safe=False)
 
-    # Filter drugs by pharmacy
-    drugs = Drug.objects.filter(pharmacy=pharmacy)
-
     query = request.GET.get('q', '').strip()
-    if query:
-        name_parts = query.split()
-        if len(name_parts) == 2:
-            generic, brand = name_parts
-            items = drugs.filter(Q(name__icontains=generic) & Q(brand__icontains=brand))
-        else:
-            items = drugs.filter(Q(name__icontains=query)| Q(brand__icontains=query) | Q(id__icontains=query)).order_by('name')[:10]
-
-        results= [{'name': item.name, 'brand': item.brand, 'id': item.id} for item in items]
-    else:
-        results = []
+    results= [{'name': item['name'], 'brand': item['brand'], 'id': item['id']} for item in search_drugs(pharmacy, query)]
 
     return JsonResponse(results, safe=False)
 
 
 
 def my_patients(request):
-    if request.user.role == 'pharmacist':
-        pharmacist = PharmacistProfile.objects.get(user=request.user)
-        pharmacy_profile = pharmacist.pharmacy
-    elif request.user.role == 'pharmacy admin':
-        pharmacy_profile = PharmacyProfile.objects.get(user=request.user)
+    if request.user.role in ['pharmacist', 'pharmacy admin']:
+        pharmacy_profile = request.pharmacy
     else:
         return HttpResponseForbidden("You don't have permission to view patients.")
 
@@ -346,7 +152,9 @@ def patient_profile(request, patient_id):
     patient = PatientProfile.objects.get(id=patient_id)
     # Exclude expired prescriptions
     today = timezone.now().date()
-    prescriptions = patient.prescription.all().filter(expiration_date__gt=today).with_latest_ordering()
+    prescriptions = patient.prescription.filter(expiration_date__gt=today).select_related(
+        'medicine', 'prescribed_by__pharmacy'
+    ).with_latest_ordering()
     return render(request, 'patient_profile.html', {
         'patient': patient,
         'prescriptions': prescriptions
@@ -355,23 +163,22 @@ def patient_profile(request, patient_id):
 @never_cache
 def inventory(request):
     # Get the pharmacy based on user role
-    if request.user.role == 'pharmacist':
-        pharmacist = PharmacistProfile.objects.get(user=request.user)
-        pharmacy = pharmacist.pharmacy
-    elif request.user.role == 'pharmacy admin':
-        pharmacy = PharmacyProfile.objects.get(user=request.user)
+    if request.user.role in ['pharmacist', 'pharmacy admin']:
+        pharmacy = request.pharmacy
     else:
         pharmacy = None
 
-    # Filter drugs by pharmacy
+    # Filter drugs by pharmacy, text fields come from the catalog cache
     if pharmacy:
-        drugs = Drug.objects.filter(pharmacy=pharmacy)
+        drugs = Drug.objects.filter(pharmacy=pharmacy).only(*VOLATILE_FIELDS).order_by('id')
     else:
         drugs = Drug.objects.none()
 
     paginator = Paginator(drugs, 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    if pharmacy:
+        page_obj.object_list = with_catalog(page_obj.object_list, pharmacy.id)
     return render(request, 'inventory.html', {
         'page_obj': page_obj
     })
@@ -379,16 +186,13 @@ def inventory(request):
 @never_cache
 def drug_detail(request, drug_id):
     # Get the pharmacy based on user role
-    if request.user.role == 'pharmacist':
-        pharmacist = PharmacistProfile.objects.get(user=request.user)
-        pharmacy = pharmacist.pharmacy
-    elif request.user.role == 'pharmacy admin':
-        pharmacy = PharmacyProfile.objects.get(user=request.user)
+    if request.user.role in ['pharmacist', 'pharmacy admin']:
+        pharmacy = request.pharmacy
     else:
         return HttpResponseForbidden("You don't have permission to view this drug.")
 
     # Verify the drug belongs to this pharmacy
-    drug_info = Drug.objects.filter(id=drug_id, pharmacy=pharmacy).all()
+    drug_info = with_catalog(Drug.objects.filter(id=drug_id, pharmacy=pharmacy).only(*VOLATILE_FIELDS), pharmacy.id)
 
     if not drug_info:
         return HttpResponseForbidden("This drug does not belong to your pharmacy.")
@@ -399,90 +203,51 @@ def drug_detail(request, drug_id):
 
 def resupply(request, drug_id):
     if request.method == 'POST':
-        pharmacy = PharmacyProfile.objects.get(user=request.user)
-        pharmacists = CustomAccount.objects.filter(pharmacistprofile__pharmacy=pharmacy)
-
-        medicine = Drug.objects.get(id=drug_id)
-
-        if medicine.stock <= 30:
-            medicine.resupply_pending = False
-            medicine.stock = 100
-            medicine.update_status()
-            medicine.save()
-
-            content = f"{medicine.name} ({medicine.brand}) has been resupplied."
-            link = reverse('drug_detail', args=[drug_id])
-
-            # Delete old resupply request notifications
-            Notifications.objects.filter(
-                drug=medicine,
-                content__icontains="resupply request"
-            ).delete()
-
-            for user in list(pharmacists):
-                notification_obj = Notifications.objects.create(
-                    user=user,
-                    content=content,
-                    link=link,
-                    drug=medicine
-                )
-
-                # Send notification with automatic unread counts
-                send_notification_with_counts(
-                    user=user,
-                    notification_data={
-                        "id": notification_obj.id,
-                        "type": "resupply",
-                        "content": content,
-                        "timestamp": timezone.localtime(notification_obj.time).strftime("%b %d, %I:%M %p"),
-                        "link": link
-                    }
-                )
-            messages.success(request, "Medication inventory successfully resupplied.")
-        else:
-            messages.info(request, "Stock is already sufficient.")
+        pharmacy = request.pharmacy
+
+        with transaction.atomic():
+            medicine = Drug.objects.select_for_update().get(id=drug_id)
+
+            if medicine.stock <= 30:
+                medicine.resupply_pending = False
+                medicine.stock = 100
+                medicine.resupply_count += 1
+                medicine.update_status()
+                medicine.save(update_fields=['resupply_pending', 'stock', 'status', 'resupply_count'])
+
+                # Pharmacist notifications run in Celery after commit, once per resupply cycle
+                transaction.on_commit(lambda: notify_drug_resupplied.delay(
+                    event_key('drug_resupplied', medicine.id, medicine.resupply_count), medicine.id, pharmacy.id
+                ))
+
+                messages.success(request, "Medication inventory successfully resupplied.")
+            else:
+                messages.info(request, "Stock is already sufficient.")
 
         return redirect(reverse('drug_detail', args=[medicine.id]))
 
 def contact_admin(request, drug_id):
-    pharmacist = PharmacistProfile.objects.get(user=request.user)
+    pharmacist = request.pharmacist
     pharmacy = pharmacist.pharmacy
 
-    medicine = Drug.objects.get(id=drug_id)
-    medicine.resupply_pending = True
-    medicine.save()
-
-    content = f"A resupply of {medicine.name} ({medicine.brand}) has been requested due to low inventory."
-    link = reverse('drug_detail', args=[drug_id])
-
-    notification_obj = Notifications.objects.create(
-        user=pharmacy.user,
-        content=content,
-        link=link,
-        drug=medicine
-    )
-
-    # Send notification with automatic unread counts
-    send_notification_with_counts(
-        user=pharmacy.user,
-        notification_data={
-            "id": notification_obj.id,
-            "type": "resupply_request",
-            "content": content,
-            "timestamp": timezone.localtime(notification_obj.time).strftime("%b %d, %I:%M %p"),
-            "link": link
-        }
-    )
+    with transaction.atomic():
+        # Locked so the cycle read is the one the request belongs to, not one a resupply is committing
+        medicine = Drug.objects.select_for_update().get(id=drug_id)
+        medicine.resupply_pending = True
+        medicine.save(update_fields=['resupply_pending'])
+
+        # Admin notification runs in Celery after commit; repeated requests before the resupply share a key
+        transaction.on_commit(lambda: notify_resupply_requested.delay(
+            event_key('resupply_requested', medicine.id, medicine.resupply_count), medicine.id, pharmacy.id
+        ))
 
     return redirect(reverse('drug_detail', args=[medicine.id]))
 
 def refill_form(request, prescription_id):
     old_prescription = Prescription.objects.get(id=prescription_id)
     patient = old_prescription.patient
-    pharmacist = PharmacistProfile.objects.get(user=request.user)
+    pharmacist = request.pharmacist
     pharmacy = pharmacist.pharmacy
-    pharmacists = CustomAccount.objects.filter(pharmacistprofile__pharmacy=pharmacy)
-    system_user = CustomAccount.objects.get(role='system')
 
     if request.method == 'POST':
         form = PrescriptionForm(request.POST, instance=old_prescription)
@@ -492,108 +257,21 @@ def refill_form(request, prescription_id):
             prescription.refill_pending = False
             prescription.refilled_on = timezone.now()
 
-            medicine = prescription.medicine
-
-            # Check stock first
-            if prescription.quantity > medicine.stock:
-                form.add_error('quantity', 'Not enough stock available.')
-                return render(request, 'create_prescriptions.html', {'form': form})
-            
-            new_stock = medicine.stock - prescription.quantity
-
-            # Reduce stock and save
-            medicine.stock -= prescription.quantity
-            medicine.update_status()
-            medicine.save()
-            prescription.save()
-
-            
-            users = [system_user, patient.user]
-            thread = Thread.objects.create()
-            thread.participant.add(*users)
-
-            if 1 <= new_stock <= 30:
-                msg = Message.objects.create(
-                    sender=system_user,
-                    thread=thread,
-                    content=f"{medicine.name} ({medicine.brand}) is running low.",
-                    link = reverse('drug_detail', args=[medicine.id])
-                )
-
-                for u in [pharmacy.user] + list(pharmacists):
-                    notification_obj = Notifications.objects.create(user=u, message=msg)
-
-                    if u.id != request.user.id:
-                        # Send notification with automatic unread counts
-                        send_notification_with_counts(
-                            user=u,
-                            notification_data={
-                                "id": notification_obj.id,
-                                "type": "low_stock",
-                                "sender": system_user.first_name,
-                                "thread_id": thread.id,
-                                "message_id": msg.id,
-                                "content": msg.content,
-                                "timestamp": timezone.localtime(msg.timestamp).strftime("%b %d, %I:%M %p"),
-                                "link": msg.link
-                            }
-                        )
-
-            elif new_stock == 0:
-                msg = Message.objects.create(
-                    sender=system_user,
-                    thread=thread,
-                    content=f"{medicine.name} ({medicine.brand}) is out of stock.",
-                    link = reverse('drug_detail', args=[medicine.id])
-                )
-
-                for u in [pharmacy.user] + list(pharmacists):
-                    notification_obj = Notifications.objects.create(user=u, message=msg)
-
-                    if u.id != request.user.id:
-                        # Send notification with automatic unread counts
-                        send_notification_with_counts(
-                            user=u,
-                            notification_data={
-                                "id": notification_obj.id,
-                                "type": "out_of_stock",
-                                "sender": system_user.first_name,
-                                "thread_id": thread.id,
-                                "message_id": msg.id,
-                                "content": msg.content,
-                                "timestamp": timezone.localtime(msg.timestamp).strftime("%b %d, %I:%M %p"),
-                                "link": msg.link
-                            }
-                        )
-                    
-
-            # Delete old refill request notifications for this prescription
-            Notifications.objects.filter(
-                prescription=old_prescription,
-                content__icontains="refill request"
-            ).delete()
-
-            content = f"A refill request has been fulfilled and is ready for pick up."
-            link = f"{reverse('patient_profile', args=[patient.id])}#prescription-{prescription.id}"
-
-            notification_obj = Notifications.objects.create(
-                user=patient.user,
-                content=content,
-                link=link,
-                prescription=prescription
-            )
+            with transaction.atomic():
+                # Check and reduce stock in one conditional UPDATE
+                new_stock = Drug.objects.reserve_stock(prescription.medicine_id, prescription.quantity)
 
-            # Send notification with automatic unread counts
-            send_notification_with_counts(
-                user=patient.user,
-                notification_data={
-                    "id": notification_obj.id,
-                    "type": "refill",
-                    "content": content,
-                    "timestamp": timezone.localtime(notification_obj.time).strftime("%b %d, %I:%M %p"),
-                    "link": link
-                }
-            )
+                if new_stock is None:
+                    form.add_error('quantity', 'Not enough stock available.')
+                    return render(request, 'create_prescriptions.html', {'form': form})
+
+                prescription.save()
+
+                # Stock alerts and the patient notification run in Celery after commit
+                transaction.on_commit(lambda: notify_prescription_refilled.delay(
+                    event_key('prescription_refilled', prescription.id, prescription.refilled_on),
+                    prescription.id, pharmacy.id, new_stock, request.user.id
+                ))
 
             return redirect(f"{reverse('patient_profile', args=[patient.id])}#prescription-{prescription.id}")
 
@@ -610,11 +288,8 @@ def refill_form(request, prescription_id):
 @never_cache
 def all_prescriptions(request):
     # Get the pharmacy based on user role
-    if request.user.role == 'pharmacist':
-        pharmacist = PharmacistProfile.objects.get(user=request.user)
-        pharmacy = pharmacist.pharmacy
-    elif request.user.role == 'pharmacy admin':
-        pharmacy = PharmacyProfile.objects.get(user=request.user)
+    if request.user.role in ['pharmacist', 'pharmacy admin']:
+        pharmacy = request.pharmacy
     else:
         return HttpResponseForbidden("You don't have permission to view prescriptions.")
 
@@ -623,7 +298,7 @@ def all_prescriptions(request):
     prescriptions = Prescription.objects.filter(
         prescribed_by__pharmacy=pharmacy,
         expiration_date__gt=today
-    ).select_related('medicine', 'patient', 'prescribed_by').order_by('-prescribed_on')
+    ).select_related('medicine', 'patient', 'prescribed_by__pharmacy').order_by('-prescribed_on')
 
     paginator = Paginator(prescriptions, 20)
     page_number = request.GET.get('page')
@@ -636,11 +311,8 @@ def all_prescriptions(request):
 @never_cache
 def all_refill_requests(request):
     # Get the pharmacy based on user role
-    if request.user.role == 'pharmacist':
-        pharmacist = PharmacistProfile.objects.get(user=request.user)
-        pharmacy = pharmacist.pharmacy
-    elif request.user.role == 'pharmacy admin':
-        pharmacy = PharmacyProfile.objects.get(user=request.user)
+    if request.user.role in ['pharmacist', 'pharmacy admin']:
+        pharmacy = request.pharmacy
     else:
         return HttpResponseForbidden("You don't have permission to view refill requests.")
 
@@ -650,7 +322,7 @@ def all_refill_requests(request):
         prescribed_by__pharmacy=pharmacy,
         refill_pending=True,
         expiration_date__gt=today
-    ).select_related('medicine', 'patient', 'prescribed_by').order_by('-prescribed_on')
+    ).select_related('medicine', 'patient', 'prescribed_by__pharmacy').order_by('-prescribed_on')
 
     paginator = Paginator(refill_requests, 20)
     page_number = request.GET.get('page')